@@ -1,43 +1,82 @@
 from flask import (
     Flask, request, jsonify, render_template,
-    g, redirect, session, send_from_directory, got_request_exception
+    g, redirect, session, send_from_directory, got_request_exception,
+    template_rendered, has_request_context
 )
 import os
 import json
 import logging
 import csv
 import uuid
-import requests
 import time
 import base64
 from datetime import datetime, timedelta, timezone
 import math
+import random
+import sys
 from urllib.parse import quote, urlparse
 import re
 import threading
+import queue
 import hmac
 import hashlib
 import secrets
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from zoneinfo import ZoneInfo
 from ipaddress import ip_address, ip_network
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import check_password_hash, generate_password_hash
-from cryptography.fernet import Fernet, InvalidToken
+from jinja2 import BaseLoader
 from flask import jsonify
 
 from compactador import compactar_plano
-from email_utils import enviar_email, enviar_email_com_anexo, enviar_email_simples
-from whatsapp_sender import schedule_whatsapp
-from backup_utils import criar_backup_criptografado, remover_backups_antigos
+from email_utils import enviar_email, enviar_email_com_anexo_bytes, enviar_email_simples
+from whatsapp_sender import AgendadorWhatsApp, DispatcherWhatsApp
+from ciclo_vida import CicloVida, restante
+from backup_utils import (
+    criar_backup_criptografado,
+    enviar_partes_backup,
+    planejar_partes_backup,
+    precisa_backup_completo,
+    remover_backups_antigos,
+)
+from obs_dependencias import MONITOR_DEPENDENCIAS, post_monitorado
+from obs_profiler import ProfilerRequisicoes
+from obs_logging import ObsJsonFormatter, configurar_log_assincrono, reiniciar_log_assincrono
+from obs_metrics import (
+    LATENCY_BUCKETS_MS,
+    ContadoresSharded,
+    HistogramasSharded,
+    MetricasMultiprocesso,
+    UltimosValoresSharded,
+    prometheus_contadores,
+    prometheus_histograma,
+    resumir_histogramas,
+)
+from asset_pipeline import (
+    IMAGE_MANIFEST_NAME,
+    IMAGE_VARIANT_FORMATS,
+    IMAGE_VARIANT_MIMETYPES,
+    carregar_manifesto_assets,
+    carregar_manifesto_imagens,
+    construir_pipeline_assets,
+    escolher_encoding_asset,
+    gerar_variantes_imagens,
+    indexar_fingerprints,
+    indexar_variantes_imagens,
+)
 
 from database import (
+    definir_observador_queries,
+    fingerprint_sql,
     init_db,
     salvar_order,
     buscar_order_por_id,
     marcar_order_processada,
     reservar_order_para_processamento,
     restaurar_order_para_pendente,
+    liberar_orders_processando_expiradas,
     registrar_falha_email,
     atualizar_order_afiliado,
     transacao_ja_processada,
@@ -47,7 +86,11 @@ from database import (
     obter_estatisticas,
     contar_pedidos_pagos_por_plano,
     agendar_whatsapp,
-    listar_whatsapp_pendentes,
+    reivindicar_whatsapp_pendentes,
+    segundos_ate_proximo_whatsapp_pendente,
+    abrir_conexao_listen,
+    aguardar_notificacoes,
+    WHATSAPP_QUEUE_CHANNEL,
     registrar_falha_whatsapp,
     incrementar_whatsapp_enviado,
     excluir_order,
@@ -64,7 +107,11 @@ from database import (
     backfill_analytics_from_orders,
     registrar_lead_upgrade_cliente,
     registrar_whatsapp_auto_agendamento,
+    listar_whatsapp_auto_agendados,
+    reivindicar_whatsapp_auto,
+    WHATSAPP_AUTO_CLAIM_LEASE_MINUTES,
     marcar_whatsapp_auto_enviado,
+    devolver_whatsapp_auto_para_agenda,
     registrar_falha_whatsapp_auto,
     registrar_quiz_submission,
     existe_quiz_submission,
@@ -75,12 +122,19 @@ from database import (
     criar_afiliado,
     atualizar_afiliado,
     excluir_afiliado,
+    obter_versao_afiliados,
     registrar_primeira_indicacao_afiliado,
     registrar_comissao_afiliado,
     registrar_backup_execucao,
+    atualizar_backup_execucao,
+    listar_entregas_backup_pendentes,
+    obter_estado_backup_anterior,
     listar_backups_execucao,
     adquirir_lock_backup_distribuido,
     liberar_lock_backup_distribuido,
+    adquirir_lock_lider_workers,
+    lock_lider_workers_ativo,
+    liberar_lock_lider_workers,
     buscar_conta_cliente_por_email,
     criar_ou_atualizar_conta_cliente,
     registrar_codigo_primeiro_acesso,
@@ -89,6 +143,7 @@ from database import (
     confirmar_senha_conta_cliente,
     forcar_reset_senha_conta_cliente,
     atualizar_ultimo_login_conta_cliente,
+    atualizar_ultimo_login_contas_cliente,
     listar_pedidos_pagos_por_email,
     listar_pedidos_acesso_por_email,
     buscar_ultimo_pedido_pago_por_email,
@@ -98,6 +153,7 @@ from database import (
     salvar_remember_token_cliente,
     limpar_remember_token_cliente,
     buscar_conta_cliente_por_remember_hash,
+    obter_versao_remember_tokens,
     conceder_bonus_indicacao_mes_gratis
 )
 
@@ -128,10 +184,78 @@ if not ADMIN_PASSWORD and not ADMIN_PASSWORD_HASH:
 # ======================================================
 
 APP_SKIP_DB_INIT = (os.environ.get("APP_SKIP_DB_INIT", "false").strip().lower() == "true")
-if APP_SKIP_DB_INIT:
-    print("[INFO] APP_SKIP_DB_INIT=true -> pulando init_db().", flush=True)
-else:
-    init_db()
+APP_WARMUP_ON_START = (os.environ.get("APP_WARMUP_ON_START", "true").strip().lower() == "true")
+# Depois de uma falha (ex.: banco fora), as requisicoes so disparam nova tentativa apos N segundos.
+APP_INIT_RETRY_SECONDS = max(0, int(os.environ.get("APP_INIT_RETRY_SECONDS", "10")))
+_APP_INIT_LOCK = threading.Lock()
+_APP_INIT_OK = False
+_APP_DB_OK = False
+_APP_INIT_FALHOU_EM = 0.0
+_INICIADOS = set()
+_INICIADOS_LOCK = threading.Lock()
+
+
+def _iniciar_uma_vez(nome):
+    """True so na primeira chamada com `nome` neste processo (starters de thread idempotentes)."""
+    with _INICIADOS_LOCK:
+        if nome in _INICIADOS:
+            return False
+        _INICIADOS.add(nome)
+        return True
+
+
+def inicializar_app():
+    """Pipeline de assets, schema do banco, backfill de analytics e workers: uma vez, no primeiro uso.
+
+    Nada disso roda no import, para o processo subir e responder rapido. Se algum passo
+    falhar, a proxima requisicao tenta de novo; init_db() concluido e as threads ja
+    iniciadas nao se repetem.
+    """
+    global _APP_INIT_OK, _APP_DB_OK, _APP_INIT_FALHOU_EM
+    if _APP_INIT_OK:
+        return
+    with _APP_INIT_LOCK:
+        if _APP_INIT_OK:
+            return
+        inicio = time.time()
+        iniciar_exportador_metricas()
+        try:
+            if _iniciar_uma_vez("asset_pipeline"):
+                inicializar_pipeline_assets()
+            if APP_SKIP_DB_INIT:
+                print("[INFO] APP_SKIP_DB_INIT=true -> pulando init_db().", flush=True)
+            elif not _APP_DB_OK:
+                init_db()
+                _APP_DB_OK = True
+            iniciar_backfill_analytics()
+            iniciar_workers_background()
+            if not BACKGROUND_WORKERS_ENABLED:
+                # Com workers, so o lider gera as variantes (iniciar_loops_background).
+                iniciar_variantes_imagens_background()
+        except Exception:
+            _APP_INIT_FALHOU_EM = time.time()
+            raise
+        _APP_INIT_OK = True
+        print(f"[INFO] Inicializacao concluida em {round((time.time() - inicio) * 1000, 2)}ms.", flush=True)
+
+
+# Nao dependem do banco nem dos workers: respondem sem esperar (nem disparar) a inicializacao.
+_CAMINHOS_SEM_INIT = ("/assets/", "/static/")
+_ROTAS_SEM_INIT = {"/healthz", "/favicon.ico"}
+
+
+@app.before_request
+def garantir_app_inicializado():
+    if _APP_INIT_OK:
+        return None
+    path = request.path or ""
+    if path in _ROTAS_SEM_INIT or path.startswith(_CAMINHOS_SEM_INIT):
+        return None
+    if _APP_INIT_FALHOU_EM and time.time() - _APP_INIT_FALHOU_EM < APP_INIT_RETRY_SECONDS:
+        return "Servico inicializando. Tente novamente em instantes.", 503, {"Retry-After": str(APP_INIT_RETRY_SECONDS)}
+    inicializar_app()
+    return None
+
 
 PASTA_SAIDA = "saida"
 os.makedirs(PASTA_SAIDA, exist_ok=True)
@@ -219,6 +343,16 @@ WHATSAPP_TEMPLATE = corrigir_texto_quebrado(os.environ.get(
 WA_SENDER_URL = os.environ.get("WA_SENDER_URL", "").strip()
 WA_SENDER_TOKEN = os.environ.get("WA_SENDER_TOKEN", "").strip()
 WHATSAPP_DELAY_MINUTES = int(os.environ.get("WHATSAPP_DELAY_MINUTES", "5"))
+WHATSAPP_QUEUE_SENDERS = max(1, int(os.environ.get("WHATSAPP_QUEUE_SENDERS", "2")))
+WHATSAPP_QUEUE_POLL_SECONDS = max(5, int(os.environ.get("WHATSAPP_QUEUE_POLL_SECONDS", "60")))
+WHATSAPP_QUEUE_LEASE_SECONDS = max(30, int(os.environ.get("WHATSAPP_QUEUE_LEASE_SECONDS", "120")))
+WHATSAPP_QUEUE_LISTEN_ENABLED = os.environ.get("WHATSAPP_QUEUE_LISTEN_ENABLED", "true").strip().lower() == "true"
+WHATSAPP_DISPATCH_BATCH_MAX = max(1, int(os.environ.get("WHATSAPP_DISPATCH_BATCH_MAX", "20")))
+WHATSAPP_DISPATCH_MAX_PENDING = max(1, int(os.environ.get("WHATSAPP_DISPATCH_MAX_PENDING", "200")))
+WHATSAPP_SCHEDULER_SENDERS = max(1, int(os.environ.get("WHATSAPP_SCHEDULER_SENDERS", "2")))
+WHATSAPP_SCHEDULER_MAX_IN_MEMORY = max(100, int(os.environ.get("WHATSAPP_SCHEDULER_MAX_IN_MEMORY", "5000")))
+WHATSAPP_SCHEDULER_HORIZON_SECONDS = max(60, int(os.environ.get("WHATSAPP_SCHEDULER_HORIZON_SECONDS", "900")))
+WHATSAPP_SCHEDULER_RELOAD_SECONDS = max(5, int(os.environ.get("WHATSAPP_SCHEDULER_RELOAD_SECONDS", "60")))
 WHATSAPP_AUTO_SEND = os.environ.get("WHATSAPP_AUTO_SEND", "true").strip().lower() == "true"
 WHATSAPP_GRAPH_VERSION = os.environ.get("WHATSAPP_GRAPH_VERSION", "v21.0").strip()
 WHATSAPP_PHONE_NUMBER_ID = os.environ.get("WHATSAPP_PHONE_NUMBER_ID", "").strip()
@@ -240,8 +374,32 @@ if not (os.environ.get("BACKUP_ENCRYPTION_PASSWORD") or "").strip():
     print("[SECURITY] BACKUP_ENCRYPTION_PASSWORD nao definido; usando ADMIN_SECRET como fallback.", flush=True)
 BACKUP_RETENTION_DAYS = int(os.environ.get("BACKUP_RETENTION_DAYS", "15"))
 BACKUP_WORKER_ENABLED = (os.environ.get("BACKUP_WORKER_ENABLED", "true").strip().lower() == "true")
+# "copy" exporta cada tabela via COPY TO STDOUT para o tar; "json" mantem o snapshot antigo.
+BACKUP_DB_EXPORT = (os.environ.get("BACKUP_DB_EXPORT", "copy").strip().lower() or "copy")
+BACKUP_DB_COPY_FORMAT = (os.environ.get("BACKUP_DB_COPY_FORMAT", "csv").strip().lower() or "csv")
+BACKUP_DB_EXPORT_WORKERS = max(1, min(8, int(os.environ.get("BACKUP_DB_EXPORT_WORKERS", "2"))))
+# Incremental: entre dois completos, so chunks de arquivo novos e linhas acima do watermark.
+# O completo precisa sair antes da retencao apagar o inicio da cadeia.
+BACKUP_INCREMENTAL_ENABLED = (os.environ.get("BACKUP_INCREMENTAL_ENABLED", "true").strip().lower() == "true")
+BACKUP_FULL_EVERY_DAYS = max(1, min(int(os.environ.get("BACKUP_FULL_EVERY_DAYS", "7")), BACKUP_RETENTION_DAYS - 1))
+# Entrega por e-mail em partes (cada uma vira um anexo base64 no JSON do Apps Script).
+BACKUP_EMAIL_PART_MAX_MB = max(1, int(os.environ.get("BACKUP_EMAIL_PART_MAX_MB", "15")))
+BACKUP_EMAIL_WORKERS = max(1, min(4, int(os.environ.get("BACKUP_EMAIL_WORKERS", "2"))))
+BACKUP_EMAIL_RETRIES = max(1, int(os.environ.get("BACKUP_EMAIL_RETRIES", "3")))
+# Entrega em SENDING ha mais tempo que isso (processo morto no meio) e retomada no proximo backup.
+BACKUP_SENDING_STALE_MINUTES = max(1, int(os.environ.get("BACKUP_SENDING_STALE_MINUTES", "30")))
 _backup_lock = threading.Lock()
 BACKGROUND_WORKERS_ENABLED = (os.environ.get("BACKGROUND_WORKERS_ENABLED", "true").strip().lower() == "true")
+# Com varios processos (gunicorn), so o lider eleito por advisory lock roda os loops de WhatsApp e backup.
+WORKERS_LEADER_ELECTION_ENABLED = (os.environ.get("WORKERS_LEADER_ELECTION_ENABLED", "true").strip().lower() == "true")
+WORKERS_LEADER_RETRY_SECONDS = max(5, int(os.environ.get("WORKERS_LEADER_RETRY_SECONDS", "30")))
+# Prazo para drenar filas e buffers no SIGTERM; deve caber no GUNICORN_GRACEFUL_TIMEOUT.
+SHUTDOWN_DRAIN_SECONDS = max(1, int(os.environ.get("SHUTDOWN_DRAIN_SECONDS", "20")))
+# Pedido preso em PROCESSANDO (processo morto no meio do webhook) volta a PENDENTE apos esse tempo.
+ORDER_PROCESSING_LEASE_MINUTES = max(1, int(os.environ.get("ORDER_PROCESSING_LEASE_MINUTES", "15")))
+CICLO_VIDA = CicloVida(prazo_segundos=SHUTDOWN_DRAIN_SECONDS)
+# Setado no inicio do encerramento: webhooks recebem 503 e os loops param de pegar trabalho novo.
+_ENCERRANDO = CICLO_VIDA.encerrando
 
 # ======================================================
 # OBSERVABILIDADE
@@ -270,36 +428,102 @@ logging.basicConfig(
 )
 OBS_LOGGER = logging.getLogger("trx.observability")
 OBS_LOGGER.setLevel(getattr(logging, OBS_LOG_LEVEL, logging.INFO))
+OBS_LOG_ASYNC_ENABLED = (os.environ.get("OBS_LOG_ASYNC_ENABLED", "true").strip().lower() == "true")
+OBS_LOG_QUEUE_MAX = _parse_int_env("OBS_LOG_QUEUE_MAX", 10000, minimum=100, maximum=1000000)
+OBS_LOG_BATCH_MAX = _parse_int_env("OBS_LOG_BATCH_MAX", 256, minimum=1, maximum=10000)
+OBS_LOG_HANDLER = None
+OBS_LOG_WRITER = None
+if OBS_LOG_ASYNC_ENABLED:
+    # json.dumps e a escrita no stdout saem da thread da requisicao; fila cheia descarta e conta.
+    OBS_LOG_HANDLER, OBS_LOG_WRITER = configurar_log_assincrono(
+        OBS_LOGGER,
+        stream=sys.stderr,
+        max_fila=OBS_LOG_QUEUE_MAX,
+        lote_max=OBS_LOG_BATCH_MAX,
+    )
+else:
+    _obs_stream_handler = logging.StreamHandler()
+    _obs_stream_handler.setFormatter(ObsJsonFormatter())
+    OBS_LOGGER.handlers = [_obs_stream_handler]
+    OBS_LOGGER.propagate = False
 
 OBS_ALERTS_ENABLED = (os.environ.get("OBS_ALERTS_ENABLED", "true").strip().lower() == "true")
 OBS_ALERT_WEBHOOK_URL = (os.environ.get("OBS_ALERT_WEBHOOK_URL") or "").strip()
 OBS_ALERT_EMAIL_TO = (os.environ.get("OBS_ALERT_EMAIL_TO") or "").strip()
 OBS_ALERT_WHATSAPP_TO = (os.environ.get("OBS_ALERT_WHATSAPP_TO") or "").strip()
 OBS_ALERT_COOLDOWN_SECONDS = _parse_int_env("OBS_ALERT_COOLDOWN_SECONDS", 300, minimum=30, maximum=86400)
+OBS_ALERT_QUEUE_MAX = _parse_int_env("OBS_ALERT_QUEUE_MAX", 200, minimum=10, maximum=10000)
+OBS_ALERT_DIGEST_WINDOW_SECONDS = _parse_int_env("OBS_ALERT_DIGEST_WINDOW_SECONDS", 60, minimum=1, maximum=3600)
+OBS_ALERT_DIGEST_MAX_ITEMS = _parse_int_env("OBS_ALERT_DIGEST_MAX_ITEMS", 20, minimum=1, maximum=200)
+OBS_ALERT_CHANNEL_CONCURRENCY = _parse_int_env("OBS_ALERT_CHANNEL_CONCURRENCY", 1, minimum=1, maximum=8)
 OBS_INCIDENT_LIMIT = _parse_int_env("OBS_INCIDENT_LIMIT", 120, minimum=20, maximum=500)
 OBS_REQUEST_LOG_ENABLED = (os.environ.get("OBS_REQUEST_LOG_ENABLED", "true").strip().lower() == "true")
+try:
+    OBS_REQUEST_LOG_SAMPLE_2XX = min(1.0, max(0.0, float(os.environ.get("OBS_REQUEST_LOG_SAMPLE_2XX", "1"))))
+except ValueError:
+    OBS_REQUEST_LOG_SAMPLE_2XX = 1.0
+OBS_REQUEST_LOG_SLOW_MS = _parse_int_env("OBS_REQUEST_LOG_SLOW_MS", 1000, minimum=0, maximum=600000)
 OBS_WORKER_STALE_SECONDS_WHATSAPP = _parse_int_env("OBS_WORKER_STALE_SECONDS_WHATSAPP", 150, minimum=60, maximum=3600)
 OBS_WORKER_STALE_SECONDS_BACKUP = _parse_int_env("OBS_WORKER_STALE_SECONDS_BACKUP", 172800, minimum=3600, maximum=604800)
 OBS_ALERT_COMPONENTS = {"webhook", "email", "whatsapp"}
 
 OBS_START_EPOCH = time.time()
 OBS_LOCK = threading.Lock()
-OBS_COUNTERS = defaultdict(int)
+# Contadores, ultima request e estado dos componentes ficam em shards por thread
+# (sem OBS_LOCK no caminho de cada request) e so sao somados em obs_health_payload.
+OBS_COUNTERS = ContadoresSharded()
 OBS_INCIDENTS = deque(maxlen=OBS_INCIDENT_LIMIT)
 OBS_ALERT_LAST_SENT = {}
-OBS_LAST_REQUEST = {
+OBS_LAST_REQUEST = UltimosValoresSharded()
+OBS_LAST_REQUEST_EMPTY = {
     "method": None,
     "path": None,
     "status": None,
     "latency_ms": None,
     "at": None,
 }
-OBS_COMPONENTS = {
-    "webhook": {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None},
-    "email": {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None},
-    "whatsapp": {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None},
-    "database": {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None},
-    "http": {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None},
+OBS_COMPONENTS = ("webhook", "email", "whatsapp", "database", "http")
+OBS_COMPONENT_STATE = UltimosValoresSharded()
+OBS_METRICS_TOKEN = (os.environ.get("OBS_METRICS_TOKEN") or "").strip()
+OBS_HTTP_LATENCY_LABELS = ("route", "method", "status_class")
+OBS_HTTP_LATENCY = HistogramasSharded(LATENCY_BUCKETS_MS)
+OBS_DB_INSTRUMENTATION_ENABLED = (os.environ.get("OBS_DB_INSTRUMENTATION_ENABLED", "true").strip().lower() == "true")
+OBS_DB_SLOW_QUERY_MS = _parse_int_env("OBS_DB_SLOW_QUERY_MS", 250, minimum=1, maximum=600000)
+OBS_DB_TOP_QUERIES = _parse_int_env("OBS_DB_TOP_QUERIES", 15, minimum=1, maximum=100)
+# Tempo e contagem de queries revelam caminho de codigo (ex.: se uma conta existe no login); mesmo
+# ligado, o header so sai para admin ou para quem traz o OBS_METRICS_TOKEN.
+OBS_SERVER_TIMING_ENABLED = (os.environ.get("OBS_SERVER_TIMING_ENABLED", "false").strip().lower() == "true")
+try:
+    OBS_PROFILER_SAMPLE_RATE = min(1.0, max(0.0, float(os.environ.get("OBS_PROFILER_SAMPLE_RATE", "0"))))
+except ValueError:
+    OBS_PROFILER_SAMPLE_RATE = 0.0
+OBS_PROFILER_MAX_PROFILES = _parse_int_env("OBS_PROFILER_MAX_PROFILES", 20, minimum=1, maximum=200)
+OBS_PROFILER_HEADER = "X-Profile-Request"
+OBS_PROFILER_QUERY_FLAG = "_profile"
+# Com varios processos (workers do gunicorn) cada um tem os proprios contadores, histogramas e
+# perfis. OBS_SHARED_DIR (gunicorn.conf.py define um por execucao do master) guarda o snapshot de
+# cada processo e os perfis, para o /metrics e o admin enxergarem todos. Vazio: so o processo atual.
+OBS_SHARED_DIR = (os.environ.get("OBS_SHARED_DIR") or "").strip()
+OBS_METRICS_FLUSH_SECONDS = _parse_int_env("OBS_METRICS_FLUSH_SECONDS", 5, minimum=1, maximum=300)
+OBS_PROFILER = ProfilerRequisicoes(
+    max_perfis=OBS_PROFILER_MAX_PROFILES,
+    raiz=os.path.dirname(os.path.abspath(__file__)),
+    diretorio=os.path.join(OBS_SHARED_DIR, "profiles") if OBS_SHARED_DIR else None,
+)
+OBS_DB_QUERIES = HistogramasSharded(LATENCY_BUCKETS_MS)
+OBS_DEPENDENCY_ERROR_RATE = _parse_int_env("OBS_DEPENDENCY_ERROR_RATE_PERCENT", 25, minimum=1, maximum=100) / 100
+OBS_DEPENDENCY_MIN_CALLS = _parse_int_env("OBS_DEPENDENCY_MIN_CALLS", 5, minimum=1, maximum=1000)
+# p95 na janela acima disto marca a dependencia como lenta (antes de comecar a falhar).
+OBS_DEPENDENCY_SLOW_MS = {
+    nome: _parse_int_env(f"OBS_DEPENDENCY_SLOW_MS_{nome.upper()}", padrao, minimum=50, maximum=120000)
+    for nome, padrao in (
+        ("infinitepay_checkout", 3000),
+        ("apps_script_email", 10000),
+        ("graph_api", 3000),
+        ("wa_sender", 3000),
+        ("wa_sender_batch", 8000),
+        ("alert_webhook", 3000),
+    )
 }
 OBS_WORKERS = {
     "whatsapp_worker": {"last_heartbeat_at": None, "last_error_at": None, "last_error": None},
@@ -320,20 +544,23 @@ def obs_json_default(value):
 
 
 def obs_log(level, event, **fields):
-    payload = {
-        "ts": obs_now_iso(),
-        "event": event,
-    }
+    if not OBS_LOGGER.isEnabledFor(level):
+        return
+    # "ts" e a serializacao JSON ficam a cargo do ObsJsonFormatter (na thread de escrita).
+    payload = {"event": event}
     for key, value in fields.items():
         if value is not None:
             payload[key] = value
 
-    OBS_LOGGER.log(level, json.dumps(payload, ensure_ascii=False, default=obs_json_default))
+    OBS_LOGGER.log(level, payload)
+
+
+def obs_log_descartados():
+    return OBS_LOG_HANDLER.descartados if OBS_LOG_HANDLER is not None else 0
 
 
 def obs_increment(metric, amount=1):
-    with OBS_LOCK:
-        OBS_COUNTERS[metric] += int(amount)
+    OBS_COUNTERS.incrementar(metric, int(amount))
 
 
 def obs_record_incident(component, error_message, context=None):
@@ -351,15 +578,8 @@ def obs_record_incident(component, error_message, context=None):
 
 
 def obs_mark_success(component, context=None):
-    now_iso = obs_now_iso()
-    with OBS_LOCK:
-        status = OBS_COMPONENTS.setdefault(
-            component,
-            {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None}
-        )
-        status["success"] += 1
-        status["last_success_at"] = now_iso
-        OBS_COUNTERS[f"{component}.success"] += 1
+    OBS_COUNTERS.incrementar(f"{component}.success")
+    OBS_COMPONENT_STATE.registrar((component, "last_success_at"), obs_now_iso())
     if context:
         obs_log(logging.INFO, "component_success", component=component, **context)
 
@@ -367,21 +587,36 @@ def obs_mark_success(component, context=None):
 def _obs_send_alert_webhook(payload):
     if not OBS_ALERT_WEBHOOK_URL:
         return "disabled"
-    response = requests.post(OBS_ALERT_WEBHOOK_URL, json=payload, timeout=10)
+    response = post_monitorado("alert_webhook", OBS_ALERT_WEBHOOK_URL, json=payload, timeout=10)
     response.raise_for_status()
     return "sent"
 
 
+def _obs_texto_digest(payload, limite_erro=200):
+    linhas = [
+        f"{payload.get('count')} incidentes entre {payload.get('first_at')} e {payload.get('at')} (UTC)"
+    ]
+    for item in payload.get("alerts") or []:
+        linhas.append(f"- [{item.get('component')}] {item.get('at')}: {(item.get('error') or '')[:limite_erro]}")
+    if payload.get("omitted"):
+        linhas.append(f"... e mais {payload.get('omitted')} incidentes omitidos")
+    return "\n".join(linhas)
+
+
 def _obs_send_alert_email(payload):
     if not OBS_ALERT_EMAIL_TO:
         return "disabled"
-    assunto = f"[ALERTA TRX] Falha em {payload.get('component')}"
-    mensagem = (
-        f"Componente: {payload.get('component')}\n"
-        f"Erro: {payload.get('error')}\n"
-        f"Horário UTC: {payload.get('at')}\n"
-        f"Contexto: {json.dumps(payload.get('context') or {}, ensure_ascii=False, default=obs_json_default)}\n"
-    )
+    if payload.get("digest"):
+        assunto = f"[ALERTA TRX] {payload.get('count')} falhas em {payload.get('component')}"
+        mensagem = _obs_texto_digest(payload) + "\n"
+    else:
+        assunto = f"[ALERTA TRX] Falha em {payload.get('component')}"
+        mensagem = (
+            f"Componente: {payload.get('component')}\n"
+            f"Erro: {payload.get('error')}\n"
+            f"Horário UTC: {payload.get('at')}\n"
+            f"Contexto: {json.dumps(payload.get('context') or {}, ensure_ascii=False, default=obs_json_default)}\n"
+        )
     enviar_email_simples(
         destinatario=OBS_ALERT_EMAIL_TO,
         assunto=assunto,
@@ -394,12 +629,15 @@ def _obs_send_alert_whatsapp(payload):
     if not OBS_ALERT_WHATSAPP_TO:
         return "disabled"
 
-    mensagem = (
-        "[ALERTA TRX]\n"
-        f"Componente: {payload.get('component')}\n"
-        f"Erro: {payload.get('error')}\n"
-        f"UTC: {payload.get('at')}"
-    )
+    if payload.get("digest"):
+        mensagem = "[ALERTA TRX]\n" + _obs_texto_digest(payload, limite_erro=120)
+    else:
+        mensagem = (
+            "[ALERTA TRX]\n"
+            f"Componente: {payload.get('component')}\n"
+            f"Erro: {payload.get('error')}\n"
+            f"UTC: {payload.get('at')}"
+        )
 
     numero = formatar_telefone_whatsapp(OBS_ALERT_WHATSAPP_TO)
 
@@ -419,7 +657,7 @@ def _obs_send_alert_whatsapp(payload):
             "type": "text",
             "text": {"preview_url": False, "body": mensagem},
         }
-        response = requests.post(url, json=payload_api, headers=headers, timeout=20)
+        response = post_monitorado("graph_api", url, json=payload_api, headers=headers, timeout=20)
         response.raise_for_status()
         return "sent"
 
@@ -433,48 +671,198 @@ def _obs_send_alert_whatsapp(payload):
             "message": mensagem,
             "order_id": f"alert-{payload.get('id')}",
         }
-        response = requests.post(WA_SENDER_URL, json=payload_api, headers=headers, timeout=20)
+        response = post_monitorado("wa_sender", WA_SENDER_URL, json=payload_api, headers=headers, timeout=20)
         response.raise_for_status()
         return "sent"
 
     raise RuntimeError("Canal WhatsApp de alerta nao configurado.")
 
 
-def _obs_dispatch_alert(payload):
-    canais = {
-        "webhook": _obs_send_alert_webhook,
-        "email": _obs_send_alert_email,
-        "whatsapp": _obs_send_alert_whatsapp,
+def _obs_montar_digest(payloads, omitidos=0):
+    if len(payloads) == 1 and not omitidos:
+        return payloads[0]
+    componentes = sorted({item.get("component") or "-" for item in payloads})
+    return {
+        "id": uuid.uuid4().hex[:12],
+        "digest": True,
+        "at": payloads[-1].get("at"),
+        "first_at": payloads[0].get("at"),
+        "component": ",".join(componentes),
+        "count": len(payloads) + omitidos,
+        "omitted": omitidos,
+        "error": f"{len(payloads) + omitidos} incidentes agrupados",
+        "alerts": [
+            {key: item.get(key) for key in ("id", "at", "component", "error", "context")}
+            for item in payloads
+        ],
+        "environment": payloads[-1].get("environment"),
     }
-    resultados = {}
 
-    for canal, sender in canais.items():
+
+class DespachanteAlertas:
+    """Fila limitada de alertas com envio por canal e digest por janela.
+
+    O primeiro alerta de um canal sai na hora; os seguintes dentro da janela
+    (ou enquanto o canal ainda esta ocupado) viram uma unica mensagem de digest.
+    """
+
+    def __init__(self, canais, janela_segundos, max_fila, max_itens_digest, concorrencia_canal):
+        self.canais = canais
+        self.janela_segundos = janela_segundos
+        self.max_itens_digest = max_itens_digest
+        self.concorrencia_canal = concorrencia_canal
+        self.fila = queue.Queue(maxsize=max_fila)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._drenando = False
+        self._estado = {
+            canal: {"buffer": [], "omitidos": 0, "ultimo_envio": 0.0, "em_voo": 0}
+            for canal in canais
+        }
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, len(canais) * concorrencia_canal),
+            thread_name_prefix="obs-alert"
+        )
+
+    def enfileirar(self, payload):
+        try:
+            self.fila.put_nowait(payload)
+        except queue.Full:
+            obs_increment("alerts.dropped")
+            return False
+        self._garantir_thread()
+        return True
+
+    def _garantir_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="obs-alert-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                payload = self.fila.get(timeout=self._proxima_espera())
+            except queue.Empty:
+                payload = None
+
+            if payload is not None:
+                self._bufferizar(payload)
+
+            self._liberar_canais()
+
+    def _bufferizar(self, payload):
+        with self._lock:
+            for canal, (habilitado, _) in self.canais.items():
+                if not habilitado():
+                    continue
+                estado = self._estado[canal]
+                if len(estado["buffer"]) >= self.max_itens_digest:
+                    estado["omitidos"] += 1
+                    obs_increment("alerts.coalesced")
+                else:
+                    estado["buffer"].append(payload)
+
+    def _proxima_espera(self):
+        agora = time.time()
+        espera = self.janela_segundos
+        with self._lock:
+            for estado in self._estado.values():
+                if estado["buffer"] and estado["em_voo"] < self.concorrencia_canal:
+                    espera = min(espera, max(0.05, estado["ultimo_envio"] + self.janela_segundos - agora))
+        return espera
+
+    def _liberar_canais(self):
+        agora = time.time()
+        envios = []
+        with self._lock:
+            for canal, estado in self._estado.items():
+                if not estado["buffer"] or estado["em_voo"] >= self.concorrencia_canal:
+                    continue
+                if not self._drenando and agora - estado["ultimo_envio"] < self.janela_segundos:
+                    continue
+                if len(estado["buffer"]) > 1 or estado["omitidos"]:
+                    obs_increment("alerts.digests")
+                envios.append((canal, _obs_montar_digest(estado["buffer"], estado["omitidos"])))
+                estado["buffer"] = []
+                estado["omitidos"] = 0
+                estado["ultimo_envio"] = agora
+                estado["em_voo"] += 1
+
+        for canal, payload in envios:
+            self._pool.submit(self._enviar_canal, canal, payload)
+
+    def _enviar_canal(self, canal, payload):
+        _, sender = self.canais[canal]
         try:
-            resultados[canal] = sender(payload)
+            resultado = sender(payload)
+            obs_increment("alerts.sent")
+            obs_log(
+                logging.WARNING,
+                "alert_dispatch_result",
+                component=payload.get("component"),
+                channel=canal,
+                success=True,
+                result=resultado,
+                alerts=payload.get("count") or 1,
+            )
         except Exception as exc:
-            resultados[canal] = f"error: {exc}"
+            obs_increment("alerts.failed")
             obs_log(
                 logging.ERROR,
                 "alert_channel_error",
                 component=payload.get("component"),
                 channel=canal,
-                error=str(exc)
+                error=str(exc),
+                alerts=payload.get("count") or 1,
             )
+        finally:
+            with self._lock:
+                self._estado[canal]["em_voo"] -= 1
+            try:
+                # Acorda o loop para liberar o digest acumulado enquanto o canal estava ocupado.
+                self.fila.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def pendentes(self):
+        with self._lock:
+            return self.fila.qsize() + sum(len(estado["buffer"]) for estado in self._estado.values())
+
+    def drenar(self, timeout):
+        """No encerramento: envia fila e buffers sem esperar a janela do digest e aguarda os envios."""
+        self._drenando = True
+        limite = time.monotonic() + max(0.0, timeout)
+        while True:
+            try:
+                payload = self.fila.get_nowait()
+            except queue.Empty:
+                payload = None
+            if payload is not None:
+                self._bufferizar(payload)
+            self._liberar_canais()
+            with self._lock:
+                ocioso = self.fila.empty() and not any(
+                    estado["buffer"] or estado["em_voo"] for estado in self._estado.values()
+                )
+            if ocioso:
+                return True
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
 
-    sucesso = any(resultado == "sent" for resultado in resultados.values())
-    with OBS_LOCK:
-        if sucesso:
-            OBS_COUNTERS["alerts.sent"] += 1
-        else:
-            OBS_COUNTERS["alerts.failed"] += 1
 
-    obs_log(
-        logging.WARNING if sucesso else logging.ERROR,
-        "alert_dispatch_result",
-        component=payload.get("component"),
-        success=sucesso,
-        channels=resultados
-    )
+OBS_ALERT_DISPATCHER = DespachanteAlertas(
+    canais={
+        "webhook": (lambda: bool(OBS_ALERT_WEBHOOK_URL), _obs_send_alert_webhook),
+        "email": (lambda: bool(OBS_ALERT_EMAIL_TO), _obs_send_alert_email),
+        "whatsapp": (lambda: bool(OBS_ALERT_WHATSAPP_TO), _obs_send_alert_whatsapp),
+    },
+    janela_segundos=OBS_ALERT_DIGEST_WINDOW_SECONDS,
+    max_fila=OBS_ALERT_QUEUE_MAX,
+    max_itens_digest=OBS_ALERT_DIGEST_MAX_ITEMS,
+    concorrencia_canal=OBS_ALERT_CHANNEL_CONCURRENCY,
+)
 
 
 def obs_alert(component, error_message, context=None):
@@ -491,10 +879,9 @@ def obs_alert(component, error_message, context=None):
         if now_epoch - last_sent >= OBS_ALERT_COOLDOWN_SECONDS:
             OBS_ALERT_LAST_SENT[fingerprint] = now_epoch
             should_send = True
-        else:
-            OBS_COUNTERS["alerts.suppressed"] += 1
 
     if not should_send:
+        obs_increment("alerts.suppressed")
         obs_log(
             logging.INFO,
             "alert_suppressed",
@@ -512,22 +899,15 @@ def obs_alert(component, error_message, context=None):
         "environment": (os.environ.get("APP_ENV") or os.environ.get("ENV") or "production"),
     }
 
-    threading.Thread(target=_obs_dispatch_alert, args=(payload,), daemon=True).start()
+    OBS_ALERT_DISPATCHER.enfileirar(payload)
 
 
 def obs_mark_error(component, error, context=None, alert=True):
     now_iso = obs_now_iso()
     error_message = str(error) if isinstance(error, Exception) else str(error or "erro_desconhecido")
 
-    with OBS_LOCK:
-        status = OBS_COMPONENTS.setdefault(
-            component,
-            {"success": 0, "errors": 0, "last_success_at": None, "last_error_at": None, "last_error": None}
-        )
-        status["errors"] += 1
-        status["last_error_at"] = now_iso
-        status["last_error"] = error_message[:500]
-        OBS_COUNTERS[f"{component}.errors"] += 1
+    OBS_COUNTERS.incrementar(f"{component}.errors")
+    OBS_COMPONENT_STATE.registrar((component, "last_error"), (now_iso, error_message[:500]))
 
     incident = obs_record_incident(component=component, error_message=error_message, context=context)
     obs_log(
@@ -551,7 +931,7 @@ def obs_worker_heartbeat(worker_name):
             {"last_heartbeat_at": None, "last_error_at": None, "last_error": None}
         )
         worker["last_heartbeat_at"] = now_iso
-        OBS_COUNTERS[f"{worker_name}.heartbeat"] += 1
+    obs_increment(f"{worker_name}.heartbeat")
 
 
 def obs_worker_error(worker_name, error):
@@ -564,7 +944,7 @@ def obs_worker_error(worker_name, error):
         )
         worker["last_error_at"] = now_iso
         worker["last_error"] = error_message[:500]
-        OBS_COUNTERS[f"{worker_name}.errors"] += 1
+    obs_increment(f"{worker_name}.errors")
     obs_log(logging.ERROR, "worker_error", worker=worker_name, error=error_message[:500])
 
 
@@ -594,16 +974,33 @@ def _format_uptime(seconds_total):
     return " ".join(partes)
 
 
+def obs_componentes(counters):
+    estado = OBS_COMPONENT_STATE.snapshot()
+    nomes = list(OBS_COMPONENTS)
+    nomes += sorted({nome for nome, _ in estado} - set(OBS_COMPONENTS))
+    componentes = {}
+    for nome in nomes:
+        last_error_at, last_error = estado.get((nome, "last_error")) or (None, None)
+        componentes[nome] = {
+            "success": counters.get(f"{nome}.success", 0),
+            "errors": counters.get(f"{nome}.errors", 0),
+            "last_success_at": estado.get((nome, "last_success_at")),
+            "last_error_at": last_error_at,
+            "last_error": last_error,
+        }
+    return componentes
+
+
 def obs_health_payload(include_incidents=False):
     now_epoch = time.time()
     db_ok, db_stats, db_error = obs_check_database()
 
+    counters = OBS_COUNTERS.snapshot()
+    components = obs_componentes(counters)
+    last_request = dict(OBS_LAST_REQUEST.snapshot().get("http") or OBS_LAST_REQUEST_EMPTY)
     with OBS_LOCK:
-        counters = dict(OBS_COUNTERS)
-        components = {nome: dict(info) for nome, info in OBS_COMPONENTS.items()}
         workers = {nome: dict(info) for nome, info in OBS_WORKERS.items()}
         incidents = [dict(item) for item in OBS_INCIDENTS]
-        last_request = dict(OBS_LAST_REQUEST)
 
     for worker_name, worker_data in workers.items():
         threshold = OBS_WORKER_STALE_SECONDS_BACKUP if worker_name == "backup_worker" else OBS_WORKER_STALE_SECONDS_WHATSAPP
@@ -626,9 +1023,13 @@ def obs_health_payload(include_incidents=False):
         if now_epoch - float(item.get("epoch") or 0) <= recent_window_seconds
     ]
 
+    dependencies = obs_resumo_dependencias()
+
     status = "ok"
     if not db_ok:
         status = "degraded"
+    if any(info.get("failing") for info in dependencies.values()):
+        status = "degraded"
     if any(info.get("stale") for info in workers.values()):
         status = "degraded"
     if any(item.get("component") in OBS_ALERT_COMPONENTS for item in recent_incidents):
@@ -651,16 +1052,205 @@ def obs_health_payload(include_incidents=False):
             "last_request": last_request,
         },
         "components": components,
+        "dependencies": dependencies,
         "workers": workers,
+        "logging": {
+            "async": OBS_LOG_HANDLER is not None,
+            "queued": OBS_LOG_HANDLER.queue.qsize() if OBS_LOG_HANDLER is not None else 0,
+            "dropped": obs_log_descartados(),
+            "sample_2xx": OBS_REQUEST_LOG_SAMPLE_2XX,
+        },
+        "alerts": {
+            "pending": OBS_ALERT_DISPATCHER.pendentes(),
+            "sent": counters.get("alerts.sent", 0),
+            "failed": counters.get("alerts.failed", 0),
+            "digests": counters.get("alerts.digests", 0),
+            "dropped": counters.get("alerts.dropped", 0),
+        },
         "counters": counters,
         "recent_incidents_count_15m": len(recent_incidents),
     }
 
     if include_incidents:
         payload["recent_incidents"] = incidents[:50]
+        payload["latency"] = obs_resumo_latencia()
+        payload["database"]["top_queries"] = obs_resumo_queries()
+        payload["database"]["slow_query_ms"] = OBS_DB_SLOW_QUERY_MS
     return payload
 
 
+def _obs_coletar_metricas():
+    return {
+        "histograms": {
+            "http": OBS_HTTP_LATENCY.snapshot(),
+            "db": OBS_DB_QUERIES.snapshot(),
+            "dependency": MONITOR_DEPENDENCIAS.latencias.snapshot(),
+        },
+        "counters": {"events": OBS_COUNTERS.snapshot()},
+    }
+
+
+OBS_METRICAS_PROCESSOS = (
+    MetricasMultiprocesso(os.path.join(OBS_SHARED_DIR, "metrics"), _obs_coletar_metricas)
+    if OBS_SHARED_DIR else None
+)
+
+
+def obs_metricas_servidor():
+    """Histogramas e contadores somados de todos os processos do servidor."""
+    if OBS_METRICAS_PROCESSOS is not None:
+        try:
+            return OBS_METRICAS_PROCESSOS.agregar()
+        except OSError as exc:
+            # Sem o diretorio compartilhado: ao menos as metricas deste processo.
+            print(f"[ERRO] Falha ao somar metricas dos processos: {exc}", flush=True)
+    dados = _obs_coletar_metricas()
+    dados["processes"] = [{"pid": os.getpid(), "started_at": OBS_START_EPOCH, "alive": True}]
+    return dados
+
+
+def iniciar_exportador_metricas():
+    if OBS_METRICAS_PROCESSOS is None or not _iniciar_uma_vez("obs_metrics_export"):
+        return
+
+    def loop():
+        while not _ENCERRANDO.wait(OBS_METRICS_FLUSH_SECONDS):
+            try:
+                OBS_METRICAS_PROCESSOS.gravar()
+            except Exception as exc:
+                print(f"[ERRO] Falha ao gravar metricas do processo: {exc}", flush=True)
+
+    threading.Thread(target=loop, name="obs-metrics-export", daemon=True).start()
+
+
+def obs_resumo_latencia(limite=25):
+    return {
+        "buckets_ms": list(LATENCY_BUCKETS_MS),
+        "routes": resumir_histogramas(
+            obs_metricas_servidor()["histograms"].get("http", {}),
+            OBS_HTTP_LATENCY.buckets,
+            OBS_HTTP_LATENCY_LABELS,
+            limite=limite,
+        ),
+    }
+
+
+def obs_resumo_dependencias():
+    dependencias = MONITOR_DEPENDENCIAS.resumo()
+    for nome, info in dependencias.items():
+        janela = info["window"]
+        limite_lento = OBS_DEPENDENCY_SLOW_MS.get(nome)
+        info["slow_threshold_ms"] = limite_lento
+        info["slow"] = bool(limite_lento and janela["p95_ms"] is not None and janela["p95_ms"] >= limite_lento)
+        info["failing"] = (
+            janela["calls"] >= OBS_DEPENDENCY_MIN_CALLS
+            and janela["error_rate"] >= OBS_DEPENDENCY_ERROR_RATE
+        )
+    return dependencias
+
+
+def obs_resumo_queries(limite=None):
+    # Ordenado por tempo total: o que mais pesa no banco, nao so o mais frequente.
+    linhas = resumir_histogramas(
+        obs_metricas_servidor()["histograms"].get("db", {}),
+        OBS_DB_QUERIES.buckets,
+        ("fingerprint",),
+        limite=limite or OBS_DB_TOP_QUERIES,
+        ordenar_por="total_ms",
+    )
+    return linhas
+
+
+def obs_registrar_query(sql_texto, duracao_ms):
+    fingerprint = fingerprint_sql(sql_texto)
+    duracao_ms = round(duracao_ms, 2)
+    OBS_DB_QUERIES.observar((fingerprint,), duracao_ms)
+
+    request_id = None
+    if has_request_context():
+        g.db_queries = getattr(g, "db_queries", 0) + 1
+        g.db_time_ms = getattr(g, "db_time_ms", 0.0) + duracao_ms
+        if duracao_ms > getattr(g, "db_slowest_ms", 0.0):
+            g.db_slowest_ms = duracao_ms
+            g.db_slowest = fingerprint
+        request_id = getattr(g, "request_id", None)
+
+    if duracao_ms >= OBS_DB_SLOW_QUERY_MS:
+        obs_increment("db.slow_queries")
+        obs_log(
+            logging.WARNING,
+            "db_slow_query",
+            request_id=request_id,
+            duration_ms=duracao_ms,
+            fingerprint=fingerprint,
+        )
+
+
+if OBS_DB_INSTRUMENTATION_ENABLED:
+    definir_observador_queries(obs_registrar_query)
+
+
+def obs_profiler_gatilho(path):
+    # Header/query so valem para admin logado; a amostragem global ignora assets.
+    if request.headers.get(OBS_PROFILER_HEADER) == "1" or request.args.get(OBS_PROFILER_QUERY_FLAG) == "1":
+        if session.get("admin"):
+            return "admin"
+    if (
+        OBS_PROFILER_SAMPLE_RATE > 0
+        and not path.startswith("/assets")
+        and not path.startswith("/static")
+        and random.random() < OBS_PROFILER_SAMPLE_RATE
+    ):
+        return "sample"
+    return None
+
+
+def obs_metrics_prometheus():
+    # Contadores e histogramas ja vem somados entre os processos: qualquer worker que atenda o
+    # scrape devolve a mesma serie monotonica, e rate()/histogram_quantile() funcionam sem agregar.
+    dados = obs_metricas_servidor()
+    histogramas = dados["histograms"]
+
+    linhas = prometheus_histograma(
+        "trx_http_request_duration_seconds",
+        "Latencia das requisicoes HTTP por rota, metodo e classe de status.",
+        histogramas.get("http", {}),
+        OBS_HTTP_LATENCY.buckets,
+        OBS_HTTP_LATENCY_LABELS,
+        escala=0.001,
+    )
+    linhas += prometheus_histograma(
+        "trx_db_query_duration_seconds",
+        "Duracao das queries por fingerprint de SQL.",
+        histogramas.get("db", {}),
+        OBS_DB_QUERIES.buckets,
+        ("fingerprint",),
+        escala=0.001,
+    )
+    linhas += prometheus_histograma(
+        "trx_dependency_duration_seconds",
+        "Duracao das chamadas a servicos externos por dependencia.",
+        histogramas.get("dependency", {}),
+        MONITOR_DEPENDENCIAS.latencias.buckets,
+        ("dependency",),
+        escala=0.001,
+    )
+    linhas += prometheus_contadores(
+        "trx_events_total", "Contadores internos de observabilidade.", dados["counters"].get("events", {})
+    )
+    agora_ts = time.time()
+    linhas += [
+        "# HELP trx_uptime_seconds Tempo desde o inicio de cada processo vivo do servidor.",
+        "# TYPE trx_uptime_seconds gauge",
+    ]
+    for processo in sorted(dados["processes"], key=lambda item: str(item["pid"])):
+        if processo["alive"] and processo.get("started_at"):
+            linhas.append(
+                f'trx_uptime_seconds{{pid="{processo["pid"]}"}} {int(agora_ts - processo["started_at"])}'
+            )
+    return "\n".join(linhas) + "\n"
+
+
 def _obs_capture_unhandled_exception(sender, exception, **extra):
     try:
         obs_mark_error(
@@ -737,6 +1327,36 @@ CLIENT_VERIFY_EMAIL_KEY = "cliente_verify_email"
 CLIENT_PENDING_REMEMBER_KEY = "cliente_pending_remember"
 CLIENT_REMEMBER_COOKIE = "trx_client_remember"
 CLIENT_REMEMBER_DAYS = int(os.environ.get("CLIENT_REMEMBER_DAYS", "30"))
+CLIENT_REMEMBER_CACHE_TTL_SECONDS = _parse_int_env("CLIENT_REMEMBER_CACHE_TTL_SECONDS", 120, minimum=0, maximum=3600)
+CLIENT_REMEMBER_CACHE_MAX_ITEMS = _parse_int_env("CLIENT_REMEMBER_CACHE_MAX_ITEMS", 5000, minimum=100, maximum=100000)
+CLIENT_LAST_LOGIN_MIN_INTERVAL_MINUTES = _parse_int_env("CLIENT_LAST_LOGIN_MIN_INTERVAL_MINUTES", 15, minimum=0, maximum=1440)
+CLIENT_LAST_LOGIN_FLUSH_SECONDS = _parse_int_env("CLIENT_LAST_LOGIN_FLUSH_SECONDS", 30, minimum=1, maximum=3600)
+CLIENT_LAST_LOGIN_FLUSH_BATCH = _parse_int_env("CLIENT_LAST_LOGIN_FLUSH_BATCH", 200, minimum=1, maximum=5000)
+_remember_token_cache = {}
+_remember_token_cache_lock = threading.Lock()
+_last_login_pending = {}
+_last_login_written_at = {}
+_last_login_lock = threading.Lock()
+_last_login_flush_lock = threading.Lock()
+_last_login_last_flush_at = time.time()
+_last_login_flush_thread = None
+# Processos do servidor (gunicorn avisa no post_fork). Com mais de um, invalidar_remember_cache_cliente()
+# so limpa o processo atual; os demais comparam a versao de remember tokens no banco (logout, reset de
+# senha e troca de token a incrementam) no maximo a cada N segundos.
+_PROCESSOS_SERVIDOR = 1
+CLIENT_REMEMBER_VERSION_CHECK_SECONDS = _parse_int_env("CLIENT_REMEMBER_VERSION_CHECK_SECONDS", 5, minimum=0, maximum=300)
+_remember_cache_versao = {"versao": None, "checado_em": 0.0}
+PAGE_CACHE_ENABLED = (os.environ.get("PAGE_CACHE_ENABLED", "true").strip().lower() == "true")
+PAGE_CACHE_TTL_SECONDS = _parse_int_env("PAGE_CACHE_TTL_SECONDS", 300, minimum=0, maximum=86400)
+PAGE_CACHE_MAX_ITEMS = _parse_int_env("PAGE_CACHE_MAX_ITEMS", 500, minimum=10, maximum=20000)
+# Com varios processos, invalidar_cache_paginas() so limpa o processo atual; os demais
+# comparam a versao do cadastro de afiliados no banco no maximo a cada N segundos.
+PAGE_CACHE_VERSION_CHECK_SECONDS = _parse_int_env("PAGE_CACHE_VERSION_CHECK_SECONDS", 5, minimum=0, maximum=300)
+_page_cache = {}
+_afiliado_ativo_cache = {}
+_prova_comercial_cache = {}
+_page_cache_lock = threading.Lock()
+_page_cache_versao = {"versao": None, "checado_em": 0.0}
 # O codigo de confirmacao deve expirar em 120 segundos.
 CLIENT_CODE_TTL_SECONDS = 120
 CLIENT_CODE_MAX_ATTEMPTS = int(os.environ.get("CLIENT_CODE_MAX_ATTEMPTS", "5"))
@@ -1001,11 +1621,55 @@ def decompor_plano_checkout(plano_checkout):
     return None, None
 
 
+def sincronizar_cache_paginas():
+    """Descarta o cache local se outro processo alterou afiliados desde a ultima checagem."""
+    agora_ts = time.time()
+    with _page_cache_lock:
+        if agora_ts - _page_cache_versao["checado_em"] < PAGE_CACHE_VERSION_CHECK_SECONDS:
+            return
+        _page_cache_versao["checado_em"] = agora_ts
+
+    try:
+        versao = obter_versao_afiliados()
+    except Exception as exc:
+        # Sem a versao nao da para confiar no cache (inclusive nos negativos).
+        obs_mark_error("database", exc, context={"source": "page_cache_version"}, alert=False)
+        versao = None
+
+    with _page_cache_lock:
+        anterior = _page_cache_versao["versao"]
+        _page_cache_versao["versao"] = versao
+        if versao is not None and versao == anterior:
+            return
+        _page_cache.clear()
+        _afiliado_ativo_cache.clear()
+
+
 def obter_afiliado_ativo(slug):
     slug = normalizar_slug_afiliado(slug)
     if not slug_afiliado_valido(slug):
         return None
-    return buscar_afiliado_por_slug(slug, apenas_ativos=True)
+
+    if PAGE_CACHE_ENABLED and PAGE_CACHE_TTL_SECONDS > 0:
+        sincronizar_cache_paginas()
+        agora_ts = time.time()
+        with _page_cache_lock:
+            item = _afiliado_ativo_cache.get(slug)
+            if item and item["cached_until"] > agora_ts:
+                return dict(item["afiliado"]) if item["afiliado"] else None
+
+    afiliado = buscar_afiliado_por_slug(slug, apenas_ativos=True)
+
+    if PAGE_CACHE_ENABLED and PAGE_CACHE_TTL_SECONDS > 0:
+        agora_ts = time.time()
+        with _page_cache_lock:
+            if len(_afiliado_ativo_cache) >= PAGE_CACHE_MAX_ITEMS:
+                _afiliado_ativo_cache.pop(next(iter(_afiliado_ativo_cache)), None)
+            _afiliado_ativo_cache[slug] = {
+                "cached_until": agora_ts + PAGE_CACHE_TTL_SECONDS,
+                "afiliado": dict(afiliado) if afiliado else None,
+            }
+    return afiliado
 
 
 def carregar_afiliado_contexto():
@@ -1420,13 +2084,33 @@ def formatar_valor_brl_com_sinal(valor):
         return f"R$ -{valor_fmt}", "neg"
     return f"R$ {valor_fmt}", "neutral"
 
-if APP_SKIP_DB_INIT or APP_SKIP_ANALYTICS_BACKFILL:
-    print("[INFO] Analytics backfill desativado no startup.", flush=True)
-else:
-    backfill_analytics_from_orders({
-        plano_id: int(info.get("preco") or 0)
-        for plano_id, info in PLANOS.items()
-    })
+def executar_backfill_analytics():
+    try:
+        resultado = backfill_analytics_from_orders({
+            plano_id: int(info.get("preco") or 0)
+            for plano_id, info in PLANOS.items()
+        })
+    except Exception as exc:
+        print(f"[ERRO] Analytics backfill falhou: {exc}", flush=True)
+        return
+    if resultado.get("skipped"):
+        print("[INFO] Analytics backfill em execucao em outro worker; pulando.", flush=True)
+    else:
+        print(
+            f"[INFO] Analytics backfill: {resultado['events']} eventos novos "
+            f"({resultado['scanned']} pedidos lidos desde {resultado['since'] or 'o inicio'}).",
+            flush=True,
+        )
+
+
+def iniciar_backfill_analytics():
+    if APP_SKIP_DB_INIT or APP_SKIP_ANALYTICS_BACKFILL:
+        print("[INFO] Analytics backfill desativado no startup.", flush=True)
+        return
+    if not _iniciar_uma_vez("analytics_backfill"):
+        return
+    # Fora do caminho da primeira requisicao: o backfill e idempotente e protegido por advisory lock.
+    threading.Thread(target=executar_backfill_analytics, name="analytics-backfill", daemon=True).start()
 
 # ======================================================
 # UTIL
@@ -1465,6 +2149,9 @@ def obter_fernet_cliente():
     if _CLIENT_DATA_FERNET is not None:
         return _CLIENT_DATA_FERNET
 
+    # Import tardio: cryptography.fernet so e carregado quando um dado de cliente e tocado.
+    from cryptography.fernet import Fernet
+
     chave_raw = hashlib.sha256(f"{ADMIN_SECRET}:client-data:v1".encode("utf-8")).digest()
     chave = base64.urlsafe_b64encode(chave_raw)
     _CLIENT_DATA_FERNET = Fernet(chave)
@@ -1483,8 +2170,11 @@ def descriptografar_texto_cliente(valor):
     texto = (valor or "").strip()
     if not texto:
         return ""
+    fernet = obter_fernet_cliente()
+    from cryptography.fernet import InvalidToken
+
     try:
-        return obter_fernet_cliente().decrypt(texto.encode("utf-8")).decode("utf-8")
+        return fernet.decrypt(texto.encode("utf-8")).decode("utf-8")
     except (InvalidToken, ValueError, TypeError):
         return texto
 
@@ -1825,7 +2515,14 @@ def iniciar_fluxo_codigo_primeiro_acesso(email, conta, remember=False):
     return True, ""
 
 
+def sessao_no_request():
+    # Sem cookie de sessao a session esta vazia; le-la so marcaria a resposta com Vary: Cookie.
+    return app.config["SESSION_COOKIE_NAME"] in request.cookies
+
+
 def cliente_logado():
+    if not sessao_no_request():
+        return False
     return bool((session.get(CLIENT_SESSION_EMAIL_KEY) or "").strip())
 
 
@@ -1898,6 +2595,8 @@ def autenticar_cliente_resposta(email, remember=False, redirect_path="/minha-con
     session[CLIENT_SESSION_EMAIL_KEY] = email
     session.permanent = remember
     atualizar_ultimo_login_conta_cliente(email)
+    _marcar_ultimo_login_gravado(email)
+    invalidar_remember_cache_cliente(email)
 
     response = redirect(destino)
     if remember:
@@ -1925,6 +2624,175 @@ def autenticar_cliente_resposta(email, remember=False, redirect_path="/minha-con
     return response
 
 
+def _remember_cache_ativo():
+    return CLIENT_REMEMBER_CACHE_TTL_SECONDS > 0
+
+
+def sincronizar_remember_cache():
+    """Descarta o cache local se outro processo trocou ou revogou algum remember token."""
+    if _PROCESSOS_SERVIDOR <= 1:
+        return
+
+    agora_ts = time.time()
+    with _remember_token_cache_lock:
+        if agora_ts - _remember_cache_versao["checado_em"] < CLIENT_REMEMBER_VERSION_CHECK_SECONDS:
+            return
+        _remember_cache_versao["checado_em"] = agora_ts
+
+    try:
+        versao = obter_versao_remember_tokens()
+    except Exception as exc:
+        # Sem a versao nao da para saber se algum token foi revogado.
+        obs_mark_error("database", exc, context={"source": "remember_cache_version"}, alert=False)
+        versao = None
+
+    with _remember_token_cache_lock:
+        anterior = _remember_cache_versao["versao"]
+        _remember_cache_versao["versao"] = versao
+        if versao is not None and versao == anterior:
+            return
+        _remember_token_cache.clear()
+
+
+def _obter_remember_cache(token_hash):
+    if not _remember_cache_ativo():
+        return None
+
+    sincronizar_remember_cache()
+
+    agora_ts = time.time()
+    with _remember_token_cache_lock:
+        item = _remember_token_cache.get(token_hash)
+        if not item:
+            return None
+        if item["cached_until"] <= agora_ts:
+            _remember_token_cache.pop(token_hash, None)
+            return None
+        return dict(item["conta"])
+
+
+def _salvar_remember_cache(token_hash, conta):
+    if not _remember_cache_ativo():
+        return
+
+    agora_ts = time.time()
+    with _remember_token_cache_lock:
+        if len(_remember_token_cache) >= CLIENT_REMEMBER_CACHE_MAX_ITEMS:
+            expirados = [k for k, item in _remember_token_cache.items() if item["cached_until"] <= agora_ts]
+            for k in expirados:
+                _remember_token_cache.pop(k, None)
+            while len(_remember_token_cache) >= CLIENT_REMEMBER_CACHE_MAX_ITEMS:
+                _remember_token_cache.pop(next(iter(_remember_token_cache)), None)
+
+        _remember_token_cache[token_hash] = {
+            "cached_until": agora_ts + CLIENT_REMEMBER_CACHE_TTL_SECONDS,
+            "conta": {
+                "email": conta.get("email"),
+                "remember_expires_at": conta.get("remember_expires_at"),
+            },
+        }
+
+
+def invalidar_remember_cache_cliente(email=None):
+    email_norm = normalizar_email(email)
+    with _remember_token_cache_lock:
+        if not email_norm:
+            _remember_token_cache.clear()
+            return
+        remover = [
+            k for k, item in _remember_token_cache.items()
+            if normalizar_email(item["conta"].get("email")) == email_norm
+        ]
+        for k in remover:
+            _remember_token_cache.pop(k, None)
+
+
+def _marcar_ultimo_login_gravado(email):
+    email_norm = normalizar_email(email)
+    if not email_norm:
+        return
+    with _last_login_lock:
+        _last_login_written_at[email_norm] = time.time()
+        _last_login_pending.pop(email_norm, None)
+
+
+def registrar_ultimo_login_cliente(email):
+    email_norm = normalizar_email(email)
+    if not email_norm:
+        return
+
+    agora_ts = time.time()
+    intervalo = CLIENT_LAST_LOGIN_MIN_INTERVAL_MINUTES * 60
+    with _last_login_lock:
+        ultimo = _last_login_written_at.get(email_norm, 0)
+        if agora_ts - ultimo < intervalo:
+            return
+        _last_login_written_at[email_norm] = agora_ts
+        _last_login_pending[email_norm] = agora_utc()
+
+    _iniciar_flush_ultimos_logins()
+    descarregar_ultimos_logins_pendentes()
+
+
+def _loop_flush_ultimos_logins():
+    # Sem isso, um pendente so seria gravado no proximo login do processo ou no encerramento.
+    while not _ENCERRANDO.wait(CLIENT_LAST_LOGIN_FLUSH_SECONDS):
+        descarregar_ultimos_logins_pendentes()
+
+
+def _iniciar_flush_ultimos_logins():
+    global _last_login_flush_thread
+
+    with _last_login_lock:
+        # is_alive() tambem cobre o filho do fork, onde a thread herdada nao existe.
+        if _last_login_flush_thread is not None and _last_login_flush_thread.is_alive():
+            return
+        _last_login_flush_thread = threading.Thread(
+            target=_loop_flush_ultimos_logins, name="last-login-flush", daemon=True
+        )
+        _last_login_flush_thread.start()
+
+
+def descarregar_ultimos_logins_pendentes(forcar=False):
+    global _last_login_last_flush_at
+
+    agora_ts = time.time()
+    with _last_login_lock:
+        if not _last_login_pending:
+            return 0
+        vencido = agora_ts - _last_login_last_flush_at >= CLIENT_LAST_LOGIN_FLUSH_SECONDS
+        lote_cheio = len(_last_login_pending) >= CLIENT_LAST_LOGIN_FLUSH_BATCH
+        if not (forcar or vencido or lote_cheio):
+            return 0
+
+    if not _last_login_flush_lock.acquire(blocking=forcar):
+        return 0
+
+    try:
+        with _last_login_lock:
+            lote = dict(_last_login_pending)
+            _last_login_pending.clear()
+            _last_login_last_flush_at = agora_ts
+            limite = agora_ts - (CLIENT_LAST_LOGIN_MIN_INTERVAL_MINUTES * 60)
+            antigos = [k for k, ts in _last_login_written_at.items() if ts < limite]
+            for k in antigos:
+                _last_login_written_at.pop(k, None)
+
+        if not lote:
+            return 0
+
+        try:
+            return atualizar_ultimo_login_contas_cliente(lote)
+        except Exception as exc:
+            with _last_login_lock:
+                for email, quando in lote.items():
+                    _last_login_pending.setdefault(email, quando)
+            obs_mark_error("database", exc, context={"source": "last_login_flush", "pending": len(lote)}, alert=False)
+            return 0
+    finally:
+        _last_login_flush_lock.release()
+
+
 def tentar_login_automatico_cliente():
     if cliente_logado():
         return None
@@ -1934,25 +2802,30 @@ def tentar_login_automatico_cliente():
         return None
 
     token_hash = hash_token_remember_cliente(token)
-    conta = buscar_conta_cliente_por_remember_hash(token_hash)
+    conta = _obter_remember_cache(token_hash)
     if not conta:
-        return "clear_cookie"
+        conta = buscar_conta_cliente_por_remember_hash(token_hash)
+        if not conta:
+            return "clear_cookie"
 
-    if conta.get("first_access_required"):
-        return "clear_cookie"
+        if conta.get("first_access_required"):
+            return "clear_cookie"
 
-    expira_em = conta.get("remember_expires_at")
-    if not expira_em:
-        return "clear_cookie"
+        if not conta.get("remember_expires_at"):
+            return "clear_cookie"
+
+        _salvar_remember_cache(token_hash, conta)
 
+    expira_em = conta.get("remember_expires_at")
     agora = datetime.now(expira_em.tzinfo) if getattr(expira_em, "tzinfo", None) else datetime.now()
     if expira_em < agora:
+        invalidar_remember_cache_cliente(conta.get("email"))
         limpar_remember_token_cliente(conta.get("email"))
         return "clear_cookie"
 
     session[CLIENT_SESSION_EMAIL_KEY] = conta.get("email")
     session.permanent = True
-    atualizar_ultimo_login_conta_cliente(conta.get("email"))
+    registrar_ultimo_login_cliente(conta.get("email"))
     return "ok"
 
 
@@ -2144,6 +3017,7 @@ def iniciar_recuperacao_senha_cliente(email):
     senha_temporaria = gerar_senha_temporaria()
     senha_hash = gerar_hash_senha(senha_temporaria)
     ok_reset = forcar_reset_senha_conta_cliente(email, senha_hash)
+    invalidar_remember_cache_cliente(email)
     if not ok_reset:
         return False
 
@@ -2198,46 +3072,290 @@ def _cspr_headers():
     ])
 
 
-THEME_HEAD_INJECTION = (
-    '\n<link rel="stylesheet" href="/assets/theme-toggle.css?v=20260217">'
+# ======================================================
+# ASSETS (FINGERPRINT + PRECOMPRESSAO)
+# ======================================================
+
+ASSETS_DIR = os.path.join(app.root_path, "assets")
+ASSETS_BUILD_DIR = os.path.join(
+    app.root_path,
+    (os.environ.get("ASSETS_BUILD_DIR") or ".assets-build").strip() or ".assets-build"
+)
+ASSET_PIPELINE_ENABLED = (os.environ.get("ASSET_PIPELINE_ENABLED", "true").strip().lower() == "true")
+ASSET_IMAGE_VARIANTS_ENABLED = (os.environ.get("ASSET_IMAGE_VARIANTS_ENABLED", "true").strip().lower() == "true")
+ASSET_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_ASSET_MANIFEST = {"version": 1, "files": {}}
+_ASSET_FINGERPRINTS = {}
+_ASSET_IMAGES = {"version": 1, "formats": [], "images": {}}
+_ASSET_IMAGE_VARIANTS = {}
+_ASSET_IMAGES_MTIME = None
+_ASSET_IMAGES_CHECADO_EM = 0.0
+ASSET_IMAGE_MANIFEST_CHECK_SECONDS = 30
+# Incrementado sempre que URLs de assets mudam; entra na chave do cache de paginas.
+_ASSET_VERSAO = 0
+
+
+def _publicar_manifesto_assets(manifesto):
+    global _ASSET_MANIFEST, _ASSET_FINGERPRINTS, _ASSET_VERSAO
+    _ASSET_MANIFEST = manifesto
+    _ASSET_FINGERPRINTS = indexar_fingerprints(manifesto)
+    _ASSET_VERSAO += 1
+
+
+def carregar_pipeline_assets():
+    """No import: so le os manifestos ja gerados (build step `python asset_pipeline.py`)."""
+    if not ASSET_PIPELINE_ENABLED:
+        print("[INFO] ASSET_PIPELINE_ENABLED=false -> assets servidos sem fingerprint.", flush=True)
+        return
+
+    try:
+        _publicar_manifesto_assets(carregar_manifesto_assets(ASSETS_BUILD_DIR))
+    except Exception as exc:
+        print(f"[ASSETS] Manifesto de assets ilegivel: {exc}", flush=True)
+    if ASSET_IMAGE_VARIANTS_ENABLED:
+        _sincronizar_manifesto_imagens(forcar=True)
+
+
+def inicializar_pipeline_assets():
+    """Regera o que mudou desde o build (incremental); roda uma vez em inicializar_app()."""
+    if not ASSET_PIPELINE_ENABLED:
+        return
+
+    inicio = time.time()
+    try:
+        manifesto = construir_pipeline_assets(ASSETS_DIR, ASSETS_BUILD_DIR)
+    except Exception as exc:
+        print(f"[ASSETS] Falha ao gerar pipeline de assets: {exc}", flush=True)
+        try:
+            manifesto = carregar_manifesto_assets(ASSETS_BUILD_DIR)
+        except Exception:
+            manifesto = {"version": 1, "files": {}}
+
+    _publicar_manifesto_assets(manifesto)
+    arquivos = manifesto.get("files", {})
+    obs_log(
+        logging.INFO,
+        "asset_pipeline_ready",
+        files=len(arquivos),
+        precompressed=sum(1 for info in arquivos.values() if info.get("encodings")),
+        duration_ms=round((time.time() - inicio) * 1000, 2),
+    )
+
+    if not ASSET_IMAGE_VARIANTS_ENABLED:
+        return
+
+    _sincronizar_manifesto_imagens(forcar=True)
+
+
+def _sincronizar_manifesto_imagens(forcar=False):
+    """Rele o manifesto de imagens quando muda no disco (o lider gera; os demais processos so leem)."""
+    global _ASSET_IMAGES_MTIME, _ASSET_IMAGES_CHECADO_EM
+    agora_ts = time.time()
+    if not forcar and agora_ts - _ASSET_IMAGES_CHECADO_EM < ASSET_IMAGE_MANIFEST_CHECK_SECONDS:
+        return
+    _ASSET_IMAGES_CHECADO_EM = agora_ts
+    try:
+        mtime = os.stat(os.path.join(ASSETS_BUILD_DIR, IMAGE_MANIFEST_NAME)).st_mtime_ns
+    except OSError:
+        mtime = None
+    if not forcar and mtime == _ASSET_IMAGES_MTIME:
+        return
+    _ASSET_IMAGES_MTIME = mtime
+    try:
+        _publicar_variantes_imagens(carregar_manifesto_imagens(ASSETS_BUILD_DIR))
+    except Exception as exc:
+        print(f"[ASSETS] Manifesto de imagens ilegivel: {exc}", flush=True)
+
+
+def iniciar_variantes_imagens_background():
+    if not ASSET_PIPELINE_ENABLED or not ASSET_IMAGE_VARIANTS_ENABLED:
+        return
+    if not _iniciar_uma_vez("image_variants"):
+        return
+    # A geracao e CPU-bound e so roda de fato para imagens novas/alteradas; sai do import
+    # para nao disputar o GIL com o boot.
+    threading.Thread(target=_gerar_variantes_imagens_background, daemon=True).start()
+
+
+def _publicar_variantes_imagens(manifesto):
+    global _ASSET_IMAGES, _ASSET_IMAGE_VARIANTS, _ASSET_VERSAO
+    _ASSET_IMAGES = manifesto or {"version": 1, "formats": [], "images": {}}
+    _ASSET_IMAGE_VARIANTS = indexar_variantes_imagens(_ASSET_IMAGES)
+    _ASSET_VERSAO += 1
+
+
+def _gerar_variantes_imagens_background():
+    inicio = time.time()
+    try:
+        manifesto = gerar_variantes_imagens(ASSETS_DIR, ASSETS_BUILD_DIR)
+    except Exception as exc:
+        print(f"[ASSETS] Falha ao gerar variantes de imagens: {exc}", flush=True)
+        return
+
+    _publicar_variantes_imagens(manifesto)
+    obs_log(
+        logging.INFO,
+        "image_variants_ready",
+        images=len(manifesto.get("images", {})),
+        formats=manifesto.get("formats", []),
+        duration_ms=round((time.time() - inicio) * 1000, 2),
+    )
+
+
+def _normalizar_caminho_asset(path):
+    rel = (path or "").strip().split("?", 1)[0]
+    if rel.startswith("/assets/"):
+        rel = rel[len("/assets/"):]
+    return rel.lstrip("/")
+
+
+def asset_url(path):
+    rel = _normalizar_caminho_asset(path)
+    info = _ASSET_MANIFEST.get("files", {}).get(rel)
+    if info:
+        return f"/assets/{info['fingerprinted']}"
+    return f"/assets/{rel}"
+
+
+def imagem_responsiva(path):
+    rel = _normalizar_caminho_asset(path)
+    resultado = {
+        "src": asset_url(rel),
+        "width": None,
+        "height": None,
+        "srcset": "",
+        "sources": [],
+    }
+
+    if ASSET_PIPELINE_ENABLED and ASSET_IMAGE_VARIANTS_ENABLED:
+        _sincronizar_manifesto_imagens()
+    info = _ASSET_IMAGES.get("images", {}).get(rel)
+    atual = _ASSET_MANIFEST.get("files", {}).get(rel)
+    if not info or (atual and atual.get("hash") != info.get("hash")):
+        return resultado
+
+    resultado["width"] = info.get("width")
+    resultado["height"] = info.get("height")
+    for formato in IMAGE_VARIANT_FORMATS:
+        itens = (info.get("variants") or {}).get(formato) or []
+        if not itens:
+            continue
+        srcset = ", ".join(f"/assets/{item['path']} {item['width']}w" for item in itens)
+        resultado["sources"].append({
+            "type": IMAGE_VARIANT_MIMETYPES[formato],
+            "srcset": srcset,
+        })
+        if formato == "webp" or not resultado["srcset"]:
+            resultado["srcset"] = srcset
+
+    return resultado
+
+
+app.add_template_global(asset_url)
+app.add_template_global(imagem_responsiva)
+carregar_pipeline_assets()
+
+
+THEME_BOOT_SCRIPT = (
     '\n<script>(function(){try{var t=localStorage.getItem("trx_theme");'
     'if(t!=="light"&&t!=="dark"){t=(window.matchMedia&&window.matchMedia("(prefers-color-scheme: dark)").matches)?"dark":"light";}'
     'document.documentElement.setAttribute("data-theme",t);'
     'document.documentElement.style.colorScheme=t;'
     '}catch(_){document.documentElement.setAttribute("data-theme","dark");document.documentElement.style.colorScheme="dark";}})();</script>\n'
 )
+THEME_CSS_RE = re.compile(r"/assets/theme-toggle(?:\.[0-9a-f]{12})?\.css|asset_url\('theme-toggle\.css'\)")
+THEME_JS_RE = re.compile(r"/assets/theme-toggle(?:\.[0-9a-f]{12})?\.js|asset_url\('theme-toggle\.js'\)")
 
-THEME_BODY_INJECTION = '\n<script src="/assets/theme-toggle.js?v=20260217"></script>\n'
 
+def _theme_head_injection(css_url, boot_script=THEME_BOOT_SCRIPT):
+    return f'\n<link rel="stylesheet" href="{css_url}">{boot_script}'
 
-def _injetar_theme_global(response):
-    content_type = (response.headers.get("Content-Type") or "").lower()
-    if "text/html" not in content_type or response.direct_passthrough:
-        return response
 
-    html = response.get_data(as_text=True)
-    if not html:
-        return response
+def _theme_body_injection(js_url):
+    return f'\n<script src="{js_url}"></script>\n'
 
-    inicio = html.lstrip()[:200].lower()
-    if not (inicio.startswith("<!doctype html") or inicio.startswith("<html")):
-        return response
 
+THEME_TEMPLATES_APLICADOS = set()
+
+
+def _html_documento_completo(html):
+    inicio = (html or "").lstrip()[:200].lower()
+    return inicio.startswith("<!doctype html") or inicio.startswith("<html")
+
+
+def _aplicar_theme_html(html, head_injection, body_injection):
     alterado = False
-    if "/assets/theme-toggle.css" not in html and "</head>" in html:
-        html = html.replace("</head>", f"{THEME_HEAD_INJECTION}</head>", 1)
+    if not THEME_CSS_RE.search(html) and "</head>" in html:
+        html = html.replace("</head>", f"{head_injection}</head>", 1)
         alterado = True
 
-    if "/assets/theme-toggle.js" not in html and "</body>" in html:
-        html = html.replace("</body>", f"{THEME_BODY_INJECTION}</body>", 1)
+    if not THEME_JS_RE.search(html) and "</body>" in html:
+        html = html.replace("</body>", f"{body_injection}</body>", 1)
         alterado = True
 
+    return html, alterado
+
+
+class ThemeInjectingLoader(BaseLoader):
+    """Injeta o tema global no fonte dos templates HTML completos, uma vez por compilacao."""
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        if _html_documento_completo(source):
+            source, _ = _aplicar_theme_html(
+                source,
+                _theme_head_injection(
+                    "{{ asset_url('theme-toggle.css') }}",
+                    boot_script="{% raw %}" + THEME_BOOT_SCRIPT + "{% endraw %}",
+                ),
+                _theme_body_injection("{{ asset_url('theme-toggle.js') }}"),
+            )
+            if THEME_CSS_RE.search(source) or THEME_JS_RE.search(source):
+                THEME_TEMPLATES_APLICADOS.add(template)
+        return source, filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
+
+
+app.jinja_env.loader = ThemeInjectingLoader(app.jinja_env.loader)
+
+
+def _marcar_template_com_theme(sender, template, context, **extra):
+    if template.name in THEME_TEMPLATES_APLICADOS:
+        g.theme_aplicado = True
+
+
+template_rendered.connect(_marcar_template_com_theme, app)
+
+
+def _injetar_theme_global(response):
+    # Fallback para HTML que nao veio de template (strings montadas nas rotas).
+    if getattr(g, "theme_aplicado", False):
+        return response
+
+    content_type = (response.headers.get("Content-Type") or "").lower()
+    if "text/html" not in content_type or response.direct_passthrough or response.is_streamed:
+        return response
+
+    html = response.get_data(as_text=True)
+    if not html or not _html_documento_completo(html):
+        return response
+
+    html, alterado = _aplicar_theme_html(
+        html,
+        _theme_head_injection(asset_url("theme-toggle.css")),
+        _theme_body_injection(asset_url("theme-toggle.js")),
+    )
     if alterado:
         response.set_data(html)
-        response.headers.pop("Content-Length", None)
 
     return response
 
+
 def formatar_telefone_infinitepay(telefone):
     numeros = re.sub(r"\D", "", telefone)
 
@@ -2317,7 +3435,7 @@ def enviar_whatsapp_automatico(order):
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = post_monitorado("graph_api", url, json=payload, headers=headers, timeout=30)
         response.raise_for_status()
         obs_mark_success(
             "whatsapp",
@@ -2345,52 +3463,214 @@ def enviar_whatsapp_automatico(order):
 MAX_TENTATIVAS_WHATSAPP = 3
 
 
-def processar_fila_whatsapp():
+def _enviar_whatsapp_fila(pedido):
+    tentativas = int(pedido.get("whatsapp_tentativas") or 0)
+    try:
+        enviar_whatsapp_automatico(pedido)
+        incrementar_whatsapp_enviado(pedido["order_id"])
+        print(f"[INFO] WhatsApp autom\u00e1tico enviado: {pedido['order_id']}", flush=True)
+    except Exception as e:
+        # O claim continua valendo ate o lease expirar, o que serve de intervalo entre tentativas.
+        registrar_falha_whatsapp(
+            pedido["order_id"],
+            tentativas + 1,
+            str(e)
+        )
+        print(f"[ERRO] Falha WhatsApp autom\u00e1tico {pedido['order_id']}: {e}", flush=True)
+
+
+def processar_fila_whatsapp(executor=None):
     obs_worker_heartbeat("whatsapp_worker")
-    pedidos = listar_whatsapp_pendentes(limite=30)
+    pedidos = reivindicar_whatsapp_pendentes(
+        limite=WHATSAPP_QUEUE_SENDERS * 2,
+        max_tentativas=MAX_TENTATIVAS_WHATSAPP,
+        lease_segundos=WHATSAPP_QUEUE_LEASE_SECONDS
+    )
 
-    for pedido in pedidos:
-        tentativas = int(pedido.get("whatsapp_tentativas") or 0)
-        if tentativas >= MAX_TENTATIVAS_WHATSAPP:
-            continue
+    if executor is None or len(pedidos) <= 1:
+        for pedido in pedidos:
+            _enviar_whatsapp_fila(pedido)
+    else:
+        list(executor.map(_enviar_whatsapp_fila, pedidos))
 
-        try:
-            enviar_whatsapp_automatico(pedido)
-            incrementar_whatsapp_enviado(pedido["order_id"])
-            print(f"[INFO] WhatsApp autom\u00e1tico enviado: {pedido['order_id']}", flush=True)
-        except Exception as e:
-            registrar_falha_whatsapp(
-                pedido["order_id"],
-                tentativas + 1,
-                str(e)
-            )
-            print(f"[ERRO] Falha WhatsApp autom\u00e1tico {pedido['order_id']}: {e}", flush=True)
+    return len(pedidos)
+
+
+def _espera_fila_whatsapp():
+    try:
+        proximo = segundos_ate_proximo_whatsapp_pendente(
+            max_tentativas=MAX_TENTATIVAS_WHATSAPP,
+            lease_segundos=WHATSAPP_QUEUE_LEASE_SECONDS
+        )
+    except Exception:
+        proximo = None
+    if proximo is None:
+        return WHATSAPP_QUEUE_POLL_SECONDS
+    # +0.5s para o NOW() do banco ja ter passado do vencimento.
+    return max(0.5, min(WHATSAPP_QUEUE_POLL_SECONDS, proximo + 0.5))
+
+
+_FILA_WHATSAPP_LOCK = threading.Lock()
 
 
 def iniciar_worker_whatsapp():
     def worker_loop():
+        executor = ThreadPoolExecutor(
+            max_workers=WHATSAPP_QUEUE_SENDERS,
+            thread_name_prefix="whatsapp-queue"
+        )
+        conn_listen = None
         while True:
+            _WORKERS_LIDER.wait()
+            espera = WHATSAPP_QUEUE_POLL_SECONDS
             try:
                 obs_worker_heartbeat("whatsapp_worker")
-                processar_fila_whatsapp()
+                # O encerramento espera este lock: o lote reivindicado termina antes do processo sair.
+                with _FILA_WHATSAPP_LOCK:
+                    if _ENCERRANDO.is_set():
+                        return
+                    lote = processar_fila_whatsapp(executor)
+                if lote >= WHATSAPP_QUEUE_SENDERS * 2:
+                    continue
+                espera = _espera_fila_whatsapp()
+
+                if WHATSAPP_QUEUE_LISTEN_ENABLED and conn_listen is None:
+                    conn_listen = abrir_conexao_listen(WHATSAPP_QUEUE_CHANNEL)
+                if conn_listen is not None:
+                    aguardar_notificacoes(conn_listen, espera)
+                    continue
             except Exception as e:
                 obs_worker_error("whatsapp_worker", e)
                 print(f"[ERRO] Worker WhatsApp com erro: {e}", flush=True)
-            time.sleep(20)
+                if conn_listen is not None:
+                    try:
+                        conn_listen.close()
+                    except Exception:
+                        pass
+                    conn_listen = None
+            if _ENCERRANDO.wait(espera):
+                return
+
+    thread = threading.Thread(target=worker_loop, daemon=True)
+    thread.start()
+
+
+def _backup_timezone():
+    return resolver_timezone_segura(BACKUP_TIMEZONE, fallback_hours=-3)
+
+
+def _registrar_backup_execucao_seguro(**kwargs):
+    try:
+        return registrar_backup_execucao(**kwargs)
+    except Exception as exc:
+        print(f"[BACKUP] falha ao registrar log: {exc}", flush=True)
+        return None
+
+
+def _atualizar_backup_execucao_seguro(run_id, **kwargs):
+    if not run_id:
+        return
+    try:
+        atualizar_backup_execucao(run_id, **kwargs)
+    except Exception as exc:
+        print(f"[BACKUP] falha ao atualizar execucao {run_id}: {exc}", flush=True)
+
+
+def _entregar_backup_por_email(run_id, caminho, filename, size_bytes, sha256, partes, detalhes=""):
+    """Envia as partes pendentes do .enc; o progresso vai para backup_runs.parts a cada parte."""
+    total = len(partes)
+    instrucoes = ""
+    if total > 1:
+        instrucoes = (
+            f"\nO backup foi dividido em {total} partes. Para reunir:\n"
+            f"python backup_utils.py join {filename}.part*of{total:03d} --sha256 {sha256}\n"
+        )
+
+    def enviar(parte, dados):
+        enviar_email_com_anexo_bytes(
+            destinatario=BACKUP_EMAIL_TO,
+            assunto=f"Backup diario TRX PRO ({filename}) - parte {parte['index']}/{total}",
+            mensagem=(
+                "Backup criptografado TRX PRO.\n\n"
+                f"Arquivo: {filename}\n"
+                f"Tamanho: {size_bytes} bytes\n"
+                f"SHA256: {sha256}\n"
+                f"{detalhes}"
+                f"Parte {parte['index']}/{total}: {parte['filename']} ({parte['size']} bytes)\n"
+                f"SHA256 da parte: {parte['sha256']}\n"
+                f"{instrucoes}"
+            ),
+            filename=parte["filename"],
+            conteudo=dados,
+        )
 
-    thread = threading.Thread(target=worker_loop, daemon=True)
-    thread.start()
+    return enviar_partes_backup(
+        caminho,
+        partes,
+        enviar,
+        workers=BACKUP_EMAIL_WORKERS,
+        tentativas=BACKUP_EMAIL_RETRIES,
+        ao_atualizar=lambda atuais: _atualizar_backup_execucao_seguro(run_id, parts=atuais),
+    )
 
 
-def _backup_timezone():
-    return resolver_timezone_segura(BACKUP_TIMEZONE, fallback_hours=-3)
+def _finalizar_entrega_backup(run_id, resultado, partes):
+    if resultado["failed"]:
+        status = "PARTIAL"
+        mensagem = (
+            f"{resultado['sent']}/{resultado['parts']} partes enviadas; "
+            "as restantes serao reenviadas na proxima execucao."
+        )
+    else:
+        status = "SUCCESS"
+        mensagem = f"Backup enviado por e-mail com sucesso ({resultado['parts']} parte(s))."
+    _atualizar_backup_execucao_seguro(run_id, status=status, message=mensagem, finished_at=agora_utc(), parts=partes)
+    return status, mensagem
+
+
+def _retomar_entrega_backup(pendente):
+    caminho = os.path.join(BACKUP_OUTPUT_DIR, pendente["filename"] or "")
+    if not pendente["filename"] or not os.path.exists(caminho) or not pendente["parts"]:
+        _atualizar_backup_execucao_seguro(
+            pendente["id"],
+            status="FAILED",
+            message="Arquivo local ou lista de partes nao existe mais; entrega abandonada.",
+            finished_at=agora_utc(),
+        )
+        return "FAILED"
+
+    partes = pendente["parts"]
+    resultado = _entregar_backup_por_email(
+        pendente["id"],
+        caminho,
+        pendente["filename"],
+        pendente["size_bytes"],
+        pendente["sha256"],
+        partes,
+        detalhes="Reenvio de partes pendentes.\n",
+    )
+    status, _ = _finalizar_entrega_backup(pendente["id"], resultado, partes)
+    print(f"[BACKUP] retomada de {pendente['filename']}: {status} ({resultado['sent']}/{resultado['parts']})", flush=True)
+    return status
 
 
-def _registrar_backup_execucao_seguro(**kwargs):
+def _retomar_entregas_backup_pendentes():
+    """Reenvia so as partes que faltaram em execucoes anteriores (PARTIAL ou SENDING abandonada)."""
     try:
-        registrar_backup_execucao(**kwargs)
+        pendentes = listar_entregas_backup_pendentes(sending_ha_minutos=BACKUP_SENDING_STALE_MINUTES)
     except Exception as exc:
-        print(f"[BACKUP] falha ao registrar log: {exc}", flush=True)
+        print(f"[BACKUP] falha ao consultar entregas pendentes: {exc}", flush=True)
+        return []
+
+    resultados = []
+    for pendente in pendentes:
+        # Uma entrega que falha de novo nao impede as demais.
+        try:
+            resultados.append(_retomar_entrega_backup(pendente))
+        except Exception as exc:
+            print(f"[BACKUP] falha ao retomar execucao {pendente['id']}: {exc}", flush=True)
+            resultados.append("FAILED")
+    return resultados
 
 
 def _segundos_ate_proximo_backup():
@@ -2419,6 +3699,9 @@ def executar_backup_criptografado(trigger_type="auto"):
     if not BACKUP_EMAIL_TO:
         return False, "E-mail de destino do backup n\u00e3o configurado."
 
+    if _ENCERRANDO.is_set():
+        return False, "Processo encerrando; backup n\u00e3o iniciado."
+
     os.makedirs(BACKUP_OUTPUT_DIR, exist_ok=True)
 
     with _backup_lock:
@@ -2445,26 +3728,54 @@ def executar_backup_criptografado(trigger_type="auto"):
             )
             return False, "Backup em andamento em outro processo."
 
+        run_id = None
         try:
+            _retomar_entregas_backup_pendentes()
+
+            estado_anterior = None
+            if BACKUP_INCREMENTAL_ENABLED:
+                try:
+                    estado_anterior = obter_estado_backup_anterior()
+                except Exception as exc:
+                    print(f"[BACKUP] estado anterior indisponivel, gerando completo: {exc}", flush=True)
+                if precisa_backup_completo(estado_anterior, BACKUP_FULL_EVERY_DAYS):
+                    estado_anterior = None
+
             info = criar_backup_criptografado(
                 project_root=os.getcwd(),
                 output_dir=BACKUP_OUTPUT_DIR,
                 password=BACKUP_ENCRYPTION_PASSWORD,
+                db_export=BACKUP_DB_EXPORT,
+                db_format=BACKUP_DB_COPY_FORMAT,
+                db_workers=BACKUP_DB_EXPORT_WORKERS,
+                estado_anterior=estado_anterior,
             )
 
-            assunto = f"Backup diario TRX PRO ({info['created_at_utc']})"
-            mensagem = (
-                "Backup criptografado gerado e enviado com sucesso.\n\n"
-                f"Arquivo: {info['filename']}\n"
-                f"Tamanho: {info['size_bytes']} bytes\n"
-                f"SHA256: {info['sha256']}\n"
-                f"Trigger: {trigger_type}\n"
+            partes = planejar_partes_backup(info["path"], BACKUP_EMAIL_PART_MAX_MB * 1024 * 1024)
+            run_id = _registrar_backup_execucao_seguro(
+                trigger_type=trigger_type,
+                status="SENDING",
+                filename=info["filename"],
+                size_bytes=info["size_bytes"],
+                sha256=info["sha256"],
+                message=f"Enviando {len(partes)} parte(s) por e-mail.",
+                started_at=inicio,
+                backup_kind=info["kind"],
+                manifest=info["state"],
+                parts=partes,
             )
-            enviar_email_com_anexo(
-                destinatario=BACKUP_EMAIL_TO,
-                assunto=assunto,
-                mensagem=mensagem,
-                caminho_arquivo=info["path"],
+            resultado = _entregar_backup_por_email(
+                run_id,
+                info["path"],
+                info["filename"],
+                info["size_bytes"],
+                info["sha256"],
+                partes,
+                detalhes=(
+                    f"Tipo: {info['kind']}\n"
+                    f"Cadeia para restore: {', '.join(info['chain'])}\n"
+                    f"Trigger: {trigger_type}\n"
+                ),
             )
 
             remover_backups_antigos(
@@ -2472,27 +3783,37 @@ def executar_backup_criptografado(trigger_type="auto"):
                 keep_days=BACKUP_RETENTION_DAYS,
             )
 
-            fim = agora_utc()
-            _registrar_backup_execucao_seguro(
-                trigger_type=trigger_type,
-                status="SUCCESS",
-                filename=info["filename"],
-                size_bytes=info["size_bytes"],
-                sha256=info["sha256"],
-                message="Backup enviado por e-mail com sucesso.",
-                started_at=inicio,
-                finished_at=fim,
-            )
+            status, mensagem = _finalizar_entrega_backup(run_id, resultado, partes)
+            if not run_id:
+                # Sem a linha SENDING (falha ao registrar), grava o resultado final de uma vez.
+                _registrar_backup_execucao_seguro(
+                    trigger_type=trigger_type,
+                    status=status,
+                    filename=info["filename"],
+                    size_bytes=info["size_bytes"],
+                    sha256=info["sha256"],
+                    message=mensagem,
+                    started_at=inicio,
+                    finished_at=agora_utc(),
+                    backup_kind=info["kind"],
+                    manifest=info["state"],
+                    parts=partes,
+                )
+            if status != "SUCCESS":
+                return False, f"Backup gerado, mas a entrega ficou incompleta: {mensagem}"
             return True, "Backup enviado com sucesso."
         except Exception as exc:
             fim = agora_utc()
-            _registrar_backup_execucao_seguro(
-                trigger_type=trigger_type,
-                status="FAILED",
-                message=str(exc),
-                started_at=inicio,
-                finished_at=fim,
-            )
+            if run_id:
+                _atualizar_backup_execucao_seguro(run_id, status="FAILED", message=str(exc), finished_at=fim)
+            else:
+                _registrar_backup_execucao_seguro(
+                    trigger_type=trigger_type,
+                    status="FAILED",
+                    message=str(exc),
+                    started_at=inicio,
+                    finished_at=fim,
+                )
             return False, f"Falha no backup: {exc}"
         finally:
             liberar_lock_backup_distribuido(lock_conn)
@@ -2508,7 +3829,9 @@ def iniciar_worker_backup_diario():
             try:
                 obs_worker_heartbeat("backup_worker")
                 esperar = _segundos_ate_proximo_backup()
-                time.sleep(esperar)
+                if _ENCERRANDO.wait(esperar):
+                    return
+                _WORKERS_LIDER.wait()
                 obs_worker_heartbeat("backup_worker")
                 ok, msg = executar_backup_criptografado(trigger_type="auto")
                 if ok:
@@ -2517,11 +3840,13 @@ def iniciar_worker_backup_diario():
                     obs_mark_error("backup", msg, context={"source": "backup_auto"}, alert=False)
                 print(f"[BACKUP] {msg}", flush=True)
                 if not ok and "em andamento em outro processo" not in msg.lower():
-                    time.sleep(60)
+                    if _ENCERRANDO.wait(60):
+                        return
             except Exception as exc:
                 obs_worker_error("backup_worker", exc)
                 print(f"[BACKUP] erro no worker: {exc}", flush=True)
-                time.sleep(60)
+                if _ENCERRANDO.wait(60):
+                    return
 
     thread = threading.Thread(target=worker_loop, daemon=True)
     thread.start()
@@ -2542,13 +3867,6 @@ def pedido_liberado_para_whatsapp(order):
     return agendado <= agora
 
 
-if BACKGROUND_WORKERS_ENABLED:
-    iniciar_worker_whatsapp()
-    iniciar_worker_backup_diario()
-else:
-    print("[INFO] BACKGROUND_WORKERS_ENABLED=false -> workers desativados.", flush=True)
-
-
 def chave_duplicidade_pedido(order):
     nome = (order.get("nome") or "").strip().lower()
     email = (order.get("email") or "").strip().lower()
@@ -2585,6 +3903,207 @@ def montar_mensagem_whatsapp_pos_pago(order):
     return WHATSAPP_TEMPLATE.format(nome=nome, plano=plano_nome)
 
 
+# Item que nao sai em 80% do lease do claim falha antes de outro processo poder reivindicar a linha.
+DISPATCHER_WHATSAPP = DispatcherWhatsApp(
+    lote_max=WHATSAPP_DISPATCH_BATCH_MAX,
+    max_pendentes=WHATSAPP_DISPATCH_MAX_PENDING,
+    validade_segundos=WHATSAPP_AUTO_CLAIM_LEASE_MINUTES * 60 * 0.8,
+)
+
+
+def _registrar_falha_whatsapp_pos_pago(order_id, order, exc):
+    print(f"\u274c Falha WhatsApp auto ({order_id}): {exc}", flush=True)
+    try:
+        registrar_falha_whatsapp_auto(order_id, str(exc))
+    finally:
+        obs_mark_error(
+            "whatsapp",
+            exc,
+            context={
+                "source": "post_paid_schedule",
+                "order_id": order_id,
+                "plan": (order or {}).get("plano"),
+                "phone": (order or {}).get("telefone"),
+            },
+            alert=True
+        )
+
+
+def _concluir_whatsapp_pos_pago(order_id, order, future):
+    exc = future.exception()
+    if exc is not None:
+        _registrar_falha_whatsapp_pos_pago(order_id, order, exc)
+        return
+
+    print(f"\U0001f4f2 WhatsApp auto enviado ({order_id})", flush=True)
+    try:
+        marcar_whatsapp_auto_enviado(order_id)
+    finally:
+        obs_mark_success(
+            "whatsapp",
+            context={
+                "source": "post_paid_schedule",
+                "order_id": order_id,
+                "plan": order.get("plano"),
+            }
+        )
+
+
+def enviar_whatsapp_pos_pago_agendado(order_id):
+    # Roda no pool do agendador; o claim evita envio duplo entre processos.
+    if not reivindicar_whatsapp_auto(order_id):
+        return False
+
+    order = None
+    try:
+        order = buscar_order_por_id(order_id)
+        telefone = (order or {}).get("telefone")
+        if not telefone:
+            raise RuntimeError("pedido sem telefone para WhatsApp")
+
+        # O dispatcher agrupa em /send-batch e respeita o ritmo por numero do sender; com a fila
+        # cheia, enviar() bloqueia este sender e o agendador para de tirar itens do heap.
+        future = DISPATCHER_WHATSAPP.enviar(telefone, montar_mensagem_whatsapp_pos_pago(order), order_id=order_id)
+    except Exception as exc:
+        _registrar_falha_whatsapp_pos_pago(order_id, order, exc)
+        return False
+
+    future.add_done_callback(lambda f: _concluir_whatsapp_pos_pago(order_id, order, f))
+    return True
+
+
+AGENDADOR_WHATSAPP_AUTO = AgendadorWhatsApp(
+    executar=enviar_whatsapp_pos_pago_agendado,
+    carregar_pendentes=lambda horizonte, limite: listar_whatsapp_auto_agendados(
+        horizonte_segundos=horizonte,
+        limite=limite
+    ),
+    senders=WHATSAPP_SCHEDULER_SENDERS,
+    max_em_memoria=WHATSAPP_SCHEDULER_MAX_IN_MEMORY,
+    horizonte_segundos=WHATSAPP_SCHEDULER_HORIZON_SECONDS,
+    intervalo_recarga=WHATSAPP_SCHEDULER_RELOAD_SECONDS,
+    nome="whatsapp_auto_scheduler",
+)
+
+
+# Setado enquanto este processo e o lider; os loops de fila/backup esperam nele a cada volta.
+_WORKERS_LIDER = threading.Event()
+_WORKERS_LOOPS_LOCK = threading.Lock()
+_WORKERS_LOOPS_INICIADOS = False
+_WORKERS_LIDER_CONN = None
+_WORKERS_LIDER_CONN_LOCK = threading.Lock()
+
+
+def iniciar_loops_background():
+    global _WORKERS_LOOPS_INICIADOS
+    with _WORKERS_LOOPS_LOCK:
+        if _WORKERS_LOOPS_INICIADOS:
+            return False
+        _WORKERS_LOOPS_INICIADOS = True
+    iniciar_worker_whatsapp()
+    iniciar_worker_backup_diario()
+    # Geracao CPU-bound: um processo so; os outros releem o manifesto do disco.
+    iniciar_variantes_imagens_background()
+    return True
+
+
+def assumir_lideranca_workers():
+    _WORKERS_LIDER.set()
+    iniciar_loops_background()
+    if WA_SENDER_URL and WA_SENDER_TOKEN:
+        # Recupera agendamentos pendentes (inclusive de antes de um restart ou de outro lider).
+        AGENDADOR_WHATSAPP_AUTO.iniciar()
+
+
+def perder_lideranca_workers():
+    # Os loops de fila/backup param sozinhos em _WORKERS_LIDER.wait(); o agendador nao olha a
+    # flag e precisa parar, senao dispara junto com o novo lider.
+    _WORKERS_LIDER.clear()
+    AGENDADOR_WHATSAPP_AUTO.parar()
+
+
+def eleger_lider_workers(conn):
+    """Uma volta da eleicao: devolve a conexao que segura o lock (ou None se nao e lider)."""
+    if conn is not None:
+        if lock_lider_workers_ativo(conn):
+            return conn
+        # O lock de sessao caiu com a conexao; outro processo pode assumir.
+        perder_lideranca_workers()
+        obs_log(logging.WARNING, "workers_leader_lost", pid=os.getpid())
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    conn = adquirir_lock_lider_workers()
+    if conn is None:
+        return None
+
+    obs_log(logging.INFO, "workers_leader_elected", pid=os.getpid())
+    assumir_lideranca_workers()
+    return conn
+
+
+def liberar_pedidos_presos():
+    """Devolve a PENDENTE pedidos cujo processo morreu no meio do webhook (o provedor reenvia)."""
+    try:
+        liberadas = liberar_orders_processando_expiradas(ORDER_PROCESSING_LEASE_MINUTES)
+    except Exception as exc:
+        print(f"[ERRO] Falha ao liberar pedidos presos em PROCESSANDO: {exc}", flush=True)
+        return []
+    if liberadas:
+        obs_log(logging.WARNING, "orders_processing_released", orders=liberadas)
+    return liberadas
+
+
+def iniciar_eleicao_lider_workers():
+    def loop():
+        global _WORKERS_LIDER_CONN
+        proxima_varredura = 0.0
+        while not _ENCERRANDO.is_set():
+            with _WORKERS_LIDER_CONN_LOCK:
+                if _ENCERRANDO.is_set():
+                    return
+                try:
+                    _WORKERS_LIDER_CONN = eleger_lider_workers(_WORKERS_LIDER_CONN)
+                except Exception as exc:
+                    perder_lideranca_workers()
+                    _WORKERS_LIDER_CONN = None
+                    print(f"[ERRO] Eleicao de lider dos workers falhou: {exc}", flush=True)
+            if _WORKERS_LIDER.is_set() and time.time() >= proxima_varredura:
+                liberar_pedidos_presos()
+                # A cada meia lease: um pedido preso espera no maximo 1,5x a lease.
+                proxima_varredura = time.time() + ORDER_PROCESSING_LEASE_MINUTES * 30
+            _ENCERRANDO.wait(WORKERS_LEADER_RETRY_SECONDS)
+
+    threading.Thread(target=loop, name="workers-leader-election", daemon=True).start()
+
+
+def liberar_lideranca_workers():
+    """Solta o advisory lock de lider para outro processo assumir os loops sem esperar o TCP cair."""
+    global _WORKERS_LIDER_CONN
+    with _WORKERS_LIDER_CONN_LOCK:
+        conn, _WORKERS_LIDER_CONN = _WORKERS_LIDER_CONN, None
+        perder_lideranca_workers()
+    if conn is None:
+        return False
+    liberar_lock_lider_workers(conn)
+    return True
+
+
+def iniciar_workers_background():
+    if not BACKGROUND_WORKERS_ENABLED:
+        print("[INFO] BACKGROUND_WORKERS_ENABLED=false -> workers desativados.", flush=True)
+        return
+    if not _iniciar_uma_vez("workers_background"):
+        return
+    if not WORKERS_LEADER_ELECTION_ENABLED:
+        liberar_pedidos_presos()
+        assumir_lideranca_workers()
+        return
+    iniciar_eleicao_lider_workers()
+
+
 def agendar_whatsapp_pos_pago(order):
     order_id = order.get("order_id")
     telefone = order.get("telefone")
@@ -2601,46 +4120,17 @@ def agendar_whatsapp_pos_pago(order):
         print(f"[INFO] WhatsApp j\u00e1 agendado/enviado para {order_id}", flush=True)
         return
 
-    mensagem = montar_mensagem_whatsapp_pos_pago(order)
     print(f"[INFO] Pagamento confirmado; agendando WhatsApp para {order_id} em {WHATSAPP_DELAY_MINUTES} min", flush=True)
 
-    def _on_success(order_id_cb):
-        try:
-            marcar_whatsapp_auto_enviado(order_id_cb)
-        finally:
-            obs_mark_success(
-                "whatsapp",
-                context={
-                    "source": "post_paid_schedule",
-                    "order_id": order_id_cb,
-                    "plan": order.get("plano"),
-                }
-            )
-
-    def _on_failure(order_id_cb, erro):
-        try:
-            registrar_falha_whatsapp_auto(order_id_cb, erro)
-        finally:
-            obs_mark_error(
-                "whatsapp",
-                erro,
-                context={
-                    "source": "post_paid_schedule",
-                    "order_id": order_id_cb,
-                    "plan": order.get("plano"),
-                    "phone": telefone,
-                },
-                alert=True
-            )
+    if _ENCERRANDO.is_set():
+        # Agendador ja parado: a linha SCHEDULED fica para o proximo processo recarregar.
+        return
 
-    schedule_whatsapp(
-        phone=telefone,
-        message=mensagem,
-        order_id=order_id,
-        delay_minutes=WHATSAPP_DELAY_MINUTES,
-        on_success=_on_success,
-        on_failure=_on_failure
-    )
+    # A linha em whatsapp_auto_dispatches e a fonte de verdade; o heap so acelera o disparo.
+    # Fora do lider so fica a linha: o agendador do lider recarrega a cada
+    # WHATSAPP_SCHEDULER_RELOAD_SECONDS, bem antes do atraso padrao vencer.
+    if AGENDADOR_WHATSAPP_AUTO.ativo:
+        AGENDADOR_WHATSAPP_AUTO.agendar(order_id, atraso_segundos=WHATSAPP_DELAY_MINUTES * 60)
 
 
 def converter_data_para_timezone_admin(dt):
@@ -3635,6 +5125,7 @@ def parse_relatorio_mensal_nome(arquivo):
         return None
 
     ganho_fmt, status = formatar_valor_brl_com_sinal(valor_float)
+    imagem = imagem_responsiva(f"meses/{arquivo}")
 
     return {
         "month": MESES_ROTULO.get(mes, mes.upper()),
@@ -3642,7 +5133,11 @@ def parse_relatorio_mensal_nome(arquivo):
         "end_day": dia_fim,
         "gain": ganho_fmt,
         "status": status,
-        "image_url": f"/assets/meses/{arquivo}",
+        "image_url": imagem["src"],
+        "image_srcset": imagem["srcset"],
+        "image_sources": imagem["sources"],
+        "image_width": imagem["width"],
+        "image_height": imagem["height"],
         "_value": valor_float,
         "_sort": (
             MESES_ORDEM_CARROSSEL.get(mes, 99),
@@ -3820,7 +5315,15 @@ def aplicar_protecoes_request():
     ip = obter_ip_request() or (request.remote_addr or "0.0.0.0")
     g.request_started_at = time.time()
     g.request_id = uuid.uuid4().hex[:12]
+    g.db_queries = 0
+    g.db_time_ms = 0.0
+    g.db_slowest_ms = 0.0
+    g.db_slowest = None
     g.request_ip = ip
+    gatilho_profile = obs_profiler_gatilho(path)
+    if gatilho_profile:
+        g.obs_profile = OBS_PROFILER.iniciar()
+        g.obs_profile_trigger = gatilho_profile
     obs_increment("http.requests_total")
     admin_surface = path.startswith("/admin") or path.startswith("/api/analytics") or path == "/dashboard"
 
@@ -3907,6 +5410,16 @@ def aplicar_protecoes_request():
             return "Falha de valida\u00e7\u00e3o CSRF.", 403
 
 
+def obs_acesso_autorizado():
+    """Sessao de admin ou token bearer dedicado (scraper do Prometheus, diagnostico)."""
+    if sessao_no_request() and session.get("admin"):
+        return True
+    if not OBS_METRICS_TOKEN:
+        return False
+    token = (request.headers.get("Authorization") or "").removeprefix("Bearer ").strip()
+    return bool(token) and hmac.compare_digest(token, OBS_METRICS_TOKEN)
+
+
 @app.after_request
 def aplicar_headers_seguranca(response):
     path = request.path or ""
@@ -3934,14 +5447,53 @@ def aplicar_headers_seguranca(response):
     else:
         obs_mark_success("http")
 
-    with OBS_LOCK:
-        OBS_LAST_REQUEST["method"] = method
-        OBS_LAST_REQUEST["path"] = path
-        OBS_LAST_REQUEST["status"] = status_code
-        OBS_LAST_REQUEST["latency_ms"] = latency_ms
-        OBS_LAST_REQUEST["at"] = obs_now_iso()
+    db_queries = getattr(g, "db_queries", 0)
+    db_ms = round(getattr(g, "db_time_ms", 0.0), 2)
+    # Regra da rota (nao o path) para manter a cardinalidade limitada.
+    rota = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+    profile = g.pop("obs_profile", None)
+    if profile is not None:
+        perfil = OBS_PROFILER.finalizar(
+            profile,
+            trigger=getattr(g, "obs_profile_trigger", None),
+            request_id=getattr(g, "request_id", None),
+            method=method,
+            path=path,
+            route=rota,
+            status=status_code,
+            latency_ms=latency_ms,
+            db_ms=db_ms,
+            db_queries=db_queries,
+            db_share=round(db_ms / latency_ms, 4) if latency_ms else None,
+        )
+        obs_increment("profiler.captured")
+        response.headers["X-Profile-Id"] = perfil["id"]
+
+    if latency_ms is not None:
+        OBS_HTTP_LATENCY.observar((rota, method, f"{status_code // 100}xx"), latency_ms)
+
+    OBS_LAST_REQUEST.registrar("http", {
+        "method": method,
+        "path": path,
+        "status": status_code,
+        "latency_ms": latency_ms,
+        "at": obs_now_iso(),
+    })
+
+    registrar_log_request = OBS_REQUEST_LOG_ENABLED
+    if (
+        registrar_log_request
+        and status_code < 400
+        and OBS_REQUEST_LOG_SAMPLE_2XX < 1.0
+        and (latency_ms or 0) < OBS_REQUEST_LOG_SLOW_MS
+        and random.random() >= OBS_REQUEST_LOG_SAMPLE_2XX
+    ):
+        # Amostragem so para respostas de sucesso rapidas; erros e lentas sempre logam.
+        registrar_log_request = False
+        obs_increment("http.request_logs_sampled_out")
 
-    if OBS_REQUEST_LOG_ENABLED:
+    if registrar_log_request:
         log_level = logging.INFO
         if status_code >= 500:
             log_level = logging.ERROR
@@ -3956,10 +5508,20 @@ def aplicar_headers_seguranca(response):
             path=path,
             status=status_code,
             latency_ms=latency_ms,
+            db_queries=db_queries,
+            db_ms=db_ms,
+            db_slowest_ms=round(getattr(g, "db_slowest_ms", 0.0), 2) if db_queries else None,
+            db_slowest=getattr(g, "db_slowest", None),
             ip=getattr(g, "request_ip", None),
             user_agent=(request.headers.get("User-Agent") or "")[:200]
         )
 
+    if OBS_SERVER_TIMING_ENABLED and obs_acesso_autorizado():
+        server_timing = [f'db;dur={db_ms};desc="{db_queries} queries"']
+        if latency_ms is not None:
+            server_timing.append(f"app;dur={latency_ms}")
+        response.headers.add("Server-Timing", ", ".join(server_timing))
+
     response.headers.setdefault("X-Content-Type-Options", "nosniff")
     response.headers.setdefault("X-Frame-Options", "DENY")
     response.headers.setdefault("Referrer-Policy", "strict-origin-when-cross-origin")
@@ -4047,7 +5609,7 @@ def criar_checkout_dinamico(plano_id, order_id, nome, email, telefone):
         ]
     }
 
-    r = requests.post(INFINITEPAY_URL, json=payload, timeout=30)
+    r = post_monitorado("infinitepay_checkout", INFINITEPAY_URL, json=payload, timeout=30)
     r.raise_for_status()
     return r.json()["url"]
 
@@ -4106,7 +5668,35 @@ def enviar_email_com_retry(order, plano_info, arquivo, senha):
 
 @app.route("/assets/<path:filename>")
 def serve_assets(filename):
-    return send_from_directory("assets", filename)
+    info = _ASSET_FINGERPRINTS.get(filename)
+    if not info:
+        variante = _ASSET_IMAGE_VARIANTS.get(filename)
+        if not variante:
+            return send_from_directory("assets", filename)
+        response = send_from_directory(
+            ASSETS_BUILD_DIR,
+            variante["build_path"],
+            mimetype=variante.get("mimetype"),
+        )
+        response.headers["Cache-Control"] = ASSET_IMMUTABLE_CACHE_CONTROL
+        return response
+
+    encodings = info.get("encodings") or {}
+    encoding = escolher_encoding_asset(request.headers.get("Accept-Encoding"), encodings)
+    if encoding:
+        response = send_from_directory(
+            ASSETS_BUILD_DIR,
+            encodings[encoding]["path"],
+            mimetype=info.get("mimetype"),
+        )
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_from_directory("assets", info["path"], mimetype=info.get("mimetype"))
+
+    if encodings:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = ASSET_IMMUTABLE_CACHE_CONTROL
+    return response
 
 
 @app.route("/favicon.ico")
@@ -4114,6 +5704,95 @@ def favicon():
     return send_from_directory("assets/favicons", "trx_bull_exact_favicon.ico")
 
 
+# ======================================================
+# CACHE DE PAGINAS PUBLICAS (LANDING)
+# ======================================================
+
+def versao_prova_comercial():
+    # Muda quando o CSV da curva ou a pasta de relatorios mensais mudam.
+    versao = []
+    for caminho in ((CAPITAL_CURVE_CSV_PATH or "").strip(), os.path.join("assets", "meses")):
+        try:
+            info = os.stat(caminho) if caminho else None
+        except OSError:
+            info = None
+        versao.append((info.st_mtime_ns, info.st_size) if info else None)
+    return tuple(versao)
+
+
+def obter_prova_comercial_cacheada():
+    if not PAGE_CACHE_ENABLED or PAGE_CACHE_TTL_SECONDS <= 0:
+        return montar_prova_comercial_auditavel()
+
+    versao = versao_prova_comercial()
+    agora_ts = time.time()
+    with _page_cache_lock:
+        item = _prova_comercial_cache.get("atual")
+        if item and item["versao"] == versao and item["cached_until"] > agora_ts:
+            return item["prova"]
+
+    prova = montar_prova_comercial_auditavel()
+    with _page_cache_lock:
+        _prova_comercial_cache["atual"] = {
+            "versao": versao,
+            "cached_until": agora_ts + PAGE_CACHE_TTL_SECONDS,
+            "prova": prova,
+        }
+    return prova
+
+
+def invalidar_cache_paginas(motivo=""):
+    with _page_cache_lock:
+        removidas = len(_page_cache)
+        _page_cache.clear()
+        _afiliado_ativo_cache.clear()
+    if removidas:
+        obs_log(logging.INFO, "page_cache_invalidated", reason=motivo or "manual", entries=removidas)
+
+
+def renderizar_landing_cacheada(template_name, afiliado):
+    """Renderiza a landing publica reaproveitando o HTML por (template, afiliado, versao da prova, assets)."""
+    contexto = {
+        "affiliate": afiliado,
+        "checkout_suffix": montar_checkout_suffix(afiliado),
+    }
+    if not PAGE_CACHE_ENABLED or PAGE_CACHE_TTL_SECONDS <= 0:
+        return render_template(template_name, proof_audit=montar_prova_comercial_auditavel(), **contexto)
+
+    chave = (
+        template_name,
+        (afiliado or {}).get("slug") or "",
+        versao_prova_comercial(),
+        _ASSET_VERSAO,
+    )
+    sincronizar_cache_paginas()
+    agora_ts = time.time()
+    with _page_cache_lock:
+        item = _page_cache.get(chave)
+        if item and item["cached_until"] > agora_ts:
+            obs_increment("page_cache_hit")
+            # O HTML em cache ja saiu do loader com o theme injetado.
+            g.theme_aplicado = item["theme_aplicado"]
+            return item["html"]
+
+    obs_increment("page_cache_miss")
+    html = render_template(template_name, proof_audit=obter_prova_comercial_cacheada(), **contexto)
+
+    with _page_cache_lock:
+        if len(_page_cache) >= PAGE_CACHE_MAX_ITEMS:
+            expiradas = [k for k, v in _page_cache.items() if v["cached_until"] <= agora_ts]
+            for k in expiradas:
+                _page_cache.pop(k, None)
+            while len(_page_cache) >= PAGE_CACHE_MAX_ITEMS:
+                _page_cache.pop(next(iter(_page_cache)), None)
+        _page_cache[chave] = {
+            "cached_until": agora_ts + PAGE_CACHE_TTL_SECONDS,
+            "html": html,
+            "theme_aplicado": bool(getattr(g, "theme_aplicado", False)),
+        }
+    return html
+
+
 @app.route("/")
 def home():
     afiliado = carregar_afiliado_contexto()
@@ -4133,12 +5812,7 @@ def home():
         },
         funnel_context=funnel_context
     )
-    return render_template(
-        "index.html",
-        affiliate=afiliado,
-        checkout_suffix=montar_checkout_suffix(afiliado),
-        proof_audit=montar_prova_comercial_auditavel()
-    )
+    return renderizar_landing_cacheada("index.html", afiliado)
 
 
 @app.route("/diagnostico-de-perfil-trx")
@@ -4219,7 +5893,7 @@ def checkout_sucesso(order_id):
             session["email"] = email
             session["telefone"] = normalizar_telefone(order.get("telefone") or "")
             session.permanent = True
-            atualizar_ultimo_login_conta_cliente(email)
+            registrar_ultimo_login_cliente(email)
 
     refresh_url = f"/sucesso/{order_id}?t={token}"
     return render_template(
@@ -4685,6 +6359,7 @@ def cliente_logout():
         return "Falha de valida\u00e7\u00e3o CSRF.", 403
     email = obter_email_cliente_logado()
     if EMAIL_RE.fullmatch(email):
+        invalidar_remember_cache_cliente(email)
         limpar_remember_token_cliente(email)
 
     limpar_sessao_cliente()
@@ -4748,6 +6423,7 @@ def cliente_ativar_afiliacao():
                 terms_accepted_ip=terms_accepted_ip,
                 terms_version=AFFILIATE_TERMS_VERSION
             )
+            invalidar_cache_paginas("affiliate_reactivated")
             return redirect("/minha-conta?info=afiliado_reativado#afiliados")
 
         if not afiliado_existente.get("terms_accepted_at"):
@@ -4790,6 +6466,7 @@ def cliente_ativar_afiliacao():
             return redirect("/minha-conta?info=afiliado_existente#afiliados")
         return redirect("/minha-conta?info=afiliado_erro#afiliados")
 
+    invalidar_cache_paginas("affiliate_created")
     return redirect("/minha-conta?info=afiliado_criado#afiliados")
 
 
@@ -4852,6 +6529,7 @@ def cliente_editar_link_afiliado():
     if not atualizado:
         return redirect("/minha-conta?info=afiliado_erro#afiliados")
 
+    invalidar_cache_paginas("affiliate_slug_changed")
     if session.get("affiliate_slug") == slug_atual:
         session["affiliate_slug"] = slug_novo
 
@@ -5168,12 +6846,7 @@ def landing_afiliado(affiliate_slug):
         funnel_context=funnel_context
     )
 
-    return render_template(
-        "index.html",
-        affiliate=afiliado,
-        checkout_suffix=montar_checkout_suffix(afiliado),
-        proof_audit=montar_prova_comercial_auditavel()
-    )
+    return renderizar_landing_cacheada("index.html", afiliado)
 
 
 @app.route("/api/reports/monthly")
@@ -5546,6 +7219,11 @@ def comprar():
 # WEBHOOK
 # ======================================================
 
+# Pedidos em PROCESSANDO neste processo; o encerramento espera por eles e devolve as sobras a PENDENTE.
+_WEBHOOKS_EM_VOO = set()
+_WEBHOOKS_EM_VOO_COND = threading.Condition()
+
+
 @app.route("/webhook/infinitypay", methods=["POST"])
 def webhook():
     obs_increment("webhook.received")
@@ -5554,6 +7232,11 @@ def webhook():
         obs_increment("webhook.unauthorized")
         return jsonify({"msg": "N\u00e3o autorizado"}), 401
 
+    if _ENCERRANDO.is_set():
+        # O provedor reenvia; o proximo processo atende sem risco de morrer no meio.
+        obs_increment("webhook.rejected_shutdown")
+        return jsonify({"msg": "Servidor reiniciando"}), 503, {"Retry-After": "5"}
+
     if not request.is_json:
         obs_increment("webhook.invalid_payload")
         return jsonify({"msg": "Content-Type inv\u00e1lido"}), 400
@@ -5609,6 +7292,8 @@ def webhook():
         obs_increment("webhook.order_processing")
         return jsonify({"msg": "Pedido em processamento"}), 200
 
+    with _WEBHOOKS_EM_VOO_COND:
+        _WEBHOOKS_EM_VOO.add(order_id)
     arquivo = None
     processamento_concluido = False
     try:
@@ -5680,6 +7365,9 @@ def webhook():
                 restaurar_order_para_pendente(order_id)
             except Exception as exc:
                 print(f"[WEBHOOK] Falha ao restaurar status pendente {order_id}: {exc}", flush=True)
+        with _WEBHOOKS_EM_VOO_COND:
+            _WEBHOOKS_EM_VOO.discard(order_id)
+            _WEBHOOKS_EM_VOO_COND.notify_all()
         if arquivo and os.path.exists(arquivo):
             os.remove(arquivo)
 
@@ -5778,6 +7466,31 @@ def admin_health():
     return render_template("admin_health.html", health=health)
 
 
+@app.teardown_request
+def descartar_profile_pendente(exc):
+    # after_request nao roda se a resposta nem chegou a ser montada.
+    OBS_PROFILER.descartar(g.pop("obs_profile", None))
+
+
+@app.route("/admin/health/profiles")
+def admin_health_profiles():
+    if not session.get("admin"):
+        return redirect("/admin/login")
+
+    perfis = OBS_PROFILER.listar()
+    perfil_id = (request.args.get("id") or "").strip()
+    selecionado = OBS_PROFILER.obter(perfil_id) if perfil_id else (perfis[0] if perfis else None)
+    return render_template(
+        "admin_health_profiles.html",
+        perfis=perfis,
+        selecionado=selecionado,
+        sample_rate=OBS_PROFILER_SAMPLE_RATE,
+        header_name=OBS_PROFILER_HEADER,
+        query_flag=OBS_PROFILER_QUERY_FLAG,
+        ignorados=OBS_PROFILER.ignorados,
+    )
+
+
 @app.route("/admin/health/data")
 def admin_health_data():
     if not session.get("admin"):
@@ -5786,6 +7499,17 @@ def admin_health_data():
     return jsonify(obs_health_payload(include_incidents=True))
 
 
+@app.route("/metrics")
+def obs_metrics():
+    if not obs_acesso_autorizado():
+        return jsonify({"error": "unauthorized"}), 403
+
+    response = app.response_class(obs_metrics_prometheus(), mimetype="text/plain")
+    response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
 @app.route("/admin/dashboard")
 def admin_dashboard():
     if not session.get("admin"):
@@ -6027,6 +7751,7 @@ def admin_afiliados_adicionar():
 
     if not inserido:
         return redirecionar_admin_afiliados("J\u00e1 existe um afiliado com esse slug.")
+    invalidar_cache_paginas("affiliate_created")
     return redirecionar_admin_afiliados("Afiliado adicionado com sucesso.", ok=True)
 
 
@@ -6076,6 +7801,7 @@ def admin_afiliados_editar(slug):
     if not atualizado:
         return redirecionar_admin_afiliados("Afiliado n\u00e3o encontrado.")
 
+    invalidar_cache_paginas("affiliate_updated")
     return redirecionar_admin_afiliados("Afiliado atualizado com sucesso.", ok=True)
 
 
@@ -6092,6 +7818,7 @@ def admin_afiliados_excluir(slug):
     if not removido:
         return redirecionar_admin_afiliados("Afiliado n\u00e3o encontrado.")
 
+    invalidar_cache_paginas("affiliate_deleted")
     if session.get("affiliate_slug") == slug:
         session.pop("affiliate_slug", None)
 
@@ -6462,10 +8189,153 @@ def admin_pedido(order_id):
 
     return render_template("admin_pedido.html", pedido=pedido_view)
 
+# ======================================================
+# ENCERRAMENTO
+# ======================================================
+# Ordem importa: primeiro para de produzir trabalho, depois espera o que esta em voo,
+# grava o que sobrou e so no fim solta o lock de lider e o escritor de logs.
+
+
+def _encerrar_agendador_whatsapp(limite):
+    # O heap so espelha linhas SCHEDULED do banco; nada se perde ao parar.
+    AGENDADOR_WHATSAPP_AUTO.parar(timeout=restante(limite))
+    return {"in_memory": AGENDADOR_WHATSAPP_AUTO.pendentes_em_memoria()}
+
+
+def _aguardar_webhooks_em_voo(limite):
+    with _WEBHOOKS_EM_VOO_COND:
+        _WEBHOOKS_EM_VOO_COND.wait_for(lambda: not _WEBHOOKS_EM_VOO, timeout=restante(limite))
+        return {"in_flight": len(_WEBHOOKS_EM_VOO)}
+
+
+def _aguardar_lock(lock, limite):
+    if not lock.acquire(timeout=restante(limite)):
+        return False
+    lock.release()
+    return True
+
+
+def _aguardar_fila_whatsapp(limite):
+    return {"drained": _aguardar_lock(_FILA_WHATSAPP_LOCK, limite)}
+
+
+def _aguardar_backup(limite):
+    # Nao da para retomar um backup pela metade: se nao couber no prazo, a execucao fica sem
+    # conclusao em backup_runs e o proximo backup agendado gera outro.
+    return {"finished": _aguardar_lock(_backup_lock, limite)}
+
+
+def _drenar_dispatcher_whatsapp(limite):
+    sobras = DISPATCHER_WHATSAPP.drenar(restante(limite))
+    order_ids = [item["order_id"] for item in sobras if item.get("order_id")]
+    return {"unsent": len(sobras), "rescheduled": devolver_whatsapp_auto_para_agenda(order_ids)}
+
+
+def _descarregar_buffers(limite):
+    return {"last_logins": descarregar_ultimos_logins_pendentes(forcar=True) or 0}
+
+
+def _registrar_pedidos_em_voo(limite):
+    # Nao volta a PENDENTE: a thread do webhook ainda pode concluir ate o graceful_timeout do
+    # gunicorn, e um reenvio do provedor em outro processo entregaria o pedido duas vezes. Se o
+    # processo morrer antes, o lider devolve pela lease de processing_started_at.
+    with _WEBHOOKS_EM_VOO_COND:
+        pendentes = sorted(_WEBHOOKS_EM_VOO)
+    if pendentes:
+        obs_log(logging.WARNING, "orders_processing_left_to_lease", orders=pendentes)
+    return {"in_flight": pendentes}
+
+
+def _gravar_metricas_processo(limite):
+    # Ultimo snapshot deste processo: as contagens dele continuam na soma do /metrics.
+    if OBS_METRICAS_PROCESSOS is None:
+        return {"shared": False}
+    OBS_METRICAS_PROCESSOS.gravar()
+    return {"shared": True}
+
+
+def _drenar_alertas(limite):
+    return {"drained": OBS_ALERT_DISPATCHER.drenar(restante(limite))}
+
+
+def _liberar_locks(limite):
+    return {"workers_leader": liberar_lideranca_workers()}
+
+
+def _concluir_encerramento(relatorio):
+    obs_log(
+        logging.WARNING if relatorio.get("deadline_exceeded") else logging.INFO,
+        "app_shutdown",
+        pid=os.getpid(),
+        **relatorio,
+    )
+    if OBS_LOG_WRITER is not None:
+        OBS_LOG_WRITER.parar()
+
+
+CICLO_VIDA.registrar("whatsapp_scheduler", _encerrar_agendador_whatsapp)
+CICLO_VIDA.registrar("webhooks", _aguardar_webhooks_em_voo)
+CICLO_VIDA.registrar("whatsapp_queue", _aguardar_fila_whatsapp)
+CICLO_VIDA.registrar("backup", _aguardar_backup)
+CICLO_VIDA.registrar("whatsapp_dispatcher", _drenar_dispatcher_whatsapp)
+CICLO_VIDA.registrar("write_behind", _descarregar_buffers)
+CICLO_VIDA.registrar("orders_processing", _registrar_pedidos_em_voo)
+CICLO_VIDA.registrar("metrics", _gravar_metricas_processo)
+CICLO_VIDA.registrar("alerts", _drenar_alertas)
+CICLO_VIDA.registrar("advisory_locks", _liberar_locks)
+CICLO_VIDA.ao_concluir = _concluir_encerramento
+
+
+def encerrar_app(motivo="shutdown"):
+    """Drena e encerra; chamado pelo SIGTERM (via CICLO_VIDA) ou pelo worker_exit do gunicorn."""
+    return CICLO_VIDA.encerrar(motivo)
+
 # ======================================================
 # START
 # ======================================================
 
+def _aquecer_app():
+    try:
+        inicializar_app()
+    except Exception as exc:
+        # A primeira requisicao tenta de novo via garantir_app_inicializado().
+        print(f"[ERRO] Falha na inicializacao em background: {exc}", flush=True)
+
+
+def configurar_processos_servidor(total):
+    """Informa quantos processos atendem o app (post_fork do gunicorn)."""
+    global _PROCESSOS_SERVIDOR
+    _PROCESSOS_SERVIDOR = max(1, int(total or 1))
+
+
+def reiniciar_recursos_apos_fork():
+    """Chamado no processo filho logo apos o fork (post_fork do gunicorn com preload_app).
+
+    Threads nao atravessam o fork: o escritor de logs volta a rodar e a sessao HTTP herdada
+    e descartada. O banco nao tem pool (get_conn abre uma conexao por chamada) e nada de
+    init_db/workers roda no import, entao o filho nao herda conexao aberta.
+    """
+    MONITOR_DEPENDENCIAS.reiniciar_apos_fork()
+    if OBS_METRICAS_PROCESSOS is not None:
+        OBS_METRICAS_PROCESSOS.reiniciar_apos_fork()
+    if OBS_LOG_WRITER is not None:
+        reiniciar_log_assincrono(OBS_LOG_HANDLER, OBS_LOG_WRITER)
+
+
+def criar_app(aquecer=None):
+    """Factory para o servidor WSGI: devolve o app sem tocar no banco nem subir workers.
+
+    Com aquecimento (padrao: APP_WARMUP_ON_START), inicializar_app() comeca numa thread
+    logo apos o boot e a primeira requisicao so espera o que ainda faltar.
+    """
+    if aquecer is None:
+        aquecer = APP_WARMUP_ON_START
+    if aquecer:
+        threading.Thread(target=_aquecer_app, name="app-warmup", daemon=True).start()
+    return app
+
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+    CICLO_VIDA.instalar_sinais()
+    criar_app().run(host="0.0.0.0", port=port)
@@ -0,0 +1,346 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import tempfile
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli e opcional
+    brotli = None
+
+try:
+    from PIL import Image, features as pil_features
+except ImportError:  # pragma: no cover - Pillow e opcional
+    Image = None
+    pil_features = None
+
+ASSET_HASH_LENGTH = 12
+ASSET_MANIFEST_NAME = "manifest.json"
+ASSET_MIN_COMPRESS_BYTES = 512
+ASSET_COMPRESSIBLE_EXTENSIONS = {
+    ".css",
+    ".js",
+    ".json",
+    ".svg",
+    ".csv",
+    ".txt",
+    ".ico",
+    ".map",
+    ".xml",
+}
+ASSET_IGNORED_SUFFIXES = {".gz", ".br"}
+ASSET_IGNORED_FILES = {".DS_Store", "Thumbs.db"}
+ASSET_ENCODINGS_PREFERENCE = ("br", "gzip")
+
+IMAGE_MANIFEST_NAME = "images.json"
+IMAGE_VARIANTS_PREFIX = "_img"
+IMAGE_VARIANT_WIDTHS = (320, 480, 768, 1080)
+IMAGE_VARIANT_FORMATS = ("avif", "webp")
+IMAGE_VARIANT_QUALITY = {"avif": 55, "webp": 78}
+IMAGE_VARIANT_MIMETYPES = {"avif": "image/avif", "webp": "image/webp"}
+IMAGE_VARIANT_SOURCES = (
+    "meses/*.png",
+    "logo-hero.png",
+    "curva.png",
+    "elliot.png",
+)
+
+
+def _hash_arquivo(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(bloco)
+    return digest.hexdigest()
+
+
+def nome_fingerprint_asset(rel_path, digest):
+    rel = str(rel_path).replace("\\", "/")
+    pasta, _, nome = rel.rpartition("/")
+    base, ponto, ext = nome.rpartition(".")
+    if not ponto or not base:
+        base, ext = nome, ""
+    nome_fp = f"{base}.{digest[:ASSET_HASH_LENGTH]}"
+    if ext:
+        nome_fp = f"{nome_fp}.{ext}"
+    return f"{pasta}/{nome_fp}" if pasta else nome_fp
+
+
+def _gravar_atomico(destino, dados):
+    destino = Path(destino)
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=str(destino.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(dados)
+        os.replace(tmp_path, destino)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _comprimir_variantes(origem, build_dir, nome_fp):
+    variantes = {}
+    plain = None
+
+    compressores = [("gzip", ".gz", lambda dados: gzip.compress(dados, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressores.insert(0, ("br", ".br", lambda dados: brotli.compress(dados, quality=11)))
+
+    for encoding, sufixo, comprimir in compressores:
+        rel_variante = f"{nome_fp}{sufixo}"
+        destino = Path(build_dir) / rel_variante
+        if not destino.exists():
+            if plain is None:
+                plain = Path(origem).read_bytes()
+            dados = comprimir(plain)
+            if len(dados) >= len(plain):
+                continue
+            _gravar_atomico(destino, dados)
+        variantes[encoding] = {
+            "path": rel_variante,
+            "size": destino.stat().st_size,
+        }
+
+    return variantes
+
+
+def _iter_assets(assets_dir, build_dir):
+    root = Path(assets_dir).resolve()
+    build = Path(build_dir).resolve()
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        if build == path or build in path.parents:
+            continue
+        if path.name in ASSET_IGNORED_FILES or path.suffix.lower() in ASSET_IGNORED_SUFFIXES:
+            continue
+        yield path, path.relative_to(root).as_posix()
+
+
+def construir_pipeline_assets(assets_dir, build_dir, min_compress_bytes=ASSET_MIN_COMPRESS_BYTES):
+    """Gera manifesto com hash de conteudo e variantes .br/.gz para os arquivos de assets."""
+    build = Path(build_dir)
+    build.mkdir(parents=True, exist_ok=True)
+    try:
+        anteriores = carregar_manifesto_assets(build).get("files", {})
+    except (OSError, ValueError):
+        anteriores = {}
+
+    arquivos = {}
+    for path, rel in _iter_assets(assets_dir, build):
+        digest = _hash_arquivo(path)
+        nome_fp = nome_fingerprint_asset(rel, digest)
+        tamanho = path.stat().st_size
+
+        variantes = {}
+        anterior = anteriores.get(rel) or {}
+        if anterior.get("hash") == digest and all(
+            (build / info["path"]).exists() for info in (anterior.get("encodings") or {}).values()
+        ):
+            # Mesmo conteudo do ultimo boot: nao recomprime (inclusive variantes descartadas por nao encolher).
+            variantes = anterior.get("encodings") or {}
+        elif path.suffix.lower() in ASSET_COMPRESSIBLE_EXTENSIONS and tamanho >= min_compress_bytes:
+            variantes = _comprimir_variantes(path, build, nome_fp)
+
+        arquivos[rel] = {
+            "path": rel,
+            "hash": digest,
+            "fingerprinted": nome_fp,
+            "size": tamanho,
+            "mimetype": mimetypes.guess_type(rel)[0] or "application/octet-stream",
+            "encodings": variantes,
+        }
+
+    manifesto = {
+        "version": 1,
+        "files": arquivos,
+    }
+    _gravar_atomico(
+        build / ASSET_MANIFEST_NAME,
+        json.dumps(manifesto, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifesto
+
+
+def formatos_imagem_suportados():
+    if Image is None:
+        return ()
+    suportados = []
+    for formato in IMAGE_VARIANT_FORMATS:
+        try:
+            if pil_features.check(formato):
+                suportados.append(formato)
+        except Exception:
+            continue
+    return tuple(suportados)
+
+
+def _salvar_variante_imagem(imagem, destino, formato):
+    buffer = io.BytesIO()
+    opcoes = {"quality": IMAGE_VARIANT_QUALITY.get(formato, 75)}
+    if formato == "webp":
+        opcoes["method"] = 5
+    elif formato == "avif":
+        opcoes["speed"] = 7
+    imagem.save(buffer, format=formato.upper(), **opcoes)
+    _gravar_atomico(destino, buffer.getvalue())
+
+
+def _gerar_variantes_arquivo(path, rel, digest, build, larguras, formatos):
+    with Image.open(path) as original:
+        largura_original, altura_original = original.size
+        alvo_larguras = sorted({w for w in larguras if w < largura_original} | {largura_original})
+        base = None
+        variantes = {formato: [] for formato in formatos}
+
+        for largura in alvo_larguras:
+            altura = max(1, round(altura_original * largura / largura_original))
+            for formato in formatos:
+                nome = nome_fingerprint_asset(rel, digest)
+                rel_variante = f"{IMAGE_VARIANTS_PREFIX}/{nome}.w{largura}.{formato}"
+                destino = build / rel_variante
+                if not destino.exists():
+                    if base is None:
+                        modo = "RGBA" if original.mode in {"RGBA", "LA", "P"} else "RGB"
+                        base = original.convert(modo)
+                    redimensionada = base if largura == largura_original else base.resize(
+                        (largura, altura), Image.LANCZOS
+                    )
+                    _salvar_variante_imagem(redimensionada, destino, formato)
+                variantes[formato].append({
+                    "path": rel_variante,
+                    "width": largura,
+                    "height": altura,
+                    "size": destino.stat().st_size,
+                })
+
+    return {
+        "path": rel,
+        "hash": digest,
+        "width": largura_original,
+        "height": altura_original,
+        "variants": {formato: itens for formato, itens in variantes.items() if itens},
+    }
+
+
+def gerar_variantes_imagens(
+    assets_dir,
+    build_dir,
+    padroes=IMAGE_VARIANT_SOURCES,
+    larguras=IMAGE_VARIANT_WIDTHS,
+    formatos=None,
+):
+    """Gera variantes AVIF/WebP redimensionadas, em cache no disco pelo hash da imagem original."""
+    formatos = tuple(formatos) if formatos is not None else formatos_imagem_suportados()
+    build = Path(build_dir)
+    build.mkdir(parents=True, exist_ok=True)
+    imagens = {}
+
+    if Image is None or not formatos:
+        manifesto = {"version": 1, "formats": [], "images": imagens}
+    else:
+        root = Path(assets_dir).resolve()
+        caminhos = set()
+        for padrao in padroes:
+            caminhos.update(path for path in root.glob(padrao) if path.is_file())
+
+        for path in sorted(caminhos):
+            rel = path.relative_to(root).as_posix()
+            try:
+                imagens[rel] = _gerar_variantes_arquivo(
+                    path, rel, _hash_arquivo(path), build, larguras, formatos
+                )
+            except Exception as exc:
+                print(f"[ASSETS] Falha ao gerar variantes de {rel}: {exc}", flush=True)
+
+        manifesto = {"version": 1, "formats": list(formatos), "images": imagens}
+
+    _gravar_atomico(
+        build / IMAGE_MANIFEST_NAME,
+        json.dumps(manifesto, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"),
+    )
+    return manifesto
+
+
+def indexar_variantes_imagens(manifesto_imagens):
+    indice = {}
+    for info in (manifesto_imagens or {}).get("images", {}).values():
+        for formato, itens in (info.get("variants") or {}).items():
+            for item in itens:
+                indice[item["path"]] = {
+                    "fingerprinted": item["path"],
+                    "build_path": item["path"],
+                    "mimetype": IMAGE_VARIANT_MIMETYPES.get(formato, "application/octet-stream"),
+                    "encodings": {},
+                }
+    return indice
+
+
+def carregar_manifesto_assets(build_dir):
+    caminho = Path(build_dir) / ASSET_MANIFEST_NAME
+    if not caminho.exists():
+        return {"version": 1, "files": {}}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def carregar_manifesto_imagens(build_dir):
+    caminho = Path(build_dir) / IMAGE_MANIFEST_NAME
+    if not caminho.exists():
+        return {"version": 1, "formats": [], "images": {}}
+    with open(caminho, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def indexar_fingerprints(manifesto):
+    return {
+        info["fingerprinted"]: info
+        for info in (manifesto or {}).get("files", {}).values()
+        if info.get("fingerprinted")
+    }
+
+
+_ACCEPT_ENCODING_RE = re.compile(r"^\s*([A-Za-z0-9*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$")
+
+
+def escolher_encoding_asset(accept_encoding, disponiveis):
+    """Retorna 'br', 'gzip' ou None conforme Accept-Encoding e variantes existentes."""
+    aceitos = {}
+    for item in (accept_encoding or "").split(","):
+        match = _ACCEPT_ENCODING_RE.match(item)
+        if not match:
+            continue
+        nome = match.group(1).lower()
+        try:
+            q = float(match.group(2)) if match.group(2) is not None else 1.0
+        except ValueError:
+            q = 0.0
+        aceitos[nome] = q
+
+    for encoding in ASSET_ENCODINGS_PREFERENCE:
+        if encoding not in (disponiveis or {}):
+            continue
+        q = aceitos.get(encoding, aceitos.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+if __name__ == "__main__":
+    import sys
+
+    raiz = Path(__file__).resolve().parent
+    destino = sys.argv[1] if len(sys.argv) > 1 else str(raiz / ".assets-build")
+    resultado = construir_pipeline_assets(raiz / "assets", destino)
+    print(f"{len(resultado['files'])} assets processados em {destino}")
+    imagens = gerar_variantes_imagens(raiz / "assets", destino)
+    print(f"{len(imagens['images'])} imagens com variantes {imagens['formats']} em {destino}")
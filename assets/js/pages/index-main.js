@@ -96,7 +96,7 @@
         const period = imgEl.getAttribute("data-period") || "";
         const gain = imgEl.getAttribute("data-gain") || "";
         const cumulative = imgEl.getAttribute("data-cumulative") || "";
-        modalImg.src = imgEl.currentSrc || imgEl.src || "";
+        modalImg.src = imgEl.getAttribute("data-full-src") || imgEl.currentSrc || imgEl.src || "";
         modalImg.alt = `Relatório mensal ampliado ${month}`.trim();
         modalTitle.textContent = `${month} • ${period} • ${gain} • Acumulado ${cumulative}`.trim();
         modal.classList.add("is-open");
@@ -160,16 +160,22 @@
       track.innerHTML = items.map((item) => `
         <article class="report-card ${item.status || "neutral"}">
           <div class="report-image">
+            <picture>
+              ${(item.image_sources || []).map((source) => `
+              <source type="${source.type}" srcset="${source.srcset}" sizes="(max-width: 900px) 92vw, min(82vw, 920px)">`).join("")}
             <img
               src="${item.image_url}"
+              data-full-src="${item.image_url}"
               alt="Relatório mensal ${item.month}"
               loading="lazy"
+              decoding="async"
               data-month="${item.month}"
               data-period="Início: dia ${item.start_day} | Fim: dia ${item.end_day}"
               data-gain="${item.gain}"
               data-cumulative="${item.cumulative_gain || "R$ 0,00"}"
               onerror="this.style.opacity=.28; this.alt='Imagem indisponível';"
             >
+            </picture>
           </div>
           <div class="report-body">
             <h3 class="report-month">${item.month}</h3>
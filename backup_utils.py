@@ -1,20 +1,74 @@
+import argparse
+import getpass
 import hashlib
+import io
 import json
 import os
+import re
+import struct
+import sys
 import tarfile
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
-from database import exportar_snapshot_publico
+from database import (
+    abrir_snapshot_exportado,
+    ajustar_sequencias_tabela,
+    carregar_tabela_de,
+    conectar_destino_restore,
+    copiar_tabela_para,
+    exportar_snapshot_publico,
+    garantir_tabela_restore,
+    resumir_watermark_tabela,
+)
 
 BACKUP_MAGIC = b"TRXBK1"
+BACKUP_STREAM_MAGIC = b"TRXBK2"
+BACKUP_CHUNK_SIZE = 1024 * 1024
 PBKDF2_ITERATIONS = 390000
 
+# Formato TRXBK2: header = magic(6) + salt(16) + prefixo_nonce(8) + chunk_size(4)
+# seguido de frames tipo(1) + tamanho(4) + ciphertext. Nonce = prefixo + indice(4);
+# o AAD amarra header, tipo e indice (sem reordenar/trocar frames). O ultimo frame
+# (FINAL) cifra o rodape JSON com contagem e sha256 do texto puro (detecta truncamento).
+_STREAM_HEADER = struct.Struct(">6s16s8sI")
+_FRAME_HEADER = struct.Struct(">BI")
+_FRAME_DATA = 1
+_FRAME_FINAL = 2
+_COPY_BUFFER = 1024 * 1024
+
+BACKUP_DB_EXPORT_MODES = ("copy", "json")
+BACKUP_DB_COPY_FORMATS = ("csv", "binary")
+BACKUP_DB_MEMBER_DIR = "database"
+BACKUP_DB_MANIFEST = "database/manifest.json"
+# Cada tabela vai para um spool (memoria ate este limite, depois disco) antes de
+# entrar no tar: o header do membro precisa do tamanho antes do conteudo.
+BACKUP_DB_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Limite por e-mail: o anexo vai em base64 (+33%) num JSON para o Apps Script/Gmail.
+BACKUP_PART_MAX_BYTES = 15 * 1024 * 1024
+
+BACKUP_STATE_VERSION = 1
+BACKUP_MANIFEST = "backup_manifest.json"
+BACKUP_FILES_DIR = "files"
+BACKUP_CHUNKS_DIR = "chunks"
+BACKUP_DEDUP_CHUNK_SIZE = 1024 * 1024
+# Tabelas so de insercao: no incremental saem so as linhas acima do watermark da coluna.
+# backup_runs nao entra: a entrega atualiza status/parts das linhas ja existentes.
+BACKUP_APPEND_ONLY_TABLES = {
+    "analytics_funnel_events": "id",
+    "analytics_purchase_events": "id",
+}
+
 EXCLUDED_DIRS = {
     ".git",
     "__pycache__",
@@ -26,6 +80,7 @@ EXCLUDED_DIRS = {
     "auth",
     "saida",
     "backups",
+    ".assets-build",
 }
 
 EXCLUDED_FILES = {
@@ -44,12 +99,177 @@ def _derive_key(password, salt):
     return kdf.derive(password.encode("utf-8"))
 
 
-def _encrypt_bytes(plaintext, password):
-    salt = os.urandom(16)
-    nonce = os.urandom(12)
+class _HashingWriter:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.bytes_written += len(data)
+        self.fileobj.write(data)
+        return len(data)
+
+
+class EscritorCifradoStream:
+    """Recebe o tar.gz em pedacos e grava frames AES-GCM de chunk_size bytes.
+
+    A memoria fica limitada a um chunk; o sha256 do arquivo final e do texto puro
+    sao calculados durante a escrita.
+    """
+
+    def __init__(self, fileobj, password, chunk_size=BACKUP_CHUNK_SIZE):
+        salt = os.urandom(16)
+        self._prefixo = os.urandom(8)
+        self.chunk_size = int(chunk_size)
+        self._aes = AESGCM(_derive_key(password=password, salt=salt))
+        self._header = _STREAM_HEADER.pack(BACKUP_STREAM_MAGIC, salt, self._prefixo, self.chunk_size)
+        self._out = _HashingWriter(fileobj)
+        self._out.write(self._header)
+        self._buffer = bytearray()
+        self._indice = 0
+        self._plain_sha256 = hashlib.sha256()
+        self._plain_bytes = 0
+        self.footer = None
+
+    def _emitir(self, tipo, dados):
+        indice = struct.pack(">I", self._indice)
+        aad = self._header + bytes([tipo]) + indice
+        ciphertext = self._aes.encrypt(self._prefixo + indice, bytes(dados), aad)
+        self._out.write(_FRAME_HEADER.pack(tipo, len(ciphertext)))
+        self._out.write(ciphertext)
+        self._indice += 1
+
+    def write(self, data):
+        if self.footer is not None:
+            raise ValueError("Stream de backup ja foi fechado.")
+        self._plain_sha256.update(data)
+        self._plain_bytes += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.chunk_size:
+            self._emitir(_FRAME_DATA, self._buffer[:self.chunk_size])
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.footer is not None:
+            return self.footer
+        if self._buffer:
+            self._emitir(_FRAME_DATA, self._buffer)
+            self._buffer = bytearray()
+        self.footer = {
+            "chunks": self._indice,
+            "plain_bytes": self._plain_bytes,
+            "plain_sha256": self._plain_sha256.hexdigest(),
+        }
+        self._emitir(_FRAME_FINAL, json.dumps(self.footer, sort_keys=True).encode("utf-8"))
+        return self.footer
+
+    @property
+    def sha256(self):
+        return self._out.sha256.hexdigest()
+
+    @property
+    def bytes_written(self):
+        return self._out.bytes_written
+
+
+class LeitorCifradoStream:
+    """Le um backup TRXBK2 frame a frame; read() devolve o tar.gz em texto puro.
+
+    Frames adulterados, fora de ordem ou ausentes (truncamento) geram ValueError.
+    """
+
+    def __init__(self, fileobj, password):
+        self._in = fileobj
+        header = self._ler_exato(_STREAM_HEADER.size)
+        magic, salt, self._prefixo, self.chunk_size = _STREAM_HEADER.unpack(header)
+        if magic != BACKUP_STREAM_MAGIC:
+            raise ValueError("Arquivo nao e um backup TRXBK2.")
+        self._header = header
+        self._aes = AESGCM(_derive_key(password=password, salt=salt))
+        self._buffer = bytearray()
+        self._indice = 0
+        self._plain_sha256 = hashlib.sha256()
+        self._plain_bytes = 0
+        self.footer = None
+
+    def _ler_exato(self, tamanho):
+        dados = self._in.read(tamanho)
+        if len(dados) != tamanho:
+            raise ValueError("Backup truncado.")
+        return dados
+
+    def _proximo_frame(self):
+        tipo, tamanho = _FRAME_HEADER.unpack(self._ler_exato(_FRAME_HEADER.size))
+        if tipo not in (_FRAME_DATA, _FRAME_FINAL) or tamanho > self.chunk_size + 4096:
+            raise ValueError("Frame de backup invalido.")
+        ciphertext = self._ler_exato(tamanho)
+        indice = struct.pack(">I", self._indice)
+        try:
+            dados = self._aes.decrypt(self._prefixo + indice, ciphertext, self._header + bytes([tipo]) + indice)
+        except InvalidTag:
+            raise ValueError("Falha de autenticacao do backup (senha incorreta ou arquivo adulterado).")
+
+        if tipo == _FRAME_DATA:
+            self._indice += 1
+            self._plain_sha256.update(dados)
+            self._plain_bytes += len(dados)
+            self._buffer += dados
+            return
+
+        footer = json.loads(dados.decode("utf-8"))
+        if (
+            footer.get("chunks") != self._indice
+            or footer.get("plain_bytes") != self._plain_bytes
+            or footer.get("plain_sha256") != self._plain_sha256.hexdigest()
+        ):
+            raise ValueError("Rodape do backup nao confere com o conteudo.")
+        if self._in.read(1):
+            raise ValueError("Dados extras apos o fim do backup.")
+        self.footer = footer
+
+    def read(self, size=-1):
+        while self.footer is None and (size is None or size < 0 or len(self._buffer) < size):
+            self._proximo_frame()
+        if size is None or size < 0:
+            size = len(self._buffer)
+        dados = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return dados
+
+    def drenar(self):
+        """Consome o restante (ex.: tar ja extraido) para validar o rodape."""
+        while self.footer is None:
+            self._proximo_frame()
+            self._buffer.clear()
+        return self.footer
+
+
+def _decrypt_legacy(fileobj, password):
+    dados = fileobj.read()
+    salt = dados[len(BACKUP_MAGIC):len(BACKUP_MAGIC) + 16]
+    nonce = dados[len(BACKUP_MAGIC) + 16:len(BACKUP_MAGIC) + 28]
     key = _derive_key(password=password, salt=salt)
-    ciphertext = AESGCM(key).encrypt(nonce=nonce, data=plaintext, associated_data=None)
-    return BACKUP_MAGIC + salt + nonce + ciphertext
+    try:
+        return AESGCM(key).decrypt(nonce, dados[len(BACKUP_MAGIC) + 28:], None)
+    except InvalidTag:
+        raise ValueError("Falha de autenticacao do backup (senha incorreta ou arquivo adulterado).")
+
+
+def abrir_backup_descriptografado(fileobj, password):
+    """Retorna um leitor do tar.gz em texto puro (TRXBK2 em streaming; TRXBK1 legado em memoria)."""
+    magic = fileobj.read(len(BACKUP_STREAM_MAGIC))
+    fileobj.seek(0)
+    if magic == BACKUP_STREAM_MAGIC:
+        return LeitorCifradoStream(fileobj, password)
+    if magic == BACKUP_MAGIC:
+        return io.BytesIO(_decrypt_legacy(fileobj, password))
+    raise ValueError("Formato de backup desconhecido.")
 
 
 def _iter_project_files(project_root):
@@ -75,18 +295,261 @@ def _write_database_snapshot_json(target_path):
         json.dump(snapshot, f, ensure_ascii=False, indent=2)
 
 
-def _build_plain_backup_tar(project_root, tar_output_path):
-    with tempfile.TemporaryDirectory(prefix="trxbkp-db-") as tmp_dir:
-        db_snapshot_path = Path(tmp_dir) / "database_snapshot.json"
-        _write_database_snapshot_json(db_snapshot_path)
+def _add_bytes_member(tar, arcname, data):
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _copy_table_to_spool(tabela, snapshot_id, formato, filtro=None):
+    spool = tempfile.SpooledTemporaryFile(max_size=BACKUP_DB_SPOOL_MAX_BYTES, prefix="trxbkp-copy-")
+    try:
+        escritor = _HashingWriter(spool)
+        inicio = time.perf_counter()
+        linhas = copiar_tabela_para(tabela, escritor, snapshot_id=snapshot_id, formato=formato, filtro=filtro)
+        duracao = time.perf_counter() - inicio
+        spool.seek(0)
+    except Exception:
+        spool.close()
+        raise
+    return spool, {
+        "rows": linhas,
+        "bytes": escritor.bytes_written,
+        "sha256": escritor.sha256.hexdigest(),
+        "seconds": round(duracao, 3),
+    }
+
+
+def _add_spool_member(tar, arcname, spool, size):
+    info = tarfile.TarInfo(arcname)
+    info.size = size
+    info.mtime = int(time.time())
+    info.mode = 0o600
+    tar.addfile(info, spool)
+
+
+def _plano_tabela(conn, tabela, anterior):
+    """Decide se a tabela so-insercao sai incremental (acima do watermark) ou completa."""
+    coluna = BACKUP_APPEND_ONLY_TABLES.get(tabela)
+    if not coluna:
+        return None
+    ate = anterior.get("watermark") if anterior and anterior.get("column") == coluna else None
+    maximo, linhas_ate = resumir_watermark_tabela(conn, tabela, coluna, ate)
+    # Se a contagem ate o watermark antigo mudou (DELETE ou insert que commitou atrasado
+    # com id menor), a cadeia nao reconstruiria a tabela: exporta completa.
+    if ate is not None and linhas_ate == anterior.get("rows"):
+        return {"column": coluna, "from": ate, "to": ate if maximo is None else max(maximo, ate), "base_rows": linhas_ate}
+    return {"column": coluna, "from": None, "to": maximo, "base_rows": 0}
+
 
-        with tarfile.open(tar_output_path, "w:gz") as tar:
-            tar.add(db_snapshot_path, arcname="database_snapshot.json")
-            for abs_path, rel_path in _iter_project_files(project_root):
-                tar.add(abs_path, arcname=str(rel_path).replace("\\", "/"))
+def exportar_tabelas_para_tar(tar, formato="csv", workers=2, tabelas_anteriores=None):
+    """Exporta cada tabela publica via COPY para um membro do tar, mais um manifest.
 
+    Todas as conexoes usam o mesmo snapshot exportado, entao o conjunto e consistente
+    mesmo com `workers` > 1 exportando tabelas em paralelo. Com `tabelas_anteriores`
+    (estado do backup anterior), as tabelas de BACKUP_APPEND_ONLY_TABLES saem so com
+    as linhas acima do watermark.
+    """
+    if formato not in BACKUP_DB_COPY_FORMATS:
+        raise ValueError(f"Formato de exportacao invalido: {formato}")
 
-def criar_backup_criptografado(project_root, output_dir, password):
+    extensao = "copy" if formato == "binary" else "csv"
+    conn, snapshot_id, tabelas, schema = abrir_snapshot_exportado()
+    manifesto = {
+        "version": 1,
+        "format": formato,
+        "exported_at": datetime.utcnow().isoformat() + "Z",
+        "tables": {},
+    }
+    try:
+        planos = {
+            tabela: _plano_tabela(conn, tabela, (tabelas_anteriores or {}).get(tabela))
+            for tabela in tabelas
+        }
+        with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="backup-copy") as pool:
+            futuros = {}
+            for tabela in tabelas:
+                plano = planos[tabela]
+                filtro = None
+                if plano and plano["from"] is not None:
+                    filtro = (plano["column"], plano["from"], plano["to"])
+                futuros[pool.submit(_copy_table_to_spool, tabela, snapshot_id, formato, filtro)] = tabela
+
+            # O tar so aceita um escritor: os membros entram na ordem em que as COPY terminam.
+            for futuro in as_completed(futuros):
+                tabela = futuros[futuro]
+                spool, info = futuro.result()
+                membro = f"{BACKUP_DB_MEMBER_DIR}/{tabela}.{extensao}"
+                try:
+                    _add_spool_member(tar, membro, spool, info["bytes"])
+                finally:
+                    spool.close()
+                item = {"member": membro, "columns": schema.get(tabela, []), **info}
+                plano = planos[tabela]
+                item["mode"] = "incremental" if plano and plano["from"] is not None else "full"
+                if plano:
+                    item.update({
+                        "watermark_column": plano["column"],
+                        "watermark_from": plano["from"],
+                        "watermark_to": plano["to"],
+                        "rows_total": plano["base_rows"] + info["rows"],
+                    })
+                manifesto["tables"][tabela] = item
+    finally:
+        try:
+            conn.rollback()
+        finally:
+            conn.close()
+
+    manifesto["tables"] = dict(sorted(manifesto["tables"].items()))
+    _add_bytes_member(
+        tar,
+        BACKUP_DB_MANIFEST,
+        json.dumps(manifesto, ensure_ascii=False, indent=2, default=str).encode("utf-8"),
+    )
+    return manifesto
+
+
+def _add_project_files(tar, project_root, backup_name, chunks, incremental):
+    """Adiciona os arquivos do projeto e devolve o indice {arquivo: chunks sha256}.
+
+    Backup completo: o arquivo vai inteiro para files/<rel> e cada chunk aponta para
+    (backup, membro, offset, tamanho). Incremental: so chunks ainda nao vistos na
+    cadeia entram, como chunks/<sha256>; o resto e so referencia.
+    """
+    arquivos = {}
+    stats = {"files": 0, "chunks_new": 0, "chunks_reused": 0, "bytes_new": 0}
+    for abs_path, rel_path in _iter_project_files(project_root):
+        rel = str(rel_path).replace("\\", "/")
+        membro = f"{BACKUP_FILES_DIR}/{rel}"
+        hashes = []
+        offset = 0
+        spool = None if incremental else tempfile.SpooledTemporaryFile(max_size=BACKUP_DB_SPOOL_MAX_BYTES)
+        try:
+            with open(abs_path, "rb") as f:
+                for bloco in iter(lambda: f.read(BACKUP_DEDUP_CHUNK_SIZE), b""):
+                    sha = hashlib.sha256(bloco).hexdigest()
+                    hashes.append(sha)
+                    if spool is not None:
+                        spool.write(bloco)
+                    if sha in chunks:
+                        stats["chunks_reused"] += 1
+                    elif incremental:
+                        membro_chunk = f"{BACKUP_CHUNKS_DIR}/{sha}"
+                        _add_bytes_member(tar, membro_chunk, bloco)
+                        chunks[sha] = [backup_name, membro_chunk, 0, len(bloco)]
+                        stats["chunks_new"] += 1
+                        stats["bytes_new"] += len(bloco)
+                    else:
+                        chunks[sha] = [backup_name, membro, offset, len(bloco)]
+                        stats["chunks_new"] += 1
+                        stats["bytes_new"] += len(bloco)
+                    offset += len(bloco)
+            if spool is not None:
+                # Grava o que foi lido e hasheado (nao reabre o arquivo, que pode ter mudado).
+                spool.seek(0)
+                _add_spool_member(tar, membro, spool, offset)
+        finally:
+            if spool is not None:
+                spool.close()
+        arquivos[rel] = {"size": offset, "chunks": hashes}
+        stats["files"] += 1
+    return arquivos, stats
+
+
+def precisa_backup_completo(estado, full_every_days, agora=None):
+    """True sem estado anterior valido ou quando o ultimo completo tem `full_every_days` dias."""
+    if not estado or estado.get("version") != BACKUP_STATE_VERSION or full_every_days <= 0:
+        return True
+    try:
+        full_at = datetime.fromisoformat(estado["full_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return (agora or datetime.utcnow()) - full_at >= timedelta(days=full_every_days)
+
+
+def _write_plain_backup_tar(
+    project_root,
+    fileobj,
+    backup_name,
+    db_export="copy",
+    db_format="csv",
+    db_workers=2,
+    estado_anterior=None,
+):
+    if db_export not in BACKUP_DB_EXPORT_MODES:
+        raise ValueError(f"Modo de exportacao do banco invalido: {db_export}")
+
+    incremental = estado_anterior is not None
+    chunks = dict(estado_anterior.get("chunks") or {}) if incremental else {}
+    tabelas_estado = {}
+    db_manifesto = None
+
+    # Modo stream (w|gz): tar e gzip escrevem direto no fileobj, sem seek nem arquivo inteiro.
+    with tarfile.open(fileobj=fileobj, mode="w|gz") as tar:
+        if db_export == "copy":
+            db_manifesto = exportar_tabelas_para_tar(
+                tar,
+                formato=db_format,
+                workers=db_workers,
+                tabelas_anteriores=(estado_anterior or {}).get("tables") if incremental else None,
+            )
+            for tabela, item in db_manifesto["tables"].items():
+                if item.get("watermark_column") and item.get("watermark_to") is not None:
+                    tabelas_estado[tabela] = {
+                        "column": item["watermark_column"],
+                        "watermark": item["watermark_to"],
+                        "rows": item["rows_total"],
+                    }
+        else:
+            with tempfile.TemporaryDirectory(prefix="trxbkp-db-") as tmp_dir:
+                db_snapshot_path = Path(tmp_dir) / "database_snapshot.json"
+                _write_database_snapshot_json(db_snapshot_path)
+                tar.add(db_snapshot_path, arcname="database_snapshot.json")
+
+        arquivos, stats = _add_project_files(tar, project_root, backup_name, chunks, incremental)
+
+        cadeia = (list(estado_anterior.get("chain") or []) if incremental else []) + [backup_name]
+        referenciados = {sha for info in arquivos.values() for sha in info["chunks"]}
+        manifesto = {
+            "version": BACKUP_STATE_VERSION,
+            "kind": "incremental" if incremental else "full",
+            "backup": backup_name,
+            "chain": cadeia,
+            "created_at": datetime.utcnow().isoformat(),
+            "database": BACKUP_DB_MANIFEST if db_manifesto is not None else "database_snapshot.json",
+            "files": arquivos,
+            "chunks": {sha: chunks[sha] for sha in sorted(referenciados)},
+            "stats": stats,
+        }
+        _add_bytes_member(tar, BACKUP_MANIFEST, json.dumps(manifesto, ensure_ascii=False).encode("utf-8"))
+
+    # Estado para o proximo incremental (vai para backup_runs.manifest).
+    estado = {
+        "version": BACKUP_STATE_VERSION,
+        "kind": manifesto["kind"],
+        "backup": backup_name,
+        "chain": cadeia,
+        "full_at": estado_anterior["full_at"] if incremental else manifesto["created_at"],
+        "tables": tabelas_estado,
+        "chunks": {sha: chunks[sha] for sha in sorted(referenciados)},
+    }
+    return manifesto, estado
+
+
+def criar_backup_criptografado(
+    project_root,
+    output_dir,
+    password,
+    chunk_size=BACKUP_CHUNK_SIZE,
+    db_export="copy",
+    db_format="csv",
+    db_workers=2,
+    estado_anterior=None,
+):
+    """Gera o .enc; com `estado_anterior` (de um backup entregue) o backup e incremental."""
     if not password or len(password.strip()) < 10:
         raise ValueError("Senha de backup ausente ou muito curta (minimo 10 caracteres).")
 
@@ -96,35 +559,658 @@ def criar_backup_criptografado(project_root, output_dir, password):
 
     stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     backup_base_name = f"trxpro-backup-{stamp}"
+    # O nome entra na cadeia dos incrementais: dois backups no mesmo segundo nao podem colidir.
+    sufixo = 1
+    while (out_dir / f"{backup_base_name}.enc").exists():
+        sufixo += 1
+        backup_base_name = f"trxpro-backup-{stamp}-{sufixo}"
 
-    with tempfile.TemporaryDirectory(prefix="trxbkp-") as tmp_dir:
-        tar_path = Path(tmp_dir) / f"{backup_base_name}.tar.gz"
-        _build_plain_backup_tar(project_root=root, tar_output_path=tar_path)
-
-        with open(tar_path, "rb") as f:
-            plain_data = f.read()
-
-    encrypted_data = _encrypt_bytes(plaintext=plain_data, password=password)
     encrypted_path = out_dir / f"{backup_base_name}.enc"
+    partial_path = out_dir / f"{backup_base_name}.enc.partial"
 
-    with open(encrypted_path, "wb") as f:
-        f.write(encrypted_data)
     try:
-        os.chmod(encrypted_path, 0o600)
+        fd = os.open(partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            escritor = EscritorCifradoStream(f, password=password, chunk_size=chunk_size)
+            manifesto, estado = _write_plain_backup_tar(
+                project_root=root,
+                fileobj=escritor,
+                backup_name=encrypted_path.name,
+                db_export=db_export,
+                db_format=db_format,
+                db_workers=db_workers,
+                estado_anterior=estado_anterior,
+            )
+            footer = escritor.close()
+        os.replace(partial_path, encrypted_path)
     except Exception:
-        pass
-
-    sha256_hash = hashlib.sha256(encrypted_data).hexdigest()
+        partial_path.unlink(missing_ok=True)
+        raise
 
     return {
         "path": str(encrypted_path),
         "filename": encrypted_path.name,
-        "size_bytes": encrypted_path.stat().st_size,
-        "sha256": sha256_hash,
+        "size_bytes": escritor.bytes_written,
+        "sha256": escritor.sha256,
+        "format": BACKUP_STREAM_MAGIC.decode("ascii"),
+        "chunks": footer["chunks"],
+        "plain_bytes": footer["plain_bytes"],
+        "kind": manifesto["kind"],
+        "chain": manifesto["chain"],
+        "files_stats": manifesto["stats"],
+        "state": estado,
         "created_at_utc": stamp,
     }
 
 
+def descriptografar_backup(encrypted_path, output_path, password):
+    """Grava o tar.gz em texto puro a partir do .enc, em streaming."""
+    with open(encrypted_path, "rb") as origem, open(output_path, "wb") as destino:
+        leitor = abrir_backup_descriptografado(origem, password)
+        total = 0
+        for bloco in iter(lambda: leitor.read(_COPY_BUFFER), b""):
+            destino.write(bloco)
+            total += len(bloco)
+    return {"path": str(output_path), "plain_bytes": total}
+
+
+def restaurar_backup(encrypted_path, target_dir, password):
+    """Extrai o backup em target_dir sem materializar o tar.gz em disco."""
+    destino = Path(target_dir)
+    destino.mkdir(parents=True, exist_ok=True)
+    extraidos = 0
+    tamanho = 0
+    with open(encrypted_path, "rb") as origem:
+        leitor = abrir_backup_descriptografado(origem, password)
+        with tarfile.open(fileobj=leitor, mode="r|gz") as tar:
+            for membro in tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extract(membro, path=destino, filter="data")
+                else:  # pragma: no cover - Python sem o filtro de extracao segura
+                    alvo = (destino / membro.name).resolve()
+                    if destino.resolve() not in alvo.parents:
+                        raise ValueError(f"Caminho invalido no backup: {membro.name}")
+                    tar.extract(membro, path=destino)
+                extraidos += 1
+                tamanho += membro.size
+        if isinstance(leitor, LeitorCifradoStream):
+            leitor.drenar()
+    return {"path": str(destino), "members": extraidos, "plain_bytes": tamanho}
+
+
+def _ler_chunk(staging, localizacao, sha):
+    backup, membro, offset, tamanho = localizacao
+    with open(Path(staging) / backup / membro, "rb") as f:
+        f.seek(offset)
+        bloco = f.read(tamanho)
+    if hashlib.sha256(bloco).hexdigest() != sha:
+        raise ValueError(f"Chunk {sha[:12]} de {backup} nao confere com o manifest.")
+    return bloco
+
+
+def _montar_banco_da_cadeia(staging, nomes, destino):
+    """Junta as partes de cada tabela: a ultima exportacao completa + incrementais seguintes."""
+    partes = {}
+    formato = None
+    final = None
+    for nome in nomes:
+        caminho = Path(staging) / nome / BACKUP_DB_MANIFEST
+        if not caminho.exists():
+            continue
+        manifesto = json.loads(caminho.read_text(encoding="utf-8"))
+        if formato and manifesto["format"] != formato:
+            raise ValueError("Backups da cadeia usam formatos de COPY diferentes.")
+        formato = manifesto["format"]
+        final = manifesto
+        for tabela, item in manifesto["tables"].items():
+            if item.get("mode") != "incremental":
+                partes[tabela] = []
+            partes.setdefault(tabela, []).append((nome, item))
+
+    if final is None:
+        return None
+
+    extensao = "copy" if formato == "binary" else "csv"
+    resultado = {"version": 1, "format": formato, "exported_at": final["exported_at"], "tables": {}}
+    for tabela, item_final in final["tables"].items():
+        lista = []
+        for indice, (nome, item) in enumerate(partes.get(tabela, [])):
+            rel = f"{BACKUP_DB_MEMBER_DIR}/{tabela}/{indice:04d}.{extensao}"
+            alvo = Path(destino) / rel
+            alvo.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(Path(staging) / nome / item["member"], alvo)
+            lista.append({
+                "member": rel,
+                "source": nome,
+                "rows": item["rows"],
+                "bytes": item["bytes"],
+                "sha256": item["sha256"],
+            })
+        resultado["tables"][tabela] = {
+            "columns": item_final.get("columns", []),
+            "rows": sum(parte["rows"] for parte in lista),
+            "parts": lista,
+        }
+
+    (Path(destino) / BACKUP_DB_MANIFEST).write_text(
+        json.dumps(resultado, ensure_ascii=False, indent=2, default=str), encoding="utf-8"
+    )
+    return resultado
+
+
+def restaurar_cadeia_backups(encrypted_paths, target_dir, password):
+    """Reconstroi um restore completo a partir do backup completo + incrementais, em ordem.
+
+    Saida: files/<arquivos do projeto> e database/<tabela>/<parte> com database/manifest.json
+    listando as partes de cada tabela na ordem de carga.
+    """
+    destino = Path(target_dir)
+    destino.mkdir(parents=True, exist_ok=True)
+    caminhos = [Path(p) for p in encrypted_paths]
+    nomes = [p.name for p in caminhos]
+
+    extraido = 0
+    with tempfile.TemporaryDirectory(prefix=".trxbkp-restore-", dir=str(destino)) as staging:
+        for caminho in caminhos:
+            extraido += restaurar_backup(caminho, Path(staging) / caminho.name, password)["plain_bytes"]
+
+        caminho_manifesto = Path(staging) / nomes[-1] / BACKUP_MANIFEST
+        if not caminho_manifesto.exists():
+            raise ValueError(f"{nomes[-1]} nao tem {BACKUP_MANIFEST} (formato anterior ao incremental).")
+        final = json.loads(caminho_manifesto.read_text(encoding="utf-8"))
+        if final["chain"] != nomes:
+            raise ValueError(f"Cadeia de backups incompleta ou fora de ordem; esperado: {final['chain']}")
+
+        raiz_arquivos = (destino / BACKUP_FILES_DIR).resolve()
+        for rel, info in final["files"].items():
+            alvo = (raiz_arquivos / rel).resolve()
+            if raiz_arquivos not in alvo.parents:
+                raise ValueError(f"Caminho invalido no manifest: {rel}")
+            alvo.parent.mkdir(parents=True, exist_ok=True)
+            with open(alvo, "wb") as saida:
+                for sha in info["chunks"]:
+                    saida.write(_ler_chunk(staging, final["chunks"][sha], sha))
+
+        final["restored_chain"] = True
+        (destino / BACKUP_MANIFEST).write_text(json.dumps(final, ensure_ascii=False), encoding="utf-8")
+        banco = _montar_banco_da_cadeia(staging, nomes, destino)
+        if banco is None and (Path(staging) / nomes[-1] / "database_snapshot.json").exists():
+            os.replace(Path(staging) / nomes[-1] / "database_snapshot.json", destino / "database_snapshot.json")
+
+    return {
+        "path": str(destino),
+        "chain": nomes,
+        "plain_bytes": extraido,
+        "files": len(final["files"]),
+        "tables": {tabela: item["rows"] for tabela, item in (banco or {}).get("tables", {}).items()},
+    }
+
+
+BENCH_TABLE = "bench_restore_events"
+BENCH_COLUMNS = [
+    {"name": "id", "type": "bigint", "nullable": False},
+    {"name": "event_name", "type": "text", "nullable": False},
+    {"name": "created_at", "type": "timestamp without time zone", "nullable": False},
+    {"name": "payload", "type": "text", "nullable": True},
+]
+
+
+def _fase(segundos, bytes_processados=0, linhas=None):
+    segundos = max(segundos, 1e-9)
+    fase = {
+        "seconds": round(segundos, 3),
+        "bytes": bytes_processados,
+        "mb_s": round(bytes_processados / (1024 * 1024) / segundos, 2),
+    }
+    if linhas is not None:
+        fase["rows"] = linhas
+        fase["rows_s"] = round(linhas / segundos, 1)
+    return fase
+
+
+class _ContadorLinhasCsv:
+    """Conta registros de um CSV do COPY em streaming (quebra de linha dentro de aspas nao conta)."""
+
+    def __init__(self):
+        self._dentro_aspas = False
+        self._quebras = 0
+        self._ultimo = b"\n"
+
+    def atualizar(self, bloco):
+        if not bloco:
+            return
+        if b'"' not in bloco:
+            if not self._dentro_aspas:
+                self._quebras += bloco.count(b"\n")
+        else:
+            # Aspas escapadas ("") alternam duas vezes: a paridade continua certa.
+            for indice, trecho in enumerate(bloco.split(b'"')):
+                if indice:
+                    self._dentro_aspas = not self._dentro_aspas
+                if not self._dentro_aspas:
+                    self._quebras += trecho.count(b"\n")
+        self._ultimo = bloco[-1:]
+
+    def total(self):
+        registros = self._quebras + (0 if self._ultimo == b"\n" else 1)
+        return max(0, registros - 1)  # HEADER true
+
+
+class _ContadorLinhasBinario:
+    """Conta tuplas do COPY binario: assinatura + flags + extensao, depois int16 campos (-1 = fim)."""
+
+    _ASSINATURA = b"PGCOPY\n\xff\r\n\x00"
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._estado = "header"
+        self._pular = 0
+        self._campos = 0
+        self._linhas = 0
+
+    def atualizar(self, bloco):
+        self._buffer += bloco
+        buf = self._buffer
+        pos = 0
+        while self._estado != "fim":
+            if self._pular:
+                passo = min(self._pular, len(buf) - pos)
+                pos += passo
+                self._pular -= passo
+                if self._pular:
+                    break
+                continue
+            if self._estado == "header":
+                if len(buf) - pos < 19:
+                    break
+                if bytes(buf[pos:pos + 11]) != self._ASSINATURA:
+                    raise ValueError("Arquivo COPY binario sem assinatura PGCOPY.")
+                self._pular = struct.unpack_from(">I", buf, pos + 15)[0]
+                pos += 19
+                self._estado = "tupla"
+            elif self._estado == "tupla":
+                if len(buf) - pos < 2:
+                    break
+                campos = struct.unpack_from(">h", buf, pos)[0]
+                pos += 2
+                if campos == -1:
+                    self._estado = "fim"
+                else:
+                    self._linhas += 1
+                    self._campos = campos
+                    self._estado = "campo" if campos else "tupla"
+            else:
+                if len(buf) - pos < 4:
+                    break
+                tamanho = struct.unpack_from(">i", buf, pos)[0]
+                pos += 4
+                self._pular = max(0, tamanho)
+                self._campos -= 1
+                if not self._campos:
+                    self._estado = "tupla"
+        del buf[:pos]
+
+    def total(self):
+        return self._linhas
+
+
+def _partes_restore(manifesto_db):
+    """Partes por tabela, tanto do restore de um backup quanto do restore da cadeia."""
+    return {
+        tabela: item["parts"] if "parts" in item else [item]
+        for tabela, item in manifesto_db["tables"].items()
+    }
+
+
+def verificar_restore(target_dir):
+    """Confere sha256, tamanho e linhas de cada parte do banco (e os arquivos) contra os manifests."""
+    raiz = Path(target_dir)
+    inicio = time.perf_counter()
+    erros = []
+    tabelas = {}
+    total_bytes = 0
+    total_linhas = 0
+
+    caminho_db = raiz / BACKUP_DB_MANIFEST
+    if caminho_db.exists():
+        manifesto_db = json.loads(caminho_db.read_text(encoding="utf-8"))
+        binario = manifesto_db["format"] == "binary"
+        for tabela, partes in _partes_restore(manifesto_db).items():
+            linhas_tabela = 0
+            for parte in partes:
+                caminho = raiz / parte["member"]
+                if not caminho.exists():
+                    erros.append(f"{parte['member']}: ausente")
+                    continue
+                contador = _ContadorLinhasBinario() if binario else _ContadorLinhasCsv()
+                sha = hashlib.sha256()
+                tamanho = 0
+                with open(caminho, "rb") as f:
+                    for bloco in iter(lambda: f.read(_COPY_BUFFER), b""):
+                        sha.update(bloco)
+                        contador.atualizar(bloco)
+                        tamanho += len(bloco)
+                linhas = contador.total()
+                if tamanho != parte["bytes"] or sha.hexdigest() != parte["sha256"]:
+                    erros.append(f"{parte['member']}: sha256/tamanho diferente do manifest")
+                if linhas != parte["rows"]:
+                    erros.append(f"{parte['member']}: {linhas} linhas, manifest diz {parte['rows']}")
+                linhas_tabela += linhas
+                total_bytes += tamanho
+            tabelas[tabela] = {"rows": linhas_tabela, "parts": len(partes)}
+            total_linhas += linhas_tabela
+
+    arquivos = 0
+    caminho_manifesto = raiz / BACKUP_MANIFEST
+    if caminho_manifesto.exists():
+        manifesto = json.loads(caminho_manifesto.read_text(encoding="utf-8"))
+        # Um incremental extraido sozinho so tem os chunks novos; so completo ou cadeia tem tudo.
+        if manifesto.get("kind") == "full" or manifesto.get("restored_chain"):
+            for rel, info in manifesto["files"].items():
+                caminho = raiz / BACKUP_FILES_DIR / rel
+                hashes = []
+                if caminho.exists():
+                    with open(caminho, "rb") as f:
+                        for bloco in iter(lambda: f.read(BACKUP_DEDUP_CHUNK_SIZE), b""):
+                            hashes.append(hashlib.sha256(bloco).hexdigest())
+                            total_bytes += len(bloco)
+                if not caminho.exists() or hashes != info["chunks"]:
+                    erros.append(f"{BACKUP_FILES_DIR}/{rel}: conteudo diferente do manifest")
+                arquivos += 1
+
+    resultado = _fase(time.perf_counter() - inicio, total_bytes, total_linhas)
+    resultado.update({"ok": not erros, "errors": erros, "tables": tabelas, "files": arquivos})
+    return resultado
+
+
+def carregar_restore_no_banco(target_dir, dsn, truncar=False):
+    """COPY FROM de cada parte, na ordem do manifest, em um Postgres (uma transacao por tabela)."""
+    raiz = Path(target_dir)
+    manifesto_db = json.loads((raiz / BACKUP_DB_MANIFEST).read_text(encoding="utf-8"))
+    formato = manifesto_db["format"]
+    inicio = time.perf_counter()
+    total_bytes = 0
+    total_linhas = 0
+    tabelas = {}
+
+    conn = conectar_destino_restore(dsn)
+    try:
+        cur = conn.cursor()
+        for tabela, partes in _partes_restore(manifesto_db).items():
+            colunas = manifesto_db["tables"][tabela].get("columns") or []
+            inicio_tabela = time.perf_counter()
+            garantir_tabela_restore(cur, tabela, colunas, truncar=truncar)
+            linhas = 0
+            for parte in partes:
+                with open(raiz / parte["member"], "rb") as f:
+                    linhas += carregar_tabela_de(cur, tabela, f, formato, [c["name"] for c in colunas])
+                total_bytes += parte["bytes"]
+            esperado = sum(parte["rows"] for parte in partes)
+            if linhas != esperado:
+                raise ValueError(f"{tabela}: {linhas} linhas carregadas, manifest diz {esperado}.")
+            ajustar_sequencias_tabela(cur, tabela)
+            conn.commit()
+            total_linhas += linhas
+            tabelas[tabela] = {"rows": linhas, "seconds": round(time.perf_counter() - inicio_tabela, 3)}
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    resultado = _fase(time.perf_counter() - inicio, total_bytes, total_linhas)
+    resultado["tables"] = tabelas
+    return resultado
+
+
+def recuperar_backup(encrypted_paths, target_dir, password, dsn=None, truncar=False):
+    """Restore medido por fase: descriptografa/extrai a cadeia, verifica e (com dsn) carrega no Postgres."""
+    caminhos = [Path(p) for p in encrypted_paths]
+    cifrados = sum(caminho.stat().st_size for caminho in caminhos)
+    fases = {}
+    inicio = time.perf_counter()
+
+    restaurado = restaurar_cadeia_backups(caminhos, target_dir, password)
+    fases["decrypt_extract"] = _fase(time.perf_counter() - inicio, restaurado["plain_bytes"])
+    fases["decrypt_extract"]["encrypted_bytes"] = cifrados
+
+    verificacao = verificar_restore(target_dir)
+    fases["verify"] = _fase(verificacao["seconds"], verificacao["bytes"], verificacao["rows"])
+    if not verificacao["ok"]:
+        raise ValueError("Restore nao confere com o manifest: " + "; ".join(verificacao["errors"][:5]))
+
+    carga = None
+    if dsn:
+        carga = carregar_restore_no_banco(target_dir, dsn, truncar=truncar)
+        fases["load"] = _fase(carga["seconds"], carga["bytes"], carga["rows"])
+
+    fases["total"] = _fase(time.perf_counter() - inicio, restaurado["plain_bytes"], verificacao["rows"])
+    return {
+        "path": restaurado["path"],
+        "chain": restaurado["chain"],
+        "files": verificacao["files"],
+        "tables": verificacao["tables"],
+        "loaded": carga["tables"] if carga else None,
+        "phases": fases,
+    }
+
+
+def _gerar_csv_sintetico(destino, tamanho_bytes, linhas_por_lote=20000):
+    """CSV no formato do COPY (HEADER) com ~tamanho_bytes; payload aleatorio evita compressao irreal."""
+    escritor = _HashingWriter(destino)
+    escritor.write(b"id,event_name,created_at,payload\n")
+    eventos = (b"page_view", b"checkout_start", b"purchase")
+    proximo_id = 1
+    while escritor.bytes_written < tamanho_bytes:
+        aleatorio = os.urandom(8 * linhas_por_lote).hex().encode("ascii")
+        escritor.write(b"".join(
+            b"%d,%s,2026-01-01 00:00:00,%s\n" % (proximo_id + i, eventos[i % 3], aleatorio[16 * i:16 * i + 16])
+            for i in range(linhas_por_lote)
+        ))
+        proximo_id += linhas_por_lote
+    return {"rows": proximo_id - 1, "bytes": escritor.bytes_written, "sha256": escritor.sha256.hexdigest()}
+
+
+def criar_backup_sintetico(output_dir, password, tamanho_mb, chunk_size=BACKUP_CHUNK_SIZE):
+    """Backup TRXBK2 completo com uma tabela sintetica de ~tamanho_mb MB (para o benchmark de restore)."""
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    caminho = out_dir / "trxpro-backup-benchmark.enc"
+    membro = f"{BACKUP_DB_MEMBER_DIR}/{BENCH_TABLE}.csv"
+
+    with tempfile.TemporaryFile(dir=str(out_dir)) as dados:
+        info = _gerar_csv_sintetico(dados, int(tamanho_mb * 1024 * 1024))
+        dados.seek(0)
+        manifesto_db = {
+            "version": 1,
+            "format": "csv",
+            "exported_at": datetime.utcnow().isoformat() + "Z",
+            "tables": {BENCH_TABLE: {"member": membro, "columns": BENCH_COLUMNS, "mode": "full", **info}},
+        }
+        manifesto = {
+            "version": BACKUP_STATE_VERSION,
+            "kind": "full",
+            "backup": caminho.name,
+            "chain": [caminho.name],
+            "created_at": datetime.utcnow().isoformat(),
+            "database": BACKUP_DB_MANIFEST,
+            "files": {},
+            "chunks": {},
+            "stats": {"files": 0, "chunks_new": 0, "chunks_reused": 0, "bytes_new": 0},
+        }
+        with open(caminho, "wb") as f:
+            escritor = EscritorCifradoStream(f, password=password, chunk_size=chunk_size)
+            with tarfile.open(fileobj=escritor, mode="w|gz") as tar:
+                _add_spool_member(tar, membro, dados, info["bytes"])
+                _add_bytes_member(tar, BACKUP_DB_MANIFEST, json.dumps(manifesto_db).encode("utf-8"))
+                _add_bytes_member(tar, BACKUP_MANIFEST, json.dumps(manifesto).encode("utf-8"))
+            escritor.close()
+
+    return {"path": str(caminho), "size_bytes": escritor.bytes_written, **info}
+
+
+def benchmark_restore(tamanho_mb=2048, diretorio=None, dsn=None, chunk_size=BACKUP_CHUNK_SIZE):
+    """Gera um backup sintetico de tamanho_mb MB e mede o restore fase a fase.
+
+    Com `dsn`, carrega a tabela BENCH_TABLE (recriada/truncada) nesse banco: use um banco descartavel.
+    """
+    senha = "benchmark-" + os.urandom(8).hex()
+    with tempfile.TemporaryDirectory(prefix="trxbkp-bench-", dir=diretorio) as tmp:
+        inicio = time.perf_counter()
+        sintetico = criar_backup_sintetico(Path(tmp) / "out", senha, tamanho_mb, chunk_size=chunk_size)
+        fase_backup = _fase(time.perf_counter() - inicio, sintetico["bytes"], sintetico["rows"])
+        relatorio = recuperar_backup([sintetico["path"]], Path(tmp) / "restore", senha, dsn=dsn, truncar=True)
+
+    relatorio["phases"] = {"backup": fase_backup, **relatorio["phases"]}
+    relatorio["dataset"] = {
+        "table": BENCH_TABLE,
+        "rows": sintetico["rows"],
+        "bytes": sintetico["bytes"],
+        "encrypted_bytes": sintetico["size_bytes"],
+    }
+    relatorio.pop("path", None)
+    return relatorio
+
+
+def nome_parte_backup(filename, indice, total):
+    return filename if total == 1 else f"{filename}.part{indice:03d}of{total:03d}"
+
+
+def planejar_partes_backup(encrypted_path, parte_max_bytes=BACKUP_PART_MAX_BYTES):
+    """Divide o .enc em partes de ate parte_max_bytes e calcula o sha256 de cada uma (em streaming)."""
+    caminho = Path(encrypted_path)
+    tamanho = caminho.stat().st_size
+    parte_max = max(1, int(parte_max_bytes))
+    total = max(1, -(-tamanho // parte_max))
+    partes = []
+    with open(caminho, "rb") as f:
+        for indice in range(1, total + 1):
+            offset = (indice - 1) * parte_max
+            tamanho_parte = min(parte_max, tamanho - offset)
+            sha = hashlib.sha256()
+            restante = tamanho_parte
+            while restante:
+                bloco = f.read(min(_COPY_BUFFER, restante))
+                if not bloco:
+                    raise ValueError(f"{caminho.name} mudou de tamanho durante a divisao em partes.")
+                sha.update(bloco)
+                restante -= len(bloco)
+            partes.append({
+                "index": indice,
+                "filename": nome_parte_backup(caminho.name, indice, total),
+                "offset": offset,
+                "size": tamanho_parte,
+                "sha256": sha.hexdigest(),
+                "status": "pending",
+                "attempts": 0,
+            })
+    return partes
+
+
+def ler_parte_backup(encrypted_path, parte):
+    with open(encrypted_path, "rb") as f:
+        f.seek(parte["offset"])
+        dados = f.read(parte["size"])
+    if len(dados) != parte["size"] or hashlib.sha256(dados).hexdigest() != parte["sha256"]:
+        raise ValueError(f"Parte {parte['filename']} nao confere com o sha256 registrado.")
+    return dados
+
+
+def enviar_partes_backup(encrypted_path, partes, enviar, workers=2, tentativas=3, espera_base=2.0, ao_atualizar=None):
+    """Envia as partes ainda nao entregues, no maximo `workers` por vez, com retry por parte.
+
+    So as partes em voo ficam em memoria. `enviar(parte, dados)` faz o envio;
+    `ao_atualizar(partes)` roda (serializado) a cada parte concluida, para persistir
+    o progresso e uma execucao seguinte retomar so o que faltou.
+    """
+    lock = threading.Lock()
+
+    def _enviar(parte):
+        erro = None
+        tentativa = 0
+        try:
+            dados = ler_parte_backup(encrypted_path, parte)
+        except (OSError, ValueError) as exc:
+            dados, erro = None, exc
+        while dados is not None and tentativa < tentativas:
+            tentativa += 1
+            try:
+                enviar(parte, dados)
+                erro = None
+                break
+            except Exception as exc:
+                erro = exc
+                if tentativa < tentativas:
+                    time.sleep(espera_base * (2 ** (tentativa - 1)))
+        dados = None
+        with lock:
+            parte["attempts"] = parte.get("attempts", 0) + tentativa
+            if erro is None:
+                parte["status"] = "sent"
+                parte["sent_at"] = datetime.utcnow().isoformat()
+                parte.pop("error", None)
+            else:
+                parte["status"] = "failed"
+                parte["error"] = str(erro)[:300]
+            if ao_atualizar:
+                ao_atualizar(partes)
+
+    pendentes = [parte for parte in partes if parte.get("status") != "sent"]
+    with ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="backup-envio") as pool:
+        list(pool.map(_enviar, pendentes))
+
+    enviadas = sum(1 for parte in partes if parte["status"] == "sent")
+    return {"parts": len(partes), "sent": enviadas, "failed": len(partes) - enviadas, "attempted": len(pendentes)}
+
+
+_PADRAO_PARTE = re.compile(r"\.part(\d{3,})of(\d{3,})$")
+
+
+def reunir_partes_backup(part_paths, output_path=None, sha256_esperado=None):
+    """Junta as partes .partNNNofMMM do .enc em ordem, conferindo se nenhuma falta."""
+    indexadas = {}
+    total = None
+    base = None
+    for caminho in map(Path, part_paths):
+        casamento = _PADRAO_PARTE.search(caminho.name)
+        if not casamento:
+            raise ValueError(f"Nome de parte invalido: {caminho.name}")
+        indice, total_parte = int(casamento.group(1)), int(casamento.group(2))
+        base_parte = caminho.name[:casamento.start()]
+        if (total is not None and total_parte != total) or (base is not None and base_parte != base):
+            raise ValueError("As partes sao de backups diferentes.")
+        if indice in indexadas:
+            raise ValueError(f"Parte {indice} repetida.")
+        total, base = total_parte, base_parte
+        indexadas[indice] = caminho
+    if total is None:
+        raise ValueError("Nenhuma parte informada.")
+    faltando = [indice for indice in range(1, total + 1) if indice not in indexadas]
+    if faltando:
+        raise ValueError(f"Faltam as partes: {', '.join(map(str, faltando))}")
+
+    saida = Path(output_path) if output_path else indexadas[1].parent / base
+    parcial = saida.with_name(saida.name + ".partial")
+    sha = hashlib.sha256()
+    tamanho = 0
+    try:
+        with open(parcial, "wb") as destino:
+            for indice in range(1, total + 1):
+                with open(indexadas[indice], "rb") as origem:
+                    for bloco in iter(lambda: origem.read(_COPY_BUFFER), b""):
+                        sha.update(bloco)
+                        destino.write(bloco)
+                        tamanho += len(bloco)
+        if sha256_esperado and sha.hexdigest() != sha256_esperado.strip().lower():
+            raise ValueError("SHA256 do arquivo reunido nao confere com o informado no e-mail.")
+        os.replace(parcial, saida)
+    except Exception:
+        parcial.unlink(missing_ok=True)
+        raise
+    return {"path": str(saida), "parts": total, "size_bytes": tamanho, "sha256": sha.hexdigest()}
+
+
 def remover_backups_antigos(output_dir, keep_days=15):
     removed = []
     if keep_days <= 0:
@@ -146,3 +1232,63 @@ def remover_backups_antigos(output_dir, keep_days=15):
             continue
 
     return removed
+
+
+def _senha_backup_cli():
+    senha = (os.environ.get("BACKUP_ENCRYPTION_PASSWORD") or "").strip()
+    return senha or getpass.getpass("Senha do backup: ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ferramentas de backup TRX PRO.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_decrypt = sub.add_parser("decrypt", help="Gera o .tar.gz a partir do .enc")
+    p_decrypt.add_argument("arquivo")
+    p_decrypt.add_argument("saida")
+    p_restore = sub.add_parser("restore", help="Extrai o .enc em um diretorio")
+    p_restore.add_argument("arquivo")
+    p_restore.add_argument("destino")
+    p_chain = sub.add_parser("restore-chain", help="Reconstroi completo + incrementais (em ordem) em um diretorio")
+    p_chain.add_argument("destino")
+    p_chain.add_argument("arquivos", nargs="+")
+    p_recover = sub.add_parser("recover", help="Restore da cadeia + verificacao + carga opcional via COPY, com throughput")
+    p_recover.add_argument("destino")
+    p_recover.add_argument("arquivos", nargs="+")
+    p_recover.add_argument("--dsn", help="Postgres de destino (ex.: postgresql://localhost/trx_restore)")
+    p_recover.add_argument("--truncate", action="store_true", help="TRUNCATE nas tabelas antes do COPY")
+    p_verify = sub.add_parser("verify", help="Confere hashes e linhas de um diretorio restaurado")
+    p_verify.add_argument("destino")
+    p_bench = sub.add_parser("bench", help="Round-trip de um backup sintetico, com MB/s e linhas/s por fase")
+    p_bench.add_argument("--size-mb", type=int, default=2048)
+    p_bench.add_argument("--dir", help="Diretorio de trabalho (precisa de ~2x o tamanho livre)")
+    p_bench.add_argument("--dsn", help="Postgres descartavel para medir tambem a carga")
+    p_join = sub.add_parser("join", help="Reune as partes .partNNNofMMM recebidas por e-mail no .enc")
+    p_join.add_argument("partes", nargs="+")
+    p_join.add_argument("-o", "--saida", help="Arquivo .enc de saida (padrao: nome original, ao lado das partes)")
+    p_join.add_argument("--sha256", help="SHA256 do .enc informado no e-mail")
+    args = parser.parse_args()
+
+    try:
+        if args.comando == "decrypt":
+            resultado = descriptografar_backup(args.arquivo, args.saida, _senha_backup_cli())
+        elif args.comando == "restore-chain":
+            resultado = restaurar_cadeia_backups(args.arquivos, args.destino, _senha_backup_cli())
+        elif args.comando == "recover":
+            resultado = recuperar_backup(
+                args.arquivos, args.destino, _senha_backup_cli(), dsn=args.dsn, truncar=args.truncate
+            )
+        elif args.comando == "verify":
+            resultado = verificar_restore(args.destino)
+            if not resultado["ok"]:
+                print(json.dumps(resultado, indent=2))
+                sys.exit(1)
+        elif args.comando == "join":
+            resultado = reunir_partes_backup(args.partes, args.saida, sha256_esperado=args.sha256)
+        elif args.comando == "bench":
+            resultado = benchmark_restore(tamanho_mb=args.size_mb, diretorio=args.dir, dsn=args.dsn)
+        else:
+            resultado = restaurar_backup(args.arquivo, args.destino, _senha_backup_cli())
+    except ValueError as exc:
+        print(f"[BACKUP] {exc}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(resultado, indent=2))
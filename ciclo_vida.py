@@ -0,0 +1,98 @@
+import signal
+import threading
+import time
+
+SHUTDOWN_DRAIN_SECONDS = 20
+
+
+def restante(limite):
+    """Segundos que ainda sobram ate o instante-limite (time.monotonic)."""
+    return max(0.0, limite - time.monotonic())
+
+
+class CicloVida:
+    """Encerramento ordenado do processo: para de aceitar trabalho e drena dentro de um prazo.
+
+    As etapas rodam uma vez, em ordem, cada uma recebendo o mesmo instante-limite; uma etapa
+    que falha ou estoura o prazo nao impede as seguintes (gravar o que sobrou, soltar locks).
+    """
+
+    def __init__(self, prazo_segundos=SHUTDOWN_DRAIN_SECONDS, ao_concluir=None):
+        self.prazo_segundos = max(0.0, float(prazo_segundos))
+        self.ao_concluir = ao_concluir
+        self.encerrando = threading.Event()
+        self.relatorio = None
+        self._etapas = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._concluido = threading.Event()
+
+    def registrar(self, nome, funcao):
+        self._etapas.append((nome, funcao))
+
+    def iniciar_encerramento(self, motivo="shutdown"):
+        """Dispara a drenagem numa thread e volta na hora (seguro para handler de sinal)."""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.encerrando.set()
+            self._thread = threading.Thread(
+                target=self._executar, args=(motivo,), name="ciclo-vida-encerramento", daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def aguardar(self, timeout=None):
+        if timeout is None:
+            # Folga para as etapas finais que nao esperam (gravacoes curtas no banco).
+            timeout = self.prazo_segundos + 5
+        return self._concluido.wait(timeout)
+
+    def encerrar(self, motivo="shutdown", timeout=None):
+        self.iniciar_encerramento(motivo)
+        self.aguardar(timeout)
+        return self.relatorio
+
+    def _executar(self, motivo):
+        inicio = time.monotonic()
+        limite = inicio + self.prazo_segundos
+        etapas = {}
+        for nome, funcao in self._etapas:
+            inicio_etapa = time.monotonic()
+            try:
+                item = {"ok": True, "result": funcao(limite)}
+            except Exception as exc:
+                item = {"ok": False, "error": str(exc)}
+            item["duration_ms"] = round((time.monotonic() - inicio_etapa) * 1000, 2)
+            etapas[nome] = item
+
+        self.relatorio = {
+            "reason": motivo,
+            "steps": etapas,
+            "duration_ms": round((time.monotonic() - inicio) * 1000, 2),
+            "deadline_exceeded": time.monotonic() > limite,
+        }
+        try:
+            if self.ao_concluir is not None:
+                self.ao_concluir(self.relatorio)
+        finally:
+            self._concluido.set()
+
+    def instalar_sinais(self, sinais=(signal.SIGTERM,)):
+        """Encadeia no handler atual: inicia a drenagem e repassa o sinal.
+
+        Sem handler anterior (servidor de desenvolvimento), espera a drenagem e sai.
+        Precisa rodar na thread principal.
+        """
+        for sinal in sinais:
+            anterior = signal.getsignal(sinal)
+
+            def handler(signum, frame, anterior=anterior):
+                self.iniciar_encerramento(f"signal_{signum}")
+                if callable(anterior):
+                    anterior(signum, frame)
+                    return
+                self.aguardar()
+                raise SystemExit(0)
+
+            signal.signal(sinal, handler)
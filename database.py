@@ -2,18 +2,109 @@ import psycopg2
 from psycopg2 import sql
 import os
 import json
-from datetime import date, datetime, time
+import re
+import select
+import time as _time
+from functools import lru_cache
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
 BACKUP_ADVISORY_LOCK_KEY = 771200913
+WORKERS_LEADER_LOCK_KEY = 74_201_903
+WHATSAPP_QUEUE_CHANNEL = "whatsapp_queue"
 
 # ======================================================
 # CONEXÃO
 # ======================================================
 
+_OBSERVADOR_QUERIES = None
+
+
+def definir_observador_queries(callback):
+    """Registra callback(sql_texto, duracao_ms) chamado apos cada execute; None desliga."""
+    global _OBSERVADOR_QUERIES
+    _OBSERVADOR_QUERIES = callback
+
+
+def _texto_query(cursor, query):
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    if isinstance(query, str):
+        return query
+    try:
+        return query.as_string(cursor)
+    except Exception:
+        return str(query)
+
+
+class CursorInstrumentado(psycopg2.extensions.cursor):
+    """Cursor que mede execute/executemany/copy_expert e repassa ao observador registrado."""
+
+    def _medir(self, metodo, query, *args):
+        observador = _OBSERVADOR_QUERIES
+        if observador is None:
+            return metodo(query, *args)
+        inicio = _time.perf_counter()
+        try:
+            return metodo(query, *args)
+        finally:
+            try:
+                observador(_texto_query(self, query), (_time.perf_counter() - inicio) * 1000)
+            except Exception:
+                pass
+
+    def execute(self, query, vars=None):
+        return self._medir(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._medir(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._medir(super().copy_expert, sql, file, size)
+
+
+_FP_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_FP_PLACEHOLDER_RE = re.compile(r"%\([^)]+\)s|%s")
+_FP_NUMERO_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_FP_LISTA_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_FP_ESPACOS_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint_sql(texto, limite=300):
+    """Normaliza o SQL (literais, placeholders, listas IN e espacos) para agrupar por forma."""
+    fp = _FP_STRING_RE.sub("?", texto or "")
+    fp = _FP_PLACEHOLDER_RE.sub("?", fp)
+    fp = _FP_NUMERO_RE.sub("?", fp)
+    fp = _FP_LISTA_RE.sub("(?+)", fp)
+    fp = _FP_ESPACOS_RE.sub(" ", fp).strip()
+    return fp[:limite]
+
+
 def get_conn():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+    return psycopg2.connect(DATABASE_URL, sslmode="require", cursor_factory=CursorInstrumentado)
+
+
+def abrir_conexao_listen(canal):
+    conn = get_conn()
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    cur = conn.cursor()
+    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(canal)))
+    cur.close()
+    return conn
+
+
+def aguardar_notificacoes(conn, timeout):
+    """Bloqueia ate chegar NOTIFY no canal ou estourar o timeout; retorna os payloads."""
+    if timeout > 0 and not conn.notifies:
+        prontos, _, _ = select.select([conn], [], [], timeout)
+        if not prontos:
+            return []
+    conn.poll()
+    payloads = [notify.payload for notify in conn.notifies]
+    conn.notifies.clear()
+    return payloads
 
 
 def _normalizar_preferencia_comissao_interna(valor):
@@ -25,11 +116,13 @@ def _normalizar_preferencia_comissao_interna(valor):
 # ======================================================
 # INIT / MIGRATIONS
 # ======================================================
+# Cada migration roda uma unica vez, em ordem, e fica registrada em schema_migrations.
+# Migration aplicada nao se edita: mudanca de schema nova entra no fim de MIGRATIONS.
+MIGRATIONS_LOCK_KEY = 74_201_901
 
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
 
+def _m001_schema_base(cur):
+    """Tabelas e colunas ate a introducao do registro (idempotente para bancos antigos)."""
     cur.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             order_id TEXT PRIMARY KEY,
@@ -43,15 +136,12 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS processed_transactions (
             transaction_nsu TEXT PRIMARY KEY,
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS whatsapp_auto_dispatches (
             order_id TEXT PRIMARY KEY,
@@ -63,7 +153,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS user_plan_stats (
             user_key TEXT PRIMARY KEY,
@@ -77,7 +166,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS analytics_purchase_events (
             id BIGSERIAL PRIMARY KEY,
@@ -90,11 +178,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_events_created_at ON analytics_purchase_events(created_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_events_user_key ON analytics_purchase_events(user_key)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_events_plano ON analytics_purchase_events(plano)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS analytics_funnel_events (
             id BIGSERIAL PRIMARY KEY,
@@ -119,12 +202,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_funnel_stage ON analytics_funnel_events(stage)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_funnel_created_at ON analytics_funnel_events(created_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_funnel_user_key ON analytics_funnel_events(user_key)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_analytics_funnel_order_id ON analytics_funnel_events(order_id)")
-    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_funnel_dedupe_key ON analytics_funnel_events(dedupe_key)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS quiz_submissions (
             id BIGSERIAL PRIMARY KEY,
@@ -141,9 +218,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_quiz_submissions_created_at ON quiz_submissions(created_at)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_quiz_submissions_user_key ON quiz_submissions(user_key)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS client_upgrade_leads (
             id BIGSERIAL PRIMARY KEY,
@@ -159,10 +233,6 @@ def init_db():
             created_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_client_upgrade_leads_email ON client_upgrade_leads(email)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_client_upgrade_leads_created_at ON client_upgrade_leads(created_at DESC)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_client_upgrade_leads_target_plan ON client_upgrade_leads(target_plan)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS affiliates (
             id BIGSERIAL PRIMARY KEY,
@@ -180,8 +250,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliates_slug ON affiliates(slug)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS affiliate_referrals (
             referred_email TEXT PRIMARY KEY,
@@ -197,9 +265,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_referrals_slug ON affiliate_referrals(affiliate_slug)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_referrals_first_referred_at ON affiliate_referrals(first_referred_at DESC)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS affiliate_commissions (
             id BIGSERIAL PRIMARY KEY,
@@ -220,11 +285,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_slug ON affiliate_commissions(affiliate_slug)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_email ON affiliate_commissions(referred_email)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_status ON affiliate_commissions(status)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_created_at ON affiliate_commissions(created_at DESC)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS backup_runs (
             id BIGSERIAL PRIMARY KEY,
@@ -238,8 +298,9 @@ def init_db():
             finished_at TIMESTAMP
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_backup_runs_started_at ON backup_runs(started_at DESC)")
-
+    cur.execute("ALTER TABLE backup_runs ADD COLUMN IF NOT EXISTS backup_kind TEXT")
+    cur.execute("ALTER TABLE backup_runs ADD COLUMN IF NOT EXISTS manifest JSONB")
+    cur.execute("ALTER TABLE backup_runs ADD COLUMN IF NOT EXISTS parts JSONB")
     cur.execute("""
         CREATE TABLE IF NOT EXISTS customer_accounts (
             id BIGSERIAL PRIMARY KEY,
@@ -259,8 +320,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_accounts_email ON customer_accounts(email)")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS customer_onboarding_progress (
             email TEXT PRIMARY KEY,
@@ -273,9 +332,6 @@ def init_db():
             updated_at TIMESTAMP DEFAULT NOW()
         )
     """)
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_onboarding_progress_updated_at ON customer_onboarding_progress(updated_at DESC)")
-
-    # 🔥 MIGRATIONS SEGURAS
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS nome TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS telefone TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS email_tentativas INTEGER DEFAULT 0")
@@ -285,13 +341,12 @@ def init_db():
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS erro_whatsapp TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS whatsapp_agendado_para TIMESTAMP")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS whatsapp_mensagens_enviadas INTEGER DEFAULT 0")
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS whatsapp_claimed_at TIMESTAMP")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS checkout_slug TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS affiliate_slug TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS affiliate_nome TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS affiliate_email TEXT")
     cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS affiliate_telefone TEXT")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_checkout_slug ON orders(checkout_slug)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_affiliate_slug ON orders(affiliate_slug)")
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS nome TEXT")
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS telefone TEXT")
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS password_hash TEXT")
@@ -305,7 +360,6 @@ def init_db():
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS last_login_at TIMESTAMP")
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW()")
     cur.execute("ALTER TABLE customer_accounts ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_accounts_remember_token_hash ON customer_accounts(remember_token_hash)")
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS email_accessed BOOLEAN NOT NULL DEFAULT FALSE")
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS tool_downloaded BOOLEAN NOT NULL DEFAULT FALSE")
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS zip_extracted BOOLEAN NOT NULL DEFAULT FALSE")
@@ -313,9 +367,7 @@ def init_db():
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS robot_activated BOOLEAN NOT NULL DEFAULT FALSE")
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW()")
     cur.execute("ALTER TABLE customer_onboarding_progress ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_customer_onboarding_progress_updated_at ON customer_onboarding_progress(updated_at DESC)")
     cur.execute("ALTER TABLE quiz_submissions ADD COLUMN IF NOT EXISTS account_email TEXT")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_quiz_submissions_account_email ON quiz_submissions(account_email)")
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS affiliate_nome TEXT")
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS affiliate_email TEXT")
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS affiliate_telefone TEXT")
@@ -325,9 +377,8 @@ def init_db():
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS first_referred_at TIMESTAMP DEFAULT NOW()")
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW()")
     cur.execute("ALTER TABLE affiliate_referrals ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_referrals_slug ON affiliate_referrals(affiliate_slug)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_referrals_first_referred_at ON affiliate_referrals(first_referred_at DESC)")
     cur.execute("ALTER TABLE affiliates ADD COLUMN IF NOT EXISTS terms_accepted_at TIMESTAMP")
+    cur.execute("ALTER TABLE whatsapp_auto_dispatches ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP")
     cur.execute("ALTER TABLE affiliates ADD COLUMN IF NOT EXISTS link_saved_at TIMESTAMP")
     cur.execute("ALTER TABLE affiliates ADD COLUMN IF NOT EXISTS terms_accepted_ip TEXT")
     cur.execute("ALTER TABLE affiliates ADD COLUMN IF NOT EXISTS terms_version TEXT")
@@ -346,11 +397,69 @@ def init_db():
     cur.execute("ALTER TABLE affiliate_commissions ADD COLUMN IF NOT EXISTS status TEXT DEFAULT 'PENDENTE'")
     cur.execute("ALTER TABLE affiliate_commissions ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW()")
     cur.execute("ALTER TABLE affiliate_commissions ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW()")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_slug ON affiliate_commissions(affiliate_slug)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_email ON affiliate_commissions(referred_email)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_status ON affiliate_commissions(status)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_affiliate_commissions_created_at ON affiliate_commissions(created_at DESC)")
 
+
+# (nome, definicao, unico). CREATE INDEX CONCURRENTLY nao bloqueia escrita na tabela.
+_INDICES_BASE = (
+    ("idx_orders_status", "ON orders(status)", False),
+    ("idx_analytics_events_created_at", "ON analytics_purchase_events(created_at)", False),
+    ("idx_analytics_events_user_key", "ON analytics_purchase_events(user_key)", False),
+    ("idx_analytics_events_plano", "ON analytics_purchase_events(plano)", False),
+    ("idx_analytics_funnel_stage", "ON analytics_funnel_events(stage)", False),
+    ("idx_analytics_funnel_created_at", "ON analytics_funnel_events(created_at)", False),
+    ("idx_analytics_funnel_user_key", "ON analytics_funnel_events(user_key)", False),
+    ("idx_analytics_funnel_order_id", "ON analytics_funnel_events(order_id)", False),
+    ("idx_analytics_funnel_dedupe_key", "ON analytics_funnel_events(dedupe_key)", True),
+    ("idx_quiz_submissions_created_at", "ON quiz_submissions(created_at)", False),
+    ("idx_quiz_submissions_user_key", "ON quiz_submissions(user_key)", False),
+    ("idx_client_upgrade_leads_email", "ON client_upgrade_leads(email)", False),
+    ("idx_client_upgrade_leads_created_at", "ON client_upgrade_leads(created_at DESC)", False),
+    ("idx_client_upgrade_leads_target_plan", "ON client_upgrade_leads(target_plan)", False),
+    ("idx_affiliates_slug", "ON affiliates(slug)", False),
+    ("idx_affiliate_referrals_slug", "ON affiliate_referrals(affiliate_slug)", False),
+    ("idx_affiliate_referrals_first_referred_at", "ON affiliate_referrals(first_referred_at DESC)", False),
+    ("idx_affiliate_commissions_slug", "ON affiliate_commissions(affiliate_slug)", False),
+    ("idx_affiliate_commissions_email", "ON affiliate_commissions(referred_email)", False),
+    ("idx_affiliate_commissions_status", "ON affiliate_commissions(status)", False),
+    ("idx_affiliate_commissions_created_at", "ON affiliate_commissions(created_at DESC)", False),
+    ("idx_backup_runs_started_at", "ON backup_runs(started_at DESC)", False),
+    ("idx_customer_accounts_email", "ON customer_accounts(email)", False),
+    ("idx_customer_onboarding_progress_updated_at", "ON customer_onboarding_progress(updated_at DESC)", False),
+    ("idx_orders_whatsapp_fila", "ON orders(whatsapp_agendado_para) WHERE COALESCE(whatsapp_enviado, FALSE) = FALSE AND whatsapp_agendado_para IS NOT NULL", False),
+    ("idx_orders_checkout_slug", "ON orders(checkout_slug)", False),
+    ("idx_orders_affiliate_slug", "ON orders(affiliate_slug)", False),
+    ("idx_customer_accounts_remember_token_hash", "ON customer_accounts(remember_token_hash)", False),
+    ("idx_quiz_submissions_account_email", "ON quiz_submissions(account_email)", False),
+    ("idx_whatsapp_auto_dispatches_status_scheduled", "ON whatsapp_auto_dispatches(status, scheduled_for)", False),
+)
+
+
+def _criar_indice_concorrente(cur, nome, definicao, unico=False):
+    """CREATE INDEX CONCURRENTLY (fora de transacao); recria se uma tentativa anterior deixou o indice invalido."""
+    cur.execute("""
+        SELECT i.indisvalid
+        FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s
+          AND c.relnamespace = 'public'::regnamespace
+    """, (nome,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(nome)))
+    cur.execute(sql.SQL(
+        "CREATE " + ("UNIQUE " if unico else "") + "INDEX CONCURRENTLY IF NOT EXISTS {} " + definicao
+    ).format(sql.Identifier(nome)))
+
+
+def _m002_indices_base(cur):
+    for nome, definicao, unico in _INDICES_BASE:
+        _criar_indice_concorrente(cur, nome, definicao, unico=unico)
+
+
+def _m003_backfill_affiliate_referrals(cur):
+    """Indicacoes dos pedidos antigos (os novos ja gravam affiliate_referrals)."""
     cur.execute("""
         INSERT INTO affiliate_referrals (
             referred_email,
@@ -384,6 +493,9 @@ def init_db():
         ON CONFLICT (referred_email) DO NOTHING
     """)
 
+
+def _m004_backfill_whatsapp_orders(cur):
+    """Agenda/contagem de WhatsApp dos pedidos anteriores a fila."""
     cur.execute("""
         UPDATE orders
         SET whatsapp_agendado_para = created_at + INTERVAL '5 minutes'
@@ -391,7 +503,6 @@ def init_db():
           AND status = 'PAGO'
           AND whatsapp_agendado_para IS NULL
     """)
-
     cur.execute("""
         UPDATE orders
         SET whatsapp_mensagens_enviadas = 1
@@ -399,17 +510,138 @@ def init_db():
           AND COALESCE(whatsapp_mensagens_enviadas, 0) = 0
     """)
 
+
+def _m005_backfill_checkout_slug(cur):
+    """salvar_order ja grava checkout_slug; so os pedidos antigos ficaram NULL."""
     cur.execute("""
         UPDATE orders
         SET checkout_slug = plano
         WHERE checkout_slug IS NULL
     """)
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
-    print("🗄️ POSTGRES OK (com migrations)", flush=True)
+def _m006_job_watermarks(cur):
+    """Watermark de jobs incrementais (ex.: backfill de analytics)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_watermarks (
+            job TEXT PRIMARY KEY,
+            watermark TIMESTAMP,
+            last_result JSONB,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+def _m007_indice_orders_created_at(cur):
+    # O backfill incremental filtra orders por created_at a partir do watermark.
+    _criar_indice_concorrente(cur, "idx_orders_created_at", "ON orders(created_at)")
+
+
+def _m008_orders_processing_started_at(cur):
+    """Lease do PROCESSANDO: pedido preso por processo morto volta a PENDENTE depois do prazo."""
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS processing_started_at TIMESTAMP")
+    # Presos de antes desta migration comecam a contar agora.
+    cur.execute("""
+        UPDATE orders
+        SET processing_started_at = NOW()
+        WHERE status = 'PROCESSANDO'
+          AND processing_started_at IS NULL
+    """)
+
+
+def _m009_cache_versions(cur):
+    """Versoes compartilhadas de caches locais: cada processo compara e descarta o seu."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+# (versao, nome, funcao(cur), concorrente). Concorrente roda em autocommit, sem transacao.
+MIGRATIONS = (
+    (1, "schema_base", _m001_schema_base, False),
+    (2, "indices_base", _m002_indices_base, True),
+    (3, "backfill_affiliate_referrals", _m003_backfill_affiliate_referrals, False),
+    (4, "backfill_whatsapp_orders", _m004_backfill_whatsapp_orders, False),
+    (5, "backfill_checkout_slug", _m005_backfill_checkout_slug, False),
+    (6, "job_watermarks", _m006_job_watermarks, False),
+    (7, "indice_orders_created_at", _m007_indice_orders_created_at, True),
+    (8, "orders_processing_started_at", _m008_orders_processing_started_at, False),
+    (9, "cache_versions", _m009_cache_versions, False),
+)
+
+
+def _versoes_migrations_aplicadas(cur):
+    try:
+        cur.execute("SELECT version FROM schema_migrations")
+    except psycopg2.errors.UndefinedTable:
+        return set()
+    return {row[0] for row in cur.fetchall()}
+
+
+def aplicar_migrations(conn=None, migrations=MIGRATIONS):
+    """Aplica as migrations pendentes sob advisory lock; com o schema em dia custa uma query."""
+    fechar = conn is None
+    conn = conn or get_conn()
+    aplicadas_agora = []
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        aplicadas = _versoes_migrations_aplicadas(cur)
+        if all(versao in aplicadas for versao, *_ in migrations):
+            return aplicadas_agora
+
+        # Outra instancia subindo junto espera aqui e depois so reconfere a lista.
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+        try:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    duration_ms INTEGER
+                )
+            """)
+            aplicadas = _versoes_migrations_aplicadas(cur)
+            for versao, nome, funcao, concorrente in migrations:
+                if versao in aplicadas:
+                    continue
+                inicio = _time.perf_counter()
+                if not concorrente:
+                    conn.autocommit = False
+                try:
+                    funcao(cur)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                        (versao, nome, int((_time.perf_counter() - inicio) * 1000)),
+                    )
+                    if not concorrente:
+                        conn.commit()
+                except Exception:
+                    if not concorrente:
+                        conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+                aplicadas_agora.append(versao)
+                print(f"🗄️ migration {versao:03d}_{nome} aplicada ({(_time.perf_counter() - inicio) * 1000:.0f}ms)", flush=True)
+        finally:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_KEY,))
+        return aplicadas_agora
+    finally:
+        if fechar:
+            conn.close()
+
+
+def init_db():
+    aplicadas = aplicar_migrations()
+    if aplicadas:
+        print(f"🗄️ POSTGRES OK (migrations aplicadas: {aplicadas})", flush=True)
+    else:
+        print("🗄️ POSTGRES OK (schema em dia)", flush=True)
 
 
 # ======================================================
@@ -523,7 +755,8 @@ def reservar_order_para_processamento(order_id):
 
     cur.execute("""
         UPDATE orders
-        SET status = 'PROCESSANDO'
+        SET status = 'PROCESSANDO',
+            processing_started_at = NOW()
         WHERE order_id = %s
           AND status = 'PENDENTE'
     """, (order_id,))
@@ -553,6 +786,25 @@ def restaurar_order_para_pendente(order_id):
     return restaurado
 
 
+def liberar_orders_processando_expiradas(lease_minutos=15):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+        UPDATE orders
+        SET status = 'PENDENTE'
+        WHERE status = 'PROCESSANDO'
+          AND processing_started_at < NOW() - (%s || ' minutes')::INTERVAL
+        RETURNING order_id
+    """, (str(int(lease_minutos)),))
+
+    liberadas = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return liberadas
+
+
 def registrar_falha_email(order_id, tentativas, erro):
     conn = get_conn()
     cur = conn.cursor()
@@ -718,6 +970,8 @@ def agendar_whatsapp(order_id, minutos=5):
         SET whatsapp_agendado_para = NOW() + (%s || ' minutes')::INTERVAL
         WHERE order_id = %s
     """, (str(minutos), order_id))
+    # Entregue so no commit; acorda os workers para recalcular o proximo vencimento.
+    cur.execute("SELECT pg_notify(%s, %s)", (WHATSAPP_QUEUE_CHANNEL, order_id))
 
     conn.commit()
     cur.close()
@@ -771,6 +1025,86 @@ def listar_whatsapp_pendentes(limite=50):
     return pedidos
 
 
+def reivindicar_whatsapp_pendentes(limite=10, max_tentativas=3, lease_segundos=120):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    # SKIP LOCKED deixa cada processo pegar um lote diferente; o lease
+    # (whatsapp_claimed_at) devolve o pedido a fila se o envio falhar ou o processo cair.
+    cur.execute("""
+        UPDATE orders
+        SET whatsapp_claimed_at = NOW()
+        WHERE order_id IN (
+            SELECT order_id
+            FROM orders
+            WHERE plano = 'trx-gratis'
+              AND status = 'PAGO'
+              AND COALESCE(whatsapp_enviado, FALSE) = FALSE
+              AND COALESCE(whatsapp_tentativas, 0) < %s
+              AND whatsapp_agendado_para IS NOT NULL
+              AND whatsapp_agendado_para <= NOW()
+              AND (
+                    whatsapp_claimed_at IS NULL
+                    OR whatsapp_claimed_at < NOW() - (%s || ' seconds')::INTERVAL
+                  )
+            ORDER BY whatsapp_agendado_para ASC
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING order_id, plano, nome, email, telefone,
+                  status, whatsapp_tentativas, whatsapp_agendado_para, created_at
+    """, (max_tentativas, str(int(lease_segundos)), limite))
+
+    rows = cur.fetchall()
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    return [
+        {
+            "order_id": row[0],
+            "plano": row[1],
+            "nome": row[2],
+            "email": row[3],
+            "telefone": row[4],
+            "status": row[5],
+            "whatsapp_tentativas": row[6],
+            "whatsapp_agendado_para": row[7],
+            "created_at": row[8],
+        }
+        for row in rows
+    ]
+
+
+def segundos_ate_proximo_whatsapp_pendente(max_tentativas=3, lease_segundos=120):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    # Pedido reivindicado (envio em andamento ou que falhou) so volta quando o lease expira;
+    # GREATEST ignora o NULL de quem nunca foi reivindicado.
+    cur.execute("""
+        SELECT GREATEST(EXTRACT(EPOCH FROM (MIN(
+                   GREATEST(
+                       whatsapp_agendado_para,
+                       whatsapp_claimed_at + (%s || ' seconds')::INTERVAL
+                   )
+               ) - NOW())), 0)
+        FROM orders
+        WHERE plano = 'trx-gratis'
+          AND status = 'PAGO'
+          AND COALESCE(whatsapp_enviado, FALSE) = FALSE
+          AND COALESCE(whatsapp_tentativas, 0) < %s
+          AND whatsapp_agendado_para IS NOT NULL
+    """, (str(int(lease_segundos)), max_tentativas))
+
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not row or row[0] is None:
+        return None
+    return float(row[0])
+
+
 def registrar_falha_whatsapp(order_id, tentativas, erro):
     conn = get_conn()
     cur = conn.cursor()
@@ -969,6 +1303,8 @@ def excluir_usuario_completo_por_order(order_id):
 
         cur.execute("DELETE FROM customer_accounts WHERE email = %s", (email_norm,))
         deleted["customer_accounts"] += cur.rowcount
+        if cur.rowcount:
+            _incrementar_versao_cache(cur, CACHE_VERSION_REMEMBER_TOKENS)
 
         cur.execute("DELETE FROM customer_onboarding_progress WHERE email = %s", (email_norm,))
         deleted["customer_onboarding_progress"] += cur.rowcount
@@ -1560,6 +1896,17 @@ def excluir_afiliado(slug):
     return removido
 
 
+def obter_versao_afiliados():
+    """Versao compartilhada do cadastro de afiliados: muda em todo insert, update e delete."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), MAX(updated_at) FROM affiliates")
+    total, ultima_alteracao = cur.fetchone()
+    cur.close()
+    conn.close()
+    return (int(total or 0), ultima_alteracao.isoformat() if ultima_alteracao else None)
+
+
 # ======================================================
 # ANALYTICS
 # ======================================================
@@ -1822,43 +2169,65 @@ def buscar_primeiro_evento_funil_usuario(user_key, stage=None):
     return row[0] if row else None
 
 
-def backfill_analytics_from_orders(precos_por_plano):
-    conn = get_conn()
-    cur = conn.cursor()
+ANALYTICS_BACKFILL_JOB = "analytics_backfill"
+ANALYTICS_BACKFILL_LOCK_KEY = 74_201_902
+# Pedido antigo pode virar PAGO depois do watermark (created_at): a janela reprocessa
+# os ultimos dias, e o ON CONFLICT mantem o backfill idempotente.
+ANALYTICS_BACKFILL_LOOKBACK_DAYS = 7
 
-    cur.execute("""
-        SELECT order_id, email, telefone, plano, status, created_at
-        FROM orders
-        WHERE status = 'PAGO'
-        ORDER BY created_at ASC
-    """)
 
-    rows = cur.fetchall()
+def backfill_analytics_from_orders(precos_por_plano, lookback_days=ANALYTICS_BACKFILL_LOOKBACK_DAYS):
+    """Eventos de compra + user_plan_stats dos pedidos PAGO sem evento, em um INSERT ... SELECT.
 
-    for row in rows:
-        order_id, email, telefone, plano, status, created_at = row
-        if plano not in precos_por_plano:
-            continue
+    Roda sob advisory lock (os outros workers pulam) e guarda o watermark em
+    job_watermarks: depois da primeira vez so os pedidos recentes sao lidos.
+    """
+    planos = [plano for plano in precos_por_plano]
+    precos = [int(precos_por_plano[plano] or 0) for plano in planos]
 
-        email_norm = (email or '').strip().lower()
-        telefone_norm = ''.join(ch for ch in (telefone or '') if ch.isdigit())
-        user_key = email_norm or telefone_norm or (order_id or '')
-        if not user_key:
-            continue
+    conn = get_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (ANALYTICS_BACKFILL_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {"skipped": True}
 
-        amount_centavos = int(precos_por_plano.get(plano) or 0)
+        cur.execute("SELECT watermark FROM job_watermarks WHERE job = %s", (ANALYTICS_BACKFILL_JOB,))
+        row = cur.fetchone()
+        watermark = row[0] if row else None
+        desde = watermark - timedelta(days=max(0, int(lookback_days))) if watermark else None
 
         cur.execute("""
-            INSERT INTO analytics_purchase_events (
-                order_id, transaction_nsu, user_key, plano,
-                is_paid, amount_centavos, created_at
-            )
-            VALUES (%s, NULL, %s, %s, %s, %s, COALESCE(%s, NOW()))
-            ON CONFLICT (order_id) DO NOTHING
-        """, (order_id, user_key, plano, amount_centavos > 0, amount_centavos, created_at))
-
-        if cur.rowcount > 0:
-            cur.execute("""
+            WITH candidatos AS (
+                SELECT
+                    o.order_id,
+                    o.plano,
+                    o.created_at,
+                    p.preco,
+                    COALESCE(
+                        NULLIF(LOWER(BTRIM(COALESCE(o.email, ''), E' \\t\\r\\n')), ''),
+                        NULLIF(REGEXP_REPLACE(COALESCE(o.telefone, ''), '[^0-9]', '', 'g'), ''),
+                        NULLIF(o.order_id, '')
+                    ) AS user_key
+                FROM orders o
+                JOIN UNNEST(%s::text[], %s::int[]) AS p(plano, preco) ON p.plano = o.plano
+                WHERE o.status = 'PAGO'
+                  AND (%s::timestamp IS NULL OR o.created_at >= %s::timestamp OR o.created_at IS NULL)
+            ),
+            novos AS (
+                INSERT INTO analytics_purchase_events (
+                    order_id, transaction_nsu, user_key, plano,
+                    is_paid, amount_centavos, created_at
+                )
+                SELECT order_id, NULL, user_key, plano, preco > 0, preco, COALESCE(created_at, NOW())
+                FROM candidatos
+                WHERE user_key IS NOT NULL
+                ORDER BY created_at ASC
+                ON CONFLICT (order_id) DO NOTHING
+                RETURNING user_key, plano, amount_centavos
+            ),
+            stats AS (
                 INSERT INTO user_plan_stats (
                     user_key,
                     free_count,
@@ -1870,17 +2239,18 @@ def backfill_analytics_from_orders(precos_por_plano):
                     plan_trx_black_count,
                     updated_at
                 )
-                VALUES (
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
+                SELECT
+                    user_key,
+                    COUNT(*) FILTER (WHERE plano = 'trx-gratis'),
+                    COUNT(*) FILTER (WHERE amount_centavos > 0 AND plano <> 'trx-gratis'),
+                    COUNT(*) FILTER (WHERE plano = 'trx-gratis'),
+                    COUNT(*) FILTER (WHERE plano = 'trx-bronze'),
+                    COUNT(*) FILTER (WHERE plano = 'trx-prata'),
+                    COUNT(*) FILTER (WHERE plano = 'trx-gold'),
+                    COUNT(*) FILTER (WHERE plano = 'trx-black'),
                     NOW()
-                )
+                FROM novos
+                GROUP BY user_key
                 ON CONFLICT (user_key)
                 DO UPDATE SET
                     free_count = user_plan_stats.free_count + EXCLUDED.free_count,
@@ -1891,20 +2261,46 @@ def backfill_analytics_from_orders(precos_por_plano):
                     plan_trx_gold_count = user_plan_stats.plan_trx_gold_count + EXCLUDED.plan_trx_gold_count,
                     plan_trx_black_count = user_plan_stats.plan_trx_black_count + EXCLUDED.plan_trx_black_count,
                     updated_at = NOW()
-            """, (
-                user_key,
-                1 if plano == 'trx-gratis' else 0,
-                1 if amount_centavos > 0 and plano != 'trx-gratis' else 0,
-                1 if plano == 'trx-gratis' else 0,
-                1 if plano == 'trx-bronze' else 0,
-                1 if plano == 'trx-prata' else 0,
-                1 if plano == 'trx-gold' else 0,
-                1 if plano == 'trx-black' else 0
-            ))
+                RETURNING 1
+            )
+            SELECT
+                (SELECT COUNT(*) FROM candidatos),
+                (SELECT COUNT(*) FROM novos),
+                (SELECT COUNT(*) FROM stats),
+                (SELECT MAX(created_at) FROM candidatos)
+        """, (planos, precos, desde, desde))
+        lidos, eventos, usuarios, maximo = cur.fetchone()
+
+        vistos = [valor for valor in (watermark, maximo) if valor is not None]
+        novo_watermark = max(vistos) if vistos else None
+        cur.execute("""
+            INSERT INTO job_watermarks (job, watermark, last_result, updated_at)
+            VALUES (%s, %s, %s::jsonb, NOW())
+            ON CONFLICT (job) DO UPDATE SET
+                watermark = EXCLUDED.watermark,
+                last_result = EXCLUDED.last_result,
+                updated_at = NOW()
+        """, (
+            ANALYTICS_BACKFILL_JOB,
+            novo_watermark,
+            json.dumps({"scanned": lidos, "events": eventos, "users": usuarios}),
+        ))
+        conn.commit()
+        return {
+            "skipped": False,
+            "since": desde,
+            "scanned": lidos,
+            "events": eventos,
+            "users": usuarios,
+            "watermark": novo_watermark,
+        }
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
 
-    conn.commit()
-    cur.close()
-    conn.close()
 
 def buscar_user_plan_stats(user_key):
     conn = get_conn()
@@ -2093,6 +2489,10 @@ def registrar_lead_upgrade_cliente(
     return inserido
 
 
+# Um envio em SENDING ha mais tempo que isso e tratado como de processo morto e reivindicado de novo.
+WHATSAPP_AUTO_CLAIM_LEASE_MINUTES = 10
+
+
 def registrar_whatsapp_auto_agendamento(order_id, delay_minutes=5):
     conn = get_conn()
     cur = conn.cursor()
@@ -2110,6 +2510,76 @@ def registrar_whatsapp_auto_agendamento(order_id, delay_minutes=5):
     return inserido
 
 
+def listar_whatsapp_auto_agendados(horizonte_segundos=900, limite=500):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    # Inclui envios presos em SENDING (processo caiu no meio) apos o lease expirar.
+    cur.execute("""
+        SELECT order_id,
+               GREATEST(EXTRACT(EPOCH FROM (COALESCE(scheduled_for, NOW()) - NOW())), 0)
+        FROM whatsapp_auto_dispatches
+        WHERE (
+                status = 'SCHEDULED'
+                OR (status = 'SENDING' AND claimed_at < NOW() - (%s || ' minutes')::INTERVAL)
+              )
+          AND COALESCE(scheduled_for, NOW()) <= NOW() + (%s || ' seconds')::INTERVAL
+        ORDER BY scheduled_for ASC NULLS FIRST
+        LIMIT %s
+    """, (str(WHATSAPP_AUTO_CLAIM_LEASE_MINUTES), str(int(horizonte_segundos)), limite))
+
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [(row[0], float(row[1] or 0)) for row in rows]
+
+
+def reivindicar_whatsapp_auto(order_id):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+        UPDATE whatsapp_auto_dispatches
+        SET status = 'SENDING',
+            claimed_at = NOW()
+        WHERE order_id = %s
+          AND (
+                status = 'SCHEDULED'
+                OR (status = 'SENDING' AND claimed_at < NOW() - (%s || ' minutes')::INTERVAL)
+              )
+    """, (order_id, str(WHATSAPP_AUTO_CLAIM_LEASE_MINUTES)))
+
+    reivindicado = cur.rowcount > 0
+    conn.commit()
+    cur.close()
+    conn.close()
+    return reivindicado
+
+
+def devolver_whatsapp_auto_para_agenda(order_ids):
+    """Envios reivindicados (SENDING) que nao sairam antes do encerramento voltam para a agenda."""
+    if not order_ids:
+        return 0
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+        UPDATE whatsapp_auto_dispatches
+        SET status = 'SCHEDULED',
+            claimed_at = NULL,
+            scheduled_for = NOW()
+        WHERE order_id = ANY(%s)
+          AND status = 'SENDING'
+    """, (list(order_ids),))
+
+    devolvidos = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+    return devolvidos
+
+
 def marcar_whatsapp_auto_enviado(order_id):
     conn = get_conn()
     cur = conn.cursor()
@@ -2459,6 +2929,8 @@ def forcar_reset_senha_conta_cliente(email, password_hash):
         WHERE email = %s
     """, ((password_hash or "").strip() or None, email_norm))
     ok = cur.rowcount > 0
+    if ok:
+        _incrementar_versao_cache(cur, CACHE_VERSION_REMEMBER_TOKENS)
     conn.commit()
     cur.close()
     conn.close()
@@ -2485,6 +2957,32 @@ def atualizar_ultimo_login_conta_cliente(email):
     return ok
 
 
+def atualizar_ultimo_login_contas_cliente(logins):
+    # logins: {email: datetime_do_ultimo_acesso}
+    itens = []
+    for email, quando in (logins or {}).items():
+        email_norm = _normalizar_email_interno(email)
+        if email_norm:
+            itens.append((email_norm, quando))
+    if not itens:
+        return 0
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE customer_accounts AS ca
+        SET last_login_at = GREATEST(COALESCE(ca.last_login_at, v.quando::TIMESTAMP), v.quando::TIMESTAMP),
+            updated_at = NOW()
+        FROM UNNEST(%s::TEXT[], %s::TIMESTAMPTZ[]) AS v(email, quando)
+        WHERE ca.email = v.email
+    """, ([email for email, _ in itens], [quando for _, quando in itens]))
+    total = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+    return total
+
+
 def salvar_remember_token_cliente(email, token_hash, expires_at):
     email_norm = _normalizar_email_interno(email)
     if not email_norm:
@@ -2500,6 +2998,8 @@ def salvar_remember_token_cliente(email, token_hash, expires_at):
         WHERE email = %s
     """, ((token_hash or "").strip() or None, expires_at, email_norm))
     ok = cur.rowcount > 0
+    if ok:
+        _incrementar_versao_cache(cur, CACHE_VERSION_REMEMBER_TOKENS)
     conn.commit()
     cur.close()
     conn.close()
@@ -2521,12 +3021,44 @@ def limpar_remember_token_cliente(email):
         WHERE email = %s
     """, (email_norm,))
     ok = cur.rowcount > 0
+    if ok:
+        _incrementar_versao_cache(cur, CACHE_VERSION_REMEMBER_TOKENS)
     conn.commit()
     cur.close()
     conn.close()
     return ok
 
 
+# Troca ou revogacao de remember token (login, logout, reset de senha, exclusao de conta).
+CACHE_VERSION_REMEMBER_TOKENS = "remember_tokens"
+
+
+def _incrementar_versao_cache(cur, nome):
+    # Na mesma transacao da escrita: quem ler a versao nova ja enxerga a alteracao.
+    cur.execute("""
+        INSERT INTO cache_versions (name, version, updated_at)
+        VALUES (%s, 1, NOW())
+        ON CONFLICT (name) DO UPDATE
+        SET version = cache_versions.version + 1,
+            updated_at = NOW()
+    """, (nome,))
+
+
+def obter_versao_cache(nome):
+    """Versao compartilhada de um cache local (0 se nunca alterada)."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM cache_versions WHERE name = %s", (nome,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return int(row[0]) if row else 0
+
+
+def obter_versao_remember_tokens():
+    return obter_versao_cache(CACHE_VERSION_REMEMBER_TOKENS)
+
+
 def buscar_conta_cliente_por_remember_hash(token_hash):
     token_hash = (token_hash or "").strip()
     if not token_hash:
@@ -2929,14 +3461,7 @@ def exportar_snapshot_publico():
     conn = get_conn()
     cur = conn.cursor()
 
-    cur.execute("""
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = 'public'
-          AND table_type = 'BASE TABLE'
-        ORDER BY table_name ASC
-    """)
-    tabelas = [r[0] for r in cur.fetchall()]
+    tabelas = listar_tabelas_publicas(cur)
 
     snapshot = {
         "exported_at": datetime.utcnow().isoformat() + "Z",
@@ -2963,6 +3488,160 @@ def exportar_snapshot_publico():
     return snapshot
 
 
+def listar_tabelas_publicas(cur):
+    cur.execute("""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_schema = 'public'
+          AND table_type = 'BASE TABLE'
+        ORDER BY table_name ASC
+    """)
+    return [r[0] for r in cur.fetchall()]
+
+
+def descrever_tabelas_publicas(cur):
+    cur.execute("""
+        SELECT table_name, column_name, data_type, is_nullable = 'YES'
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+        ORDER BY table_name ASC, ordinal_position ASC
+    """)
+    schema = {}
+    for tabela, coluna, tipo, nullable in cur.fetchall():
+        schema.setdefault(tabela, []).append({"name": coluna, "type": tipo, "nullable": bool(nullable)})
+    return schema
+
+
+def abrir_snapshot_exportado():
+    """Abre uma transacao REPEATABLE READ e exporta o snapshot (como o pg_dump -j).
+
+    A conexao retornada precisa ficar aberta ate todas as exportacoes importarem
+    o snapshot; feche com conn.rollback() + conn.close().
+    """
+    conn = get_conn()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cur = conn.cursor()
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot_id = cur.fetchone()[0]
+        tabelas = listar_tabelas_publicas(cur)
+        schema = descrever_tabelas_publicas(cur)
+        cur.close()
+    except Exception:
+        conn.close()
+        raise
+    return conn, snapshot_id, tabelas, schema
+
+
+def resumir_watermark_tabela(conn, tabela, coluna, ate=None):
+    """Retorna (max(coluna), linhas com coluna <= ate) na transacao/snapshot de `conn`."""
+    cur = conn.cursor()
+    try:
+        cur.execute(sql.SQL("SELECT max({}) FROM {}").format(sql.Identifier(coluna), sql.Identifier(tabela)))
+        maximo = cur.fetchone()[0]
+        linhas_ate = None
+        if ate is not None:
+            cur.execute(
+                sql.SQL("SELECT count(*) FROM {} WHERE {} <= %s").format(sql.Identifier(tabela), sql.Identifier(coluna)),
+                (ate,),
+            )
+            linhas_ate = cur.fetchone()[0]
+    finally:
+        cur.close()
+    return maximo, linhas_ate
+
+
+def copiar_tabela_para(tabela, destino, snapshot_id=None, formato="csv", filtro=None):
+    """COPY TO STDOUT direto para o arquivo `destino`; retorna a quantidade de linhas.
+
+    `filtro` = (coluna, desde_exclusivo, ate_inclusivo) exporta so essa faixa (backup incremental).
+    """
+    opcoes = "FORMAT binary" if formato == "binary" else "FORMAT csv, HEADER true"
+    origem = sql.Identifier(tabela)
+    if filtro:
+        coluna, desde, ate = filtro
+        condicoes = [sql.SQL("{} <= {}").format(sql.Identifier(coluna), sql.Literal(ate))]
+        if desde is not None:
+            condicoes.insert(0, sql.SQL("{} > {}").format(sql.Identifier(coluna), sql.Literal(desde)))
+        origem = sql.SQL("(SELECT * FROM {} WHERE {} ORDER BY {})").format(
+            sql.Identifier(tabela),
+            sql.SQL(" AND ").join(condicoes),
+            sql.Identifier(coluna),
+        )
+    conn = get_conn()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        cur = conn.cursor()
+        if snapshot_id:
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+        cur.copy_expert(sql.SQL("COPY {} TO STDOUT WITH (" + opcoes + ")").format(origem), destino)
+        linhas = cur.rowcount
+        cur.close()
+        conn.rollback()
+        return linhas
+    finally:
+        conn.close()
+
+
+# Tipos do information_schema que nao viram DDL direto (ARRAY, enums): o restore usa text.
+_TIPOS_SEM_DDL = {"ARRAY", "USER-DEFINED"}
+
+
+def conectar_destino_restore(dsn):
+    """Conexao com o Postgres de destino de um restore (ex.: local, sem TLS obrigatorio)."""
+    return psycopg2.connect(dsn, cursor_factory=CursorInstrumentado)
+
+
+def garantir_tabela_restore(cur, tabela, colunas, truncar=False):
+    """Cria a tabela a partir das colunas do manifest se o destino ainda nao tem o schema."""
+    if colunas:
+        _criar_tabela_restore(cur, tabela, colunas)
+    if truncar:
+        cur.execute(sql.SQL("TRUNCATE TABLE {}").format(sql.Identifier(tabela)))
+
+
+def _criar_tabela_restore(cur, tabela, colunas):
+    definicoes = [
+        sql.SQL("{} {}{}").format(
+            sql.Identifier(coluna["name"]),
+            sql.SQL("text" if coluna["type"] in _TIPOS_SEM_DDL else coluna["type"]),
+            sql.SQL("" if coluna.get("nullable", True) else " NOT NULL"),
+        )
+        for coluna in colunas
+    ]
+    cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} ({})").format(
+        sql.Identifier(tabela), sql.SQL(", ").join(definicoes)
+    ))
+
+
+def carregar_tabela_de(cur, tabela, origem, formato="csv", colunas=None):
+    """COPY FROM STDIN lendo de `origem`; retorna a quantidade de linhas carregadas."""
+    opcoes = "FORMAT binary" if formato == "binary" else "FORMAT csv, HEADER true"
+    alvo = sql.Identifier(tabela)
+    if colunas:
+        alvo = sql.SQL("{} ({})").format(alvo, sql.SQL(", ").join(sql.Identifier(c) for c in colunas))
+    cur.copy_expert(sql.SQL("COPY {} FROM STDIN WITH (" + opcoes + ")").format(alvo), origem)
+    return cur.rowcount
+
+
+def ajustar_sequencias_tabela(cur, tabela):
+    """Depois do COPY, leva as sequences (serial/identity) da tabela ao max da coluna."""
+    cur.execute("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = %s
+          AND pg_get_serial_sequence(quote_ident(table_name), column_name) IS NOT NULL
+    """, (tabela,))
+    for (coluna,) in cur.fetchall():
+        cur.execute(
+            sql.SQL(
+                "SELECT setval(pg_get_serial_sequence(%s, %s), COALESCE(max({col}), 1), max({col}) IS NOT NULL) FROM {tab}"
+            ).format(col=sql.Identifier(coluna), tab=sql.Identifier(tabela)),
+            (tabela, coluna),
+        )
+
+
 def registrar_backup_execucao(
     trigger_type,
     status,
@@ -2971,7 +3650,10 @@ def registrar_backup_execucao(
     sha256=None,
     message=None,
     started_at=None,
-    finished_at=None
+    finished_at=None,
+    backup_kind=None,
+    manifest=None,
+    parts=None
 ):
     conn = get_conn()
     cur = conn.cursor()
@@ -2985,13 +3667,18 @@ def registrar_backup_execucao(
             sha256,
             message,
             started_at,
-            finished_at
+            finished_at,
+            backup_kind,
+            manifest,
+            parts
         )
         VALUES (
             %s, %s, %s, %s, %s, %s,
             COALESCE(%s, NOW()),
-            COALESCE(%s, NOW())
+            COALESCE(%s, NOW()),
+            %s, %s::jsonb, %s::jsonb
         )
+        RETURNING id
     """, (
         (trigger_type or "manual")[:30],
         (status or "UNKNOWN")[:30],
@@ -3000,20 +3687,99 @@ def registrar_backup_execucao(
         (sha256 or "")[:128] or None,
         (message or "")[:1000] or None,
         started_at,
-        finished_at
+        finished_at,
+        (backup_kind or "")[:20] or None,
+        json.dumps(manifest, ensure_ascii=False) if manifest is not None else None,
+        json.dumps(parts, ensure_ascii=False) if parts is not None else None
     ))
+    run_id = cur.fetchone()[0]
+
+    conn.commit()
+    cur.close()
+    conn.close()
+    return run_id
 
+
+def atualizar_backup_execucao(run_id, status=None, message=None, finished_at=None, parts=None):
+    """Atualiza uma execucao em andamento (progresso das partes, status final)."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE backup_runs
+        SET status = COALESCE(%s, status),
+            message = COALESCE(%s, message),
+            finished_at = COALESCE(%s, finished_at),
+            parts = COALESCE(%s::jsonb, parts)
+        WHERE id = %s
+    """, (
+        (status or "")[:30] or None,
+        (message or "")[:1000] or None,
+        finished_at,
+        json.dumps(parts, ensure_ascii=False) if parts is not None else None,
+        int(run_id),
+    ))
     conn.commit()
     cur.close()
     conn.close()
 
 
+def listar_entregas_backup_pendentes(sending_ha_minutos=30, limite=20):
+    """Execucoes com partes ainda nao entregues, da mais antiga para a mais nova.
+
+    Inclui PARTIAL e tambem SENDING antigas: o processo morreu no meio da entrega e a
+    linha nunca recebeu status final.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, filename, size_bytes, sha256, backup_kind, parts
+        FROM backup_runs
+        WHERE (status = 'PARTIAL' AND parts IS NOT NULL)
+           OR (status = 'SENDING' AND started_at < NOW() - (%s || ' minutes')::INTERVAL)
+        ORDER BY id ASC
+        LIMIT %s
+    """, (str(int(sending_ha_minutos)), int(limite)))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [
+        {
+            "id": row[0],
+            "filename": row[1],
+            "size_bytes": row[2],
+            "sha256": row[3],
+            "backup_kind": row[4],
+            "parts": row[5],
+        }
+        for row in rows
+    ]
+
+
+def obter_estado_backup_anterior():
+    """Estado (watermarks + indice de chunks) do ultimo backup entregue com sucesso."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT manifest
+        FROM backup_runs
+        WHERE status = 'SUCCESS'
+          AND manifest IS NOT NULL
+        ORDER BY id DESC
+        LIMIT 1
+    """)
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row[0] if row else None
+
+
 def listar_backups_execucao(limit=30):
     conn = get_conn()
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT id, trigger_type, status, filename, size_bytes, sha256, message, started_at, finished_at
+        SELECT id, trigger_type, status, filename, size_bytes, sha256, message, started_at, finished_at,
+               backup_kind, parts
         FROM backup_runs
         ORDER BY started_at DESC
         LIMIT %s
@@ -3035,6 +3801,9 @@ def listar_backups_execucao(limit=30):
             "message": r[6],
             "started_at": r[7],
             "finished_at": r[8],
+            "backup_kind": r[9],
+            "parts_total": len(r[10] or []),
+            "parts_sent": sum(1 for parte in (r[10] or []) if parte.get("status") == "sent"),
         })
 
     return itens
@@ -3070,3 +3839,58 @@ def liberar_lock_backup_distribuido(conn):
         pass
     finally:
         conn.close()
+
+
+def adquirir_lock_lider_workers():
+    """Conexao dedicada segurando o lock de lider dos workers, ou None se outro processo ja e lider.
+
+    O lock e de sessao: cai junto com a conexao (processo morto, rede), e outro processo assume.
+    """
+    conn = get_conn()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (WORKERS_LEADER_LOCK_KEY,))
+        ok = bool(cur.fetchone()[0])
+    except Exception:
+        cur.close()
+        conn.close()
+        raise
+    cur.close()
+
+    if ok:
+        return conn
+
+    conn.close()
+    return None
+
+
+def lock_lider_workers_ativo(conn):
+    if not conn or conn.closed:
+        return False
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        finally:
+            cur.close()
+    except Exception:
+        return False
+    return True
+
+
+def liberar_lock_lider_workers(conn):
+    if not conn:
+        return
+
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (WORKERS_LEADER_LOCK_KEY,))
+        finally:
+            cur.close()
+    except Exception:
+        pass
+    finally:
+        conn.close()
@@ -2,9 +2,8 @@ import base64
 import os
 import unicodedata
 
-import requests
+from obs_dependencias import post_monitorado
 
-print("EMAIL_UTILS CARREGADO")
 
 GOOGLE_EMAIL_WEBHOOK = os.environ.get(
     "GOOGLE_EMAIL_WEBHOOK",
@@ -16,7 +15,8 @@ def _enviar_payload_email(payload):
     if not GOOGLE_EMAIL_WEBHOOK:
         raise RuntimeError("GOOGLE_EMAIL_WEBHOOK nao configurado.")
 
-    response = requests.post(
+    response = post_monitorado(
+        "apps_script_email",
         GOOGLE_EMAIL_WEBHOOK,
         json=payload,
         timeout=60,
@@ -45,6 +45,18 @@ def enviar_email_com_anexo(destinatario, assunto, mensagem, caminho_arquivo):
     _enviar_payload_email(payload)
 
 
+def enviar_email_com_anexo_bytes(destinatario, assunto, mensagem, filename, conteudo):
+    """Como enviar_email_com_anexo, mas com o anexo ja em memoria (ex.: uma parte do backup)."""
+    payload = {
+        "email": destinatario,
+        "assunto": assunto,
+        "mensagem": mensagem,
+        "filename": filename,
+        "file_base64": base64.b64encode(conteudo).decode("utf-8"),
+    }
+    _enviar_payload_email(payload)
+
+
 def enviar_email_simples(destinatario, assunto, mensagem, html=None):
     payload = {
         "email": destinatario,
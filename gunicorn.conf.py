@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+def _env_int(nome, padrao, minimo=1):
+    try:
+        valor = int(os.environ.get(nome) or padrao)
+    except (TypeError, ValueError):
+        valor = int(padrao)
+    return max(minimo, valor)
+
+
+# Sobe com `gunicorn -c gunicorn.conf.py` (start.sh).
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{_env_int('PORT', 5000)}"
+
+# Processos x threads: a app e I/O-bound (Postgres, e-mail, WhatsApp), entao poucas
+# instancias do processo e algumas threads por processo. WEB_CONCURRENCY e o padrao do Render/Heroku.
+worker_class = "gthread"
+workers = _env_int("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4))
+threads = _env_int("GUNICORN_THREADS", 8)
+keepalive = _env_int("GUNICORN_KEEPALIVE", 5)
+timeout = _env_int("GUNICORN_TIMEOUT", 60)
+# Maior que SHUTDOWN_DRAIN_SECONDS (20s), para a drenagem do app terminar antes do SIGKILL.
+graceful_timeout = _env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+max_requests = _env_int("GUNICORN_MAX_REQUESTS", 0, minimo=0)
+max_requests_jitter = _env_int("GUNICORN_MAX_REQUESTS_JITTER", 0, minimo=0)
+
+# Import unico no master; o import de app.py nao abre banco nem sobe thread de worker.
+preload_app = (os.environ.get("GUNICORN_PRELOAD", "true").strip().lower() == "true")
+
+# Metricas e perfis de todos os workers (o scrape do /metrics cai em qualquer um): cada processo
+# grava o proprio snapshot num diretorio compartilhado. Padrao: um diretorio por execucao do master.
+_OBS_SHARED_DIR_PADRAO = not (os.environ.get("OBS_SHARED_DIR") or "").strip()
+if _OBS_SHARED_DIR_PADRAO:
+    os.environ["OBS_SHARED_DIR"] = os.path.join(tempfile.gettempdir(), f"trx-obs-{os.getpid()}")
+
+# O app ja registra cada requisicao (evento http_request) em JSON.
+accesslog = None
+errorlog = "-"
+
+
+def on_starting(server):
+    from obs_metrics import limpar_diretorio_metricas
+
+    # Contadores de uma execucao anterior nao entram na soma desta.
+    limpar_diretorio_metricas(os.path.join(os.environ["OBS_SHARED_DIR"], "metrics"))
+
+
+def on_exit(server):
+    if _OBS_SHARED_DIR_PADRAO:
+        shutil.rmtree(os.environ["OBS_SHARED_DIR"], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    import app as modulo
+
+    modulo.configurar_processos_servidor(server.cfg.workers)
+    if server.cfg.preload_app:
+        # Modulo importado no master: recria o que nao sobrevive ao fork.
+        modulo.reiniciar_recursos_apos_fork()
+    # Aquecimento por processo: schema, backfill e eleicao do lider dos workers.
+    modulo.criar_app()
+
+
+def post_worker_init(worker):
+    import app as modulo
+
+    # Roda depois do gunicorn instalar os proprios sinais: o SIGTERM do worker passa a
+    # disparar a drenagem em paralelo ao termino das requisicoes em voo.
+    modulo.CICLO_VIDA.instalar_sinais()
+
+
+def worker_exit(server, worker):
+    import app as modulo
+
+    # Requisicoes em voo ja terminaram; espera a drenagem de filas/buffers dentro do prazo.
+    modulo.encerrar_app("worker_exit")
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from obs_metrics import LATENCY_BUCKETS_MS, HistogramasSharded, resumir_histogramas
+
+DEPENDENCY_WINDOW_SECONDS = 300
+DEPENDENCY_WINDOW_MAX_EVENTS = 500
+
+
+class MonitorDependencias:
+    """Tempo, timeouts, status HTTP e taxa de erro em janela movel por dependencia externa.
+
+    A latencia vai para histogramas sharded (sem lock no caminho quente); status,
+    timeouts e a janela movel ficam sob um lock curto, fora da chamada de rede.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS, janela_segundos=DEPENDENCY_WINDOW_SECONDS,
+                 max_eventos=DEPENDENCY_WINDOW_MAX_EVENTS):
+        self.latencias = HistogramasSharded(buckets)
+        self.janela_segundos = janela_segundos
+        self.max_eventos = max_eventos
+        self._lock = threading.Lock()
+        self._status = defaultdict(lambda: defaultdict(int))
+        self._timeouts = defaultdict(int)
+        self._eventos = defaultdict(lambda: deque(maxlen=self.max_eventos))
+        self._ultimo_erro = {}
+        self._sessao = None
+        self._lock_sessao = threading.Lock()
+
+    def sessao(self):
+        """requests.Session compartilhada (keep-alive), criada no primeiro envio.
+
+        O import de requests/urllib3 pesa no cold start e so e necessario quando
+        alguma dependencia externa e de fato chamada.
+        """
+        if self._sessao is None:
+            with self._lock_sessao:
+                if self._sessao is None:
+                    import requests
+
+                    self._sessao = requests.Session()
+        return self._sessao
+
+    def fechar_sessao(self):
+        with self._lock_sessao:
+            sessao, self._sessao = self._sessao, None
+        if sessao is not None:
+            sessao.close()
+
+    def reiniciar_apos_fork(self):
+        # A sessao herdada compartilha sockets com o processo pai: descarta sem fechar.
+        self._lock_sessao = threading.Lock()
+        self._sessao = None
+
+    def registrar(self, dependencia, duracao_ms, status=None, erro=None, timeout=False, agora=None):
+        agora = time.time() if agora is None else agora
+        duracao_ms = round(duracao_ms, 2)
+        falhou = bool(erro) or timeout or (status is not None and status >= 400)
+        self.latencias.observar((dependencia,), duracao_ms)
+        with self._lock:
+            if timeout:
+                self._timeouts[dependencia] += 1
+                rotulo = "timeout"
+            elif status is not None:
+                rotulo = str(status)
+            else:
+                rotulo = "error" if falhou else "ok"
+            self._status[dependencia][rotulo] += 1
+            self._eventos[dependencia].append((agora, falhou, duracao_ms))
+            if falhou:
+                self._ultimo_erro[dependencia] = {
+                    "at": datetime.fromtimestamp(agora, tz=timezone.utc).isoformat(),
+                    "status": rotulo,
+                    "error": str(erro or rotulo)[:300],
+                }
+
+    def post(self, dependencia, url, **kwargs):
+        """POST medido; excecoes de rede sao registradas e repassadas."""
+        sessao = self.sessao()
+        import requests
+
+        inicio = time.perf_counter()
+        try:
+            response = sessao.post(url, **kwargs)
+        except requests.Timeout as exc:
+            self.registrar(dependencia, (time.perf_counter() - inicio) * 1000, erro=exc, timeout=True)
+            raise
+        except requests.RequestException as exc:
+            self.registrar(dependencia, (time.perf_counter() - inicio) * 1000, erro=exc)
+            raise
+        self.registrar(dependencia, (time.perf_counter() - inicio) * 1000, status=response.status_code)
+        return response
+
+    def janela(self, dependencia, agora=None):
+        agora = time.time() if agora is None else agora
+        limite = agora - self.janela_segundos
+        with self._lock:
+            eventos = [evento for evento in self._eventos.get(dependencia, ()) if evento[0] >= limite]
+        chamadas = len(eventos)
+        erros = sum(1 for _, falhou, _ in eventos if falhou)
+        duracoes = sorted(duracao for _, _, duracao in eventos)
+        p95 = duracoes[min(chamadas - 1, int(0.95 * chamadas))] if chamadas else None
+        return {
+            "window_seconds": self.janela_segundos,
+            "calls": chamadas,
+            "errors": erros,
+            "error_rate": round(erros / chamadas, 4) if chamadas else 0.0,
+            "p95_ms": p95,
+        }
+
+    def resumo(self, agora=None):
+        historico = {
+            linha["dependency"]: linha
+            for linha in resumir_histogramas(
+                self.latencias.snapshot(), self.latencias.buckets, ("dependency",)
+            )
+        }
+        with self._lock:
+            nomes = sorted(set(self._status) | set(historico))
+            status = {nome: dict(self._status.get(nome, {})) for nome in nomes}
+            timeouts = {nome: self._timeouts.get(nome, 0) for nome in nomes}
+            ultimo_erro = {nome: dict(self._ultimo_erro[nome]) for nome in nomes if nome in self._ultimo_erro}
+
+        resultado = {}
+        for nome in nomes:
+            item = dict(historico.get(nome) or {"dependency": nome, "count": 0})
+            item.pop("dependency", None)
+            item["timeouts"] = timeouts[nome]
+            item["status_codes"] = status[nome]
+            item["last_error"] = ultimo_erro.get(nome)
+            item["window"] = self.janela(nome, agora=agora)
+            resultado[nome] = item
+        return resultado
+
+    def limpar(self):
+        self.latencias.limpar()
+        with self._lock:
+            self._status.clear()
+            self._timeouts.clear()
+            self._eventos.clear()
+            self._ultimo_erro.clear()
+
+
+MONITOR_DEPENDENCIAS = MonitorDependencias()
+
+
+def post_monitorado(dependencia, url, **kwargs):
+    return MONITOR_DEPENDENCIAS.post(dependencia, url, **kwargs)
@@ -0,0 +1,195 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+OBS_LOG_QUEUE_MAX = 10000
+OBS_LOG_BATCH_MAX = 256
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class ObsJsonFormatter(logging.Formatter):
+    """Serializa o dict do obs_log so na thread de escrita (fora da requisicao)."""
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            payload = {"ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat()}
+            payload.update(record.msg)
+            return json.dumps(payload, ensure_ascii=False, default=_json_default)
+        return super().format(record)
+
+
+class FilaLogHandler(QueueHandler):
+    """QueueHandler com fila limitada: descarta (e conta) em vez de bloquear o worker."""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self._lock_descartes = threading.Lock()
+        self.descartados = 0
+
+    def prepare(self, record):
+        # O payload ja e um dict novo por chamada; nada de format() na thread da requisicao.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_descartes:
+                self.descartados += 1
+
+
+class EscritorLogLote:
+    """Consome a fila e escreve os registros em lote, com um unico flush por lote."""
+
+    def __init__(self, fila, stream=None, formatter=None, lote_max=OBS_LOG_BATCH_MAX):
+        self.fila = fila
+        self.stream = stream if stream is not None else sys.stderr
+        self.formatter = formatter or ObsJsonFormatter()
+        self.lote_max = max(1, int(lote_max))
+        self._thread = None
+        self._parar = object()
+        self.lotes = 0
+        self.escritos = 0
+
+    def iniciar(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="obs-log-writer", daemon=True)
+        self._thread.start()
+
+    def parar(self, timeout=5):
+        if self._thread is None:
+            return
+        self.fila.put(self._parar)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _formatar(self, record):
+        try:
+            return self.formatter.format(record)
+        except Exception as exc:
+            return json.dumps({"event": "log_format_error", "error": str(exc)})
+
+    def _escrever(self, registros):
+        if not registros:
+            return
+        try:
+            self.stream.write("\n".join(self._formatar(r) for r in registros) + "\n")
+            self.stream.flush()
+        except Exception:
+            pass
+        self.lotes += 1
+        self.escritos += len(registros)
+
+    def _loop(self):
+        while True:
+            item = self.fila.get()
+            registros = []
+            encerrar = item is self._parar
+            if not encerrar:
+                registros.append(item)
+            while not encerrar and len(registros) < self.lote_max:
+                try:
+                    item = self.fila.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._parar:
+                    encerrar = True
+                    break
+                registros.append(item)
+            self._escrever(registros)
+            if encerrar:
+                return
+
+
+def configurar_log_assincrono(logger, stream=None, max_fila=OBS_LOG_QUEUE_MAX, lote_max=OBS_LOG_BATCH_MAX):
+    fila = queue.Queue(maxsize=max(1, int(max_fila)))
+    handler = FilaLogHandler(fila)
+    escritor = EscritorLogLote(fila, stream=stream, lote_max=lote_max)
+    logger.handlers = [handler]
+    logger.propagate = False
+    escritor.iniciar()
+    return handler, escritor
+
+
+def reiniciar_log_assincrono(handler, escritor):
+    """No processo filho apos fork: fila nova (o lock da herdada pode ter ficado preso) e thread nova."""
+    fila = queue.Queue(maxsize=handler.queue.maxsize)
+    handler.queue = fila
+    handler._lock_descartes = threading.Lock()
+    escritor.fila = fila
+    escritor._thread = None
+    escritor.iniciar()
+
+
+class _StreamLento:
+    """Simula stdout ligado a um coletor de logs: cada write custa `latencia` segundos."""
+
+    def __init__(self, latencia):
+        self.latencia = latencia
+
+    def write(self, dados):
+        time.sleep(self.latencia)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+
+def benchmark_log_requisicao(total=20000, latencia_escrita=0.0001):
+    """Compara o custo por chamada de log sincrono (json.dumps + StreamHandler) com a fila."""
+    campos = {
+        "event": "http_request",
+        "request_id": "abc123",
+        "method": "GET",
+        "path": "/",
+        "status": 200,
+        "latency_ms": 12.5,
+        "ip": "203.0.113.10",
+        "user_agent": "Mozilla/5.0 (benchmark)",
+    }
+    resultados = {}
+
+    logger_sync = logging.getLogger("obs.bench.sync")
+    logger_sync.propagate = False
+    handler_sync = logging.StreamHandler(_StreamLento(latencia_escrita))
+    handler_sync.setFormatter(logging.Formatter("%(message)s"))
+    logger_sync.handlers = [handler_sync]
+    logger_sync.setLevel(logging.INFO)
+    inicio = time.perf_counter()
+    for _ in range(total):
+        payload = {"ts": datetime.now(timezone.utc).isoformat(), **campos}
+        logger_sync.info(json.dumps(payload, ensure_ascii=False, default=_json_default))
+    resultados["sync_us_por_log"] = round((time.perf_counter() - inicio) / total * 1e6, 2)
+
+    logger_async = logging.getLogger("obs.bench.async")
+    logger_async.setLevel(logging.INFO)
+    handler, escritor = configurar_log_assincrono(
+        logger_async,
+        stream=_StreamLento(latencia_escrita),
+        max_fila=total + 1,
+    )
+    inicio = time.perf_counter()
+    for _ in range(total):
+        logger_async.info(dict(campos))
+    resultados["fila_us_por_log"] = round((time.perf_counter() - inicio) / total * 1e6, 2)
+    escritor.parar()
+    resultados["latencia_escrita_us"] = round(latencia_escrita * 1e6, 2)
+    resultados["fila_lotes"] = escritor.lotes
+    resultados["fila_descartados"] = handler.descartados
+    return resultados
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(json.dumps(benchmark_log_requisicao(total=total), indent=2))
@@ -0,0 +1,360 @@
+import itertools
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class _RegistroPorThread(ABC):
+    """Base dos registros sharded: um shard (dict) por thread, somado so na leitura.
+
+    Cada thread escreve apenas no proprio shard, sem lock global; o lock e usado
+    na criacao do shard e na agregacao. Shards de threads encerradas sao
+    consolidados na base (na leitura ou quando a lista de shards cresce demais,
+    caso de servidores que criam uma thread por requisicao).
+    """
+
+    max_shards_antes_de_consolidar = 256
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._base = {}
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                if len(self._shards) >= self.max_shards_antes_de_consolidar:
+                    self._consolidar_encerrados()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _consolidar_encerrados(self):
+        vivos = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                vivos.append((thread, shard))
+            else:
+                self._somar(self._base, shard)
+        self._shards = vivos
+        return vivos
+
+    def _agregar(self):
+        with self._lock:
+            vivos = self._consolidar_encerrados()
+            resultado = {}
+            self._somar(resultado, self._base)
+            for _, shard in vivos:
+                self._somar(resultado, shard)
+        return resultado
+
+    @abstractmethod
+    def _somar(self, destino, origem):
+        """Acumula o shard `origem` em `destino` (mesmo formato de item)."""
+
+    def limpar(self):
+        with self._lock:
+            self._base = {}
+            for _, shard in self._shards:
+                shard.clear()
+
+
+class HistogramasSharded(_RegistroPorThread):
+    """Histogramas de bucket fixo com um shard por thread."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        super().__init__()
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _novo_item(self):
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observar(self, chave, valor):
+        shard = self._shard()
+        item = shard.get(chave)
+        if item is None:
+            item = self._novo_item()
+            shard[chave] = item
+        indice = len(self.buckets)
+        for posicao, limite in enumerate(self.buckets):
+            if valor <= limite:
+                indice = posicao
+                break
+        item[0][indice] += 1
+        item[1] += valor
+        item[2] += 1
+
+    def _somar(self, destino, origem):
+        for chave, (contagens, soma, total) in list(origem.items()):
+            alvo = destino.get(chave)
+            if alvo is None:
+                alvo = self._novo_item()
+                destino[chave] = alvo
+            for indice, valor in enumerate(list(contagens)):
+                alvo[0][indice] += valor
+            alvo[1] += soma
+            alvo[2] += total
+
+    def snapshot(self):
+        return {
+            chave: {"buckets": contagens, "sum": soma, "count": total}
+            for chave, (contagens, soma, total) in self._agregar().items()
+        }
+
+
+class ContadoresSharded(_RegistroPorThread):
+    """Contadores inteiros por thread; snapshot() devolve o dict somado."""
+
+    def incrementar(self, chave, quantidade=1):
+        shard = self._shard()
+        shard[chave] = shard.get(chave, 0) + quantidade
+
+    def _somar(self, destino, origem):
+        for chave, valor in origem.copy().items():
+            destino[chave] = destino.get(chave, 0) + valor
+
+    def snapshot(self):
+        return self._agregar()
+
+
+class UltimosValoresSharded(_RegistroPorThread):
+    """Ultimo valor por chave; cada escrita leva um numero de sequencia global e a leitura fica com o maior."""
+
+    def __init__(self):
+        super().__init__()
+        self._sequencia = itertools.count(1)
+
+    def registrar(self, chave, valor):
+        self._shard()[chave] = (next(self._sequencia), valor)
+
+    def _somar(self, destino, origem):
+        for chave, item in origem.copy().items():
+            atual = destino.get(chave)
+            if atual is None or item[0] > atual[0]:
+                destino[chave] = item
+
+    def snapshot(self):
+        return {chave: valor for chave, (_, valor) in self._agregar().items()}
+
+
+def gravar_json_atomico(caminho, dados):
+    """Grava via arquivo temporario + rename: quem le nunca ve o JSON pela metade."""
+    diretorio = os.path.dirname(caminho) or "."
+    os.makedirs(diretorio, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=diretorio, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False)
+        os.replace(tmp_path, caminho)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _processo_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricasMultiprocesso:
+    """Soma os registros de todos os processos do servidor (ex.: workers do gunicorn).
+
+    Mesmo modelo do modo multiprocess do prometheus_client: cada processo grava o
+    proprio snapshot em `metrics-<pid>.json` num diretorio compartilhado e quem atende
+    a leitura soma todos os arquivos. Arquivos de processos encerrados continuam na
+    soma para os contadores nunca voltarem; o diretorio e limpo quando o servidor sobe.
+
+    `coletar()` devolve {"histograms": {nome: snapshot}, "counters": {nome: dict}}.
+    """
+
+    prefixo = "metrics-"
+
+    def __init__(self, diretorio, coletar):
+        self.diretorio = diretorio
+        self.coletar = coletar
+        self.iniciado_em = time.time()
+        self._lock = threading.Lock()
+
+    def reiniciar_apos_fork(self):
+        self.iniciado_em = time.time()
+
+    def _arquivo(self, pid):
+        return os.path.join(self.diretorio, f"{self.prefixo}{pid}.json")
+
+    def gravar(self):
+        dados = self.coletar()
+        registro = {
+            "pid": os.getpid(),
+            "started_at": self.iniciado_em,
+            "written_at": time.time(),
+            "histograms": {
+                nome: [[list(chave), item["buckets"], item["sum"], item["count"]] for chave, item in snapshot.items()]
+                for nome, snapshot in dados.get("histograms", {}).items()
+            },
+            "counters": dados.get("counters", {}),
+        }
+        with self._lock:
+            gravar_json_atomico(self._arquivo(registro["pid"]), registro)
+        return registro
+
+    def _ler_registros(self):
+        try:
+            nomes = sorted(os.listdir(self.diretorio))
+        except FileNotFoundError:
+            return []
+        registros = []
+        for nome in nomes:
+            if not (nome.startswith(self.prefixo) and nome.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.diretorio, nome), "r", encoding="utf-8") as f:
+                    registros.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return registros
+
+    def agregar(self):
+        """Grava o snapshot atual deste processo e devolve a soma de todos os processos."""
+        proprio = self.gravar()
+        histogramas = {}
+        contadores = {}
+        processos = []
+        for registro in self._ler_registros():
+            pid = registro.get("pid")
+            processos.append({
+                "pid": pid,
+                "started_at": registro.get("started_at"),
+                "alive": pid == proprio["pid"] or (isinstance(pid, int) and _processo_vivo(pid)),
+            })
+            for nome, itens in (registro.get("histograms") or {}).items():
+                destino = histogramas.setdefault(nome, {})
+                for chave, buckets, soma, total in itens:
+                    chave = tuple(chave)
+                    alvo = destino.get(chave)
+                    if alvo is None:
+                        destino[chave] = {"buckets": list(buckets), "sum": soma, "count": total}
+                        continue
+                    alvo["buckets"] = [a + b for a, b in zip(alvo["buckets"], buckets)]
+                    alvo["sum"] += soma
+                    alvo["count"] += total
+            for nome, valores in (registro.get("counters") or {}).items():
+                destino = contadores.setdefault(nome, {})
+                for chave, valor in valores.items():
+                    destino[chave] = destino.get(chave, 0) + valor
+        return {"histograms": histogramas, "counters": contadores, "processes": processos}
+
+
+def limpar_diretorio_metricas(diretorio):
+    """Apaga os snapshots de uma execucao anterior do servidor (chamado no master, antes dos workers)."""
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return 0
+    removidos = 0
+    for nome in nomes:
+        if nome.startswith(MetricasMultiprocesso.prefixo) or nome.startswith(".tmp-"):
+            try:
+                os.unlink(os.path.join(diretorio, nome))
+                removidos += 1
+            except OSError:
+                pass
+    return removidos
+
+
+def estimar_percentil(item, buckets, q):
+    """Estimativa por interpolacao linear dentro do bucket (como histogram_quantile)."""
+    total = item.get("count") or 0
+    if total <= 0:
+        return None
+    alvo = q * total
+    acumulado = 0
+    inferior = 0.0
+    for indice, contagem in enumerate(item["buckets"]):
+        superior = buckets[indice] if indice < len(buckets) else None
+        if acumulado + contagem >= alvo and contagem > 0:
+            if superior is None:
+                return buckets[-1] if buckets else None
+            fracao = (alvo - acumulado) / contagem
+            return round(inferior + (superior - inferior) * fracao, 2)
+        acumulado += contagem
+        if superior is not None:
+            inferior = superior
+    return buckets[-1] if buckets else None
+
+
+def resumir_histogramas(snapshot, buckets, rotulos, limite=None, ordenar_por="count"):
+    linhas = []
+    for chave, item in snapshot.items():
+        total = item.get("count") or 0
+        if not total:
+            continue
+        linha = dict(zip(rotulos, chave))
+        linha.update({
+            "count": total,
+            "total_ms": round(item["sum"], 2),
+            "avg_ms": round(item["sum"] / total, 2),
+            "p50_ms": estimar_percentil(item, buckets, 0.50),
+            "p95_ms": estimar_percentil(item, buckets, 0.95),
+            "p99_ms": estimar_percentil(item, buckets, 0.99),
+        })
+        linhas.append(linha)
+    linhas.sort(key=lambda linha: linha[ordenar_por], reverse=True)
+    return linhas[:limite] if limite else linhas
+
+
+def _prom_escape(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _prom_labels(pares):
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{nome}="{_prom_escape(valor)}"' for nome, valor in pares) + "}"
+
+
+def _prom_numero(valor):
+    if isinstance(valor, float):
+        if math.isinf(valor):
+            return "+Inf"
+        return repr(round(valor, 6))
+    return str(valor)
+
+
+def prometheus_histograma(nome, ajuda, snapshot, buckets, rotulos, escala=1.0):
+    """Serializa um snapshot no formato texto do Prometheus (buckets cumulativos)."""
+    linhas = [f"# HELP {nome} {ajuda}", f"# TYPE {nome} histogram"]
+    for chave in sorted(snapshot, key=lambda c: tuple(str(p) for p in c)):
+        item = snapshot[chave]
+        base = list(zip(rotulos, chave))
+        acumulado = 0
+        for indice, contagem in enumerate(item["buckets"]):
+            acumulado += contagem
+            limite = _prom_numero(buckets[indice] * escala) if indice < len(buckets) else "+Inf"
+            linhas.append(f"{nome}_bucket{_prom_labels(base + [('le', limite)])} {acumulado}")
+        linhas.append(f"{nome}_sum{_prom_labels(base)} {_prom_numero(float(item['sum']) * escala)}")
+        linhas.append(f"{nome}_count{_prom_labels(base)} {item['count']}")
+    return linhas
+
+
+def prometheus_contadores(nome, ajuda, contadores, rotulo="name"):
+    linhas = [f"# HELP {nome} {ajuda}", f"# TYPE {nome} counter"]
+    for chave in sorted(contadores):
+        linhas.append(f"{nome}{_prom_labels([(rotulo, chave)])} {_prom_numero(contadores[chave])}")
+    return linhas
@@ -0,0 +1,169 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from obs_metrics import gravar_json_atomico
+
+PROFILER_MAX_PROFILES = 20
+PROFILER_TOP_FUNCTIONS = 25
+_ARQUIVO_PERFIL = re.compile(r"\d{13}-[0-9a-f]{12}\.json")
+
+
+def _nome_funcao(chave, raiz=None):
+    arquivo, linha, funcao = chave
+    if arquivo == "~":
+        # Funcoes built-in (ex.: <method 'execute' of 'psycopg2.extensions.cursor' objects>).
+        return funcao
+    if raiz and arquivo.startswith(raiz):
+        arquivo = os.path.relpath(arquivo, raiz)
+    else:
+        partes = arquivo.replace("\\", "/").split("/")
+        arquivo = "/".join(partes[-2:])
+    return f"{arquivo}:{linha}({funcao})"
+
+
+def resumir_perfil(profile, raiz=None, limite=PROFILER_TOP_FUNCTIONS):
+    """Top funcoes por tempo acumulado e por tempo proprio, a partir do cProfile."""
+    stats = pstats.Stats(profile).stats
+    linhas = []
+    total_chamadas = 0
+    for chave, (chamadas_primitivas, chamadas, proprio, acumulado, _) in stats.items():
+        total_chamadas += chamadas
+        linhas.append({
+            "function": _nome_funcao(chave, raiz),
+            "calls": chamadas,
+            "primitive_calls": chamadas_primitivas,
+            "tottime_ms": round(proprio * 1000, 3),
+            "cumtime_ms": round(acumulado * 1000, 3),
+        })
+    por_acumulado = sorted(linhas, key=lambda item: item["cumtime_ms"], reverse=True)[:limite]
+    por_proprio = sorted(linhas, key=lambda item: item["tottime_ms"], reverse=True)[:limite]
+    return {
+        "total_calls": total_chamadas,
+        "functions": len(linhas),
+        "top_cumulative": por_acumulado,
+        "top_self": por_proprio,
+    }
+
+
+class ProfilerRequisicoes:
+    """Guarda os ultimos N perfis de requisicao em memoria ou, com `diretorio`, em disco.
+
+    Com varios processos (workers do gunicorn) o perfil e capturado num worker e a tela
+    de admin pode cair em outro: com um diretorio compartilhado cada perfil vira um
+    arquivo `<epoch_ms>-<id>.json` e todos os processos enxergam os mesmos N mais novos.
+
+    So um perfil roda por vez: o cProfile de uma thread nao ve as outras e, a partir
+    do Python 3.12, nao aceita dois profilers ativos; pedidos concorrentes sao ignorados.
+    """
+
+    def __init__(self, max_perfis=PROFILER_MAX_PROFILES, top_funcoes=PROFILER_TOP_FUNCTIONS, raiz=None, diretorio=None):
+        self.top_funcoes = top_funcoes
+        self.raiz = raiz
+        self.diretorio = diretorio or None
+        self.max_perfis = max(1, int(max_perfis))
+        self._perfis = deque(maxlen=self.max_perfis)
+        self._lock = threading.Lock()
+        self._ocupado = threading.Lock()
+        self.ignorados = 0
+
+    def iniciar(self):
+        if not self._ocupado.acquire(blocking=False):
+            with self._lock:
+                self.ignorados += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except Exception:
+            self._ocupado.release()
+            raise
+        return profile
+
+    def descartar(self, profile):
+        if profile is None:
+            return
+        try:
+            profile.disable()
+        finally:
+            self._ocupado.release()
+
+    def finalizar(self, profile, **meta):
+        if profile is None:
+            return None
+        self.descartar(profile)
+        perfil = {
+            "id": uuid.uuid4().hex[:12],
+            "at": datetime.now(timezone.utc).isoformat(),
+            "epoch": time.time(),
+            **meta,
+        }
+        perfil.update(resumir_perfil(profile, raiz=self.raiz, limite=self.top_funcoes))
+        if self.diretorio:
+            nome = f"{int(perfil['epoch'] * 1000):013d}-{perfil['id']}.json"
+            gravar_json_atomico(os.path.join(self.diretorio, nome), perfil)
+            self._podar_diretorio()
+            return perfil
+        with self._lock:
+            self._perfis.appendleft(perfil)
+        return perfil
+
+    def _arquivos(self):
+        """Nomes dos perfis em disco, do mais novo para o mais antigo."""
+        try:
+            nomes = os.listdir(self.diretorio)
+        except FileNotFoundError:
+            return []
+        return sorted((nome for nome in nomes if _ARQUIVO_PERFIL.fullmatch(nome)), reverse=True)
+
+    def _podar_diretorio(self):
+        for nome in self._arquivos()[self.max_perfis:]:
+            try:
+                os.unlink(os.path.join(self.diretorio, nome))
+            except FileNotFoundError:
+                # Outro processo podou primeiro.
+                pass
+
+    def _ler(self, nome):
+        try:
+            with open(os.path.join(self.diretorio, nome), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def listar(self):
+        if self.diretorio:
+            perfis = (self._ler(nome) for nome in self._arquivos()[:self.max_perfis])
+            return [perfil for perfil in perfis if perfil]
+        with self._lock:
+            return [dict(item) for item in self._perfis]
+
+    def obter(self, perfil_id):
+        if self.diretorio:
+            for nome in self._arquivos():
+                if nome.endswith(f"-{perfil_id}.json"):
+                    return self._ler(nome)
+            return None
+        with self._lock:
+            for item in self._perfis:
+                if item["id"] == perfil_id:
+                    return dict(item)
+        return None
+
+    def limpar(self):
+        with self._lock:
+            self._perfis.clear()
+            self.ignorados = 0
+        if self.diretorio:
+            for nome in self._arquivos():
+                try:
+                    os.unlink(os.path.join(self.diretorio, nome))
+                except FileNotFoundError:
+                    pass
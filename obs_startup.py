@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+
+STARTUP_PROBE_PATH = "/healthz"
+STARTUP_TOP_MODULES = 15
+# Modulos que nao devem ser carregados no import do app (ficam para o primeiro uso).
+STARTUP_LAZY_MODULES = ("requests", "urllib3", "cryptography.fernet")
+STARTUP_RESULT_PREFIX = "STARTUP_RESULT "
+
+_SONDA = """
+import json, sys, time
+inicio = time.perf_counter()
+import app as modulo
+importado = time.perf_counter()
+cliente = modulo.criar_app(aquecer=False).test_client()
+resposta = cliente.get(sys.argv[1])
+fim = time.perf_counter()
+print(%r + json.dumps({
+    "import_ms": round((importado - inicio) * 1000, 2),
+    "first_response_ms": round((fim - importado) * 1000, 2),
+    "total_ms": round((fim - inicio) * 1000, 2),
+    "status": resposta.status_code,
+    "lazy_loaded": {nome: nome in sys.modules for nome in sys.argv[2:]},
+}), flush=True)
+""" % STARTUP_RESULT_PREFIX
+
+
+def resumir_importtime(saida, limite=STARTUP_TOP_MODULES):
+    """Le a saida de `python -X importtime` e devolve os modulos mais caros (tempo proprio)."""
+    modulos = []
+    for linha in saida.splitlines():
+        if not linha.startswith("import time:"):
+            continue
+        partes = linha[len("import time:"):].split("|")
+        if len(partes) != 3:
+            continue
+        try:
+            proprio, acumulado = int(partes[0]), int(partes[1])
+        except ValueError:
+            continue
+        modulos.append({
+            "module": partes[2].strip(),
+            "self_ms": round(proprio / 1000, 2),
+            "cumulative_ms": round(acumulado / 1000, 2),
+        })
+    modulos.sort(key=lambda item: item["self_ms"], reverse=True)
+    return modulos[:limite]
+
+
+def medir_startup(raiz=None, caminho=STARTUP_PROBE_PATH, env=None, python=None, timeout=120):
+    """Sobe o app num processo novo: tempo de import, tempo ate a primeira resposta e importtime."""
+    raiz = raiz or os.path.dirname(os.path.abspath(__file__))
+    ambiente = dict(os.environ if env is None else env)
+    processo = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-c", _SONDA, caminho, *STARTUP_LAZY_MODULES],
+        cwd=raiz,
+        env=ambiente,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    )
+    resultado = None
+    for linha in processo.stdout.splitlines():
+        if linha.startswith(STARTUP_RESULT_PREFIX):
+            resultado = json.loads(linha[len(STARTUP_RESULT_PREFIX):])
+    if processo.returncode != 0 or resultado is None:
+        raise RuntimeError(
+            f"Sonda de startup falhou (exit {processo.returncode}): {processo.stderr.strip()[-2000:]}"
+        )
+    resultado["top_modules"] = resumir_importtime(processo.stderr)
+    return resultado
+
+
+if __name__ == "__main__":
+    caminho = sys.argv[1] if len(sys.argv) > 1 else STARTUP_PROBE_PATH
+    print(json.dumps(medir_startup(caminho=caminho), indent=2))
@@ -12,6 +12,7 @@ const PORT = Number(process.env.PORT || 10000);
 const WA_SENDER_TOKEN = (process.env.WA_SENDER_TOKEN || '').trim();
 const AUTH_DIR = (process.env.AUTH_DIR || './auth').trim();
 const MIN_SECONDS_BETWEEN_SAME_NUMBER = Number(process.env.MIN_SECONDS_BETWEEN_SAME_NUMBER || 60);
+const MAX_BATCH_MESSAGES = Math.max(1, Number(process.env.MAX_BATCH_MESSAGES || 50));
 
 if (!WA_SENDER_TOKEN) {
   console.error('❌ WA_SENDER_TOKEN não configurado. Encerrando.');
@@ -75,7 +76,8 @@ function parseBearerToken(req) {
 function authMiddleware(req, res, next) {
   const ip = getClientIp(req);
   if (isAuthRateLimited(ip)) {
-    return res.status(429).json({ ok: false, error: 'rate_limited' });
+    res.set('Retry-After', '60');
+    return res.status(429).json({ ok: false, error: 'rate_limited', retry_after: 60 });
   }
   const token = parseBearerToken(req);
   if (!token || !safeTokenEquals(token, WA_SENDER_TOKEN)) {
@@ -109,6 +111,14 @@ function markSent(phone) {
   lastSentByNumber.set(phone, Date.now());
 }
 
+async function sendText(phone, message, orderId) {
+  const jid = `${phone}@s.whatsapp.net`;
+  const sent = await sock.sendMessage(jid, { text: message });
+  markSent(phone);
+  console.log(`📤 Envio realizado para ${phone} (order_id=${orderId || '-'})`);
+  return sent?.key?.id || null;
+}
+
 function scheduleReconnect(delayMs = 3000) {
   if (reconnectTimer) return;
   reconnectTimer = setTimeout(() => {
@@ -211,18 +221,15 @@ app.post('/send', authMiddleware, async (req, res) => {
 
     const limiter = canSendToNumber(phone);
     if (!limiter.ok) {
+      res.set('Retry-After', String(limiter.waitSeconds));
       return res.status(429).json({
         ok: false,
-        error: `aguarde ${limiter.waitSeconds}s para enviar novamente para este número`
+        error: `aguarde ${limiter.waitSeconds}s para enviar novamente para este número`,
+        retry_after: limiter.waitSeconds
       });
     }
 
-    const jid = `${phone}@s.whatsapp.net`;
-    const sent = await sock.sendMessage(jid, { text: message });
-    markSent(phone);
-
-    const messageId = sent?.key?.id || null;
-    console.log(`📤 Envio realizado para ${phone} (order_id=${orderId || '-'})`);
+    const messageId = await sendText(phone, message, orderId);
 
     return res.json({
       ok: true,
@@ -235,6 +242,54 @@ app.post('/send', authMiddleware, async (req, res) => {
   }
 });
 
+app.post('/send-batch', authMiddleware, async (req, res) => {
+  if (!isConnected || !sock) {
+    res.set('Retry-After', '5');
+    return res.status(503).json({ ok: false, error: 'whatsapp não conectado', retry_after: 5 });
+  }
+
+  const messages = Array.isArray(req.body.messages) ? req.body.messages : null;
+  if (!messages || !messages.length) {
+    return res.status(400).json({ ok: false, error: 'messages obrigatório' });
+  }
+  if (messages.length > MAX_BATCH_MESSAGES) {
+    return res.status(400).json({ ok: false, error: `máximo de ${MAX_BATCH_MESSAGES} mensagens por lote` });
+  }
+
+  // Resultado por item: o lote nunca falha inteiro por causa de um número.
+  const results = [];
+  for (const item of messages) {
+    const orderId = item?.order_id || null;
+    try {
+      const phone = validatePhone(item?.phone);
+      const message = String(item?.message || '').trim();
+      if (!message) {
+        results.push({ ok: false, order_id: orderId, error: 'message obrigatório' });
+        continue;
+      }
+
+      const limiter = canSendToNumber(phone);
+      if (!limiter.ok) {
+        results.push({
+          ok: false,
+          order_id: orderId,
+          error: `aguarde ${limiter.waitSeconds}s para enviar novamente para este número`,
+          retry_after: limiter.waitSeconds
+        });
+        continue;
+      }
+
+      const messageId = await sendText(phone, message, orderId);
+      results.push({ ok: true, order_id: orderId, message_id: messageId });
+    } catch (err) {
+      console.error('❌ Erro no /send-batch:', err.message);
+      results.push({ ok: false, order_id: orderId, error: err.message || 'erro ao enviar' });
+    }
+  }
+
+  return res.json({ ok: true, results });
+});
+
 app.listen(PORT, async () => {
   console.log(`🚀 WA sender HTTP ativo na porta ${PORT}`);
   await connectWhatsApp().catch((err) => {
@@ -1,2 +1,6 @@
 #!/bin/bash
-python app.py
+# APP_SERVER=flask usa o servidor de desenvolvimento (um processo, sem tuning de keep-alive).
+if [ "${APP_SERVER:-gunicorn}" = "flask" ]; then
+  exec python app.py
+fi
+exec gunicorn -c gunicorn.conf.py
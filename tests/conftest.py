@@ -23,6 +23,7 @@ def app_module():
     os.environ.setdefault("BACKGROUND_WORKERS_ENABLED", "false")
     os.environ.setdefault("BACKUP_WORKER_ENABLED", "false")
     os.environ.setdefault("OBS_ALERTS_ENABLED", "false")
+    os.environ.setdefault("ASSET_IMAGE_VARIANTS_ENABLED", "false")
 
     if "app" in sys.modules:
         del sys.modules["app"]
@@ -37,9 +38,25 @@ def reset_app_state(app_module):
     app_module._request_rate_limit.clear()
     app_module._failed_login_attempts.clear()
     app_module._online_sessions.clear()
-    app_module.OBS_COUNTERS.clear()
+    app_module.OBS_COUNTERS.limpar()
+    app_module.OBS_COMPONENT_STATE.limpar()
+    app_module.OBS_LAST_REQUEST.limpar()
     app_module.OBS_INCIDENTS.clear()
     app_module.OBS_ALERT_LAST_SENT.clear()
+    app_module.OBS_HTTP_LATENCY.limpar()
+    app_module.OBS_DB_QUERIES.limpar()
+    app_module.MONITOR_DEPENDENCIAS.limpar()
+    app_module.OBS_PROFILER.limpar()
+    app_module._remember_token_cache.clear()
+    app_module._last_login_pending.clear()
+    app_module._last_login_written_at.clear()
+    app_module._page_cache.clear()
+    app_module._afiliado_ativo_cache.clear()
+    app_module._prova_comercial_cache.clear()
+    app_module._page_cache_versao.update(versao=None, checado_em=0.0)
+    app_module.obter_versao_afiliados = lambda: (0, None)
+    app_module._remember_cache_versao.update(versao=None, checado_em=0.0)
+    app_module.obter_versao_remember_tokens = lambda: 0
     app_module.registrar_evento_funil = lambda *args, **kwargs: False
     app_module.buscar_primeiro_evento_funil_usuario = lambda *args, **kwargs: None
 
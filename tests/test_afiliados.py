@@ -31,3 +31,60 @@ def test_admin_afiliado_adicionar_sem_login_redireciona(app_module, client, monk
     )
     assert response.status_code == 302
     assert response.headers["Location"].endswith("/admin/login")
+
+
+def test_landing_afiliado_usa_cache_e_invalida_ao_editar(app_module, client, monkeypatch):
+    chamadas = {"render": 0, "busca": 0}
+    render_original = app_module.render_template
+
+    def render_contado(*args, **kwargs):
+        chamadas["render"] += 1
+        return render_original(*args, **kwargs)
+
+    def buscar(slug, apenas_ativos=True):
+        chamadas["busca"] += 1
+        return {"slug": slug, "nome": "Afiliado Teste", "ativo": True}
+
+    monkeypatch.setattr(app_module, "render_template", render_contado)
+    monkeypatch.setattr(app_module, "buscar_afiliado_por_slug", buscar)
+    monkeypatch.setattr(app_module, "validar_csrf_token", lambda token: True)
+    monkeypatch.setattr(app_module, "atualizar_afiliado", lambda **kwargs: True)
+
+    primeira = client.get("/afiliado-teste")
+    segunda = client.get("/afiliado-teste")
+    assert primeira.status_code == 200
+    assert primeira.get_data() == segunda.get_data()
+    assert "-afiliado-teste" in segunda.get_data(as_text=True)
+    assert segunda.get_data(as_text=True).count(app_module.asset_url("theme-toggle.css")) == 1
+    assert chamadas == {"render": 1, "busca": 1}
+
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    client.post(
+        "/admin/afiliados/afiliado-teste/editar",
+        data={"csrf_token": "ok", "slug": "afiliado-teste", "nome": "Novo Nome", "ativo": "on"},
+    )
+
+    client.get("/afiliado-teste")
+    assert chamadas == {"render": 2, "busca": 2}
+
+
+def test_landing_afiliado_ve_exclusao_feita_em_outro_processo(app_module, client, monkeypatch):
+    versao = {"atual": (1, "2026-01-01T00:00:00")}
+    ativos = {"afiliado-teste"}
+
+    monkeypatch.setattr(app_module, "PAGE_CACHE_VERSION_CHECK_SECONDS", 0)
+    monkeypatch.setattr(app_module, "obter_versao_afiliados", lambda: versao["atual"])
+    monkeypatch.setattr(
+        app_module,
+        "buscar_afiliado_por_slug",
+        lambda slug, apenas_ativos=True: {"slug": slug, "nome": "Afiliado Teste", "ativo": True} if slug in ativos else None,
+    )
+
+    assert client.get("/afiliado-teste").status_code == 200
+
+    # Outro processo exclui o afiliado: invalidar_cache_paginas() nao roda aqui.
+    ativos.clear()
+    versao["atual"] = (0, "2026-01-01T00:00:00")
+
+    assert client.get("/afiliado-teste").status_code == 404
@@ -0,0 +1,114 @@
+def test_theme_injetado_no_template_uma_vez(app_module, client):
+    response = client.get("/termos")
+    assert response.status_code == 200
+
+    html = response.get_data(as_text=True)
+    assert html.count(app_module.asset_url("theme-toggle.css")) == 1
+    assert html.count(app_module.asset_url("theme-toggle.js")) == 1
+    assert html.index(app_module.asset_url("theme-toggle.css")) < html.index("</head>")
+    assert int(response.headers["Content-Length"]) == len(response.get_data())
+    assert "termos.html" in app_module.THEME_TEMPLATES_APLICADOS
+
+
+def test_theme_fallback_para_html_fora_de_template(app_module):
+    with app_module.app.test_request_context("/"):
+        response = app_module.app.make_response("<!doctype html><html><head></head><body></body></html>")
+        response = app_module._injetar_theme_global(response)
+        html = response.get_data(as_text=True)
+
+    assert app_module.THEME_CSS_RE.search(html)
+    assert app_module.THEME_JS_RE.search(html)
+
+
+def test_asset_fingerprint_servido_com_cache_imutavel_e_precomprimido(app_module, client):
+    url = app_module.asset_url("css/design-system.css")
+    assert url != "/assets/css/design-system.css"
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == app_module.ASSET_IMMUTABLE_CACHE_CONTROL
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.mimetype == "text/css"
+
+    response_plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response_plain.headers
+    with open(f"{app_module.ASSETS_DIR}/css/design-system.css", "rb") as f:
+        assert response_plain.get_data() == f.read()
+
+
+def test_asset_sem_fingerprint_continua_disponivel(client):
+    response = client.get("/assets/css/design-system.css")
+    assert response.status_code == 200
+    assert "immutable" not in (response.headers.get("Cache-Control") or "")
+
+
+def test_variantes_imagem_geradas_e_expostas_no_relatorio_mensal(app_module, client, monkeypatch, tmp_path):
+    import pytest
+
+    from asset_pipeline import formatos_imagem_suportados, gerar_variantes_imagens
+
+    if "webp" not in formatos_imagem_suportados():
+        pytest.skip("Pillow com suporte a WebP indisponivel")
+
+    from PIL import Image
+
+    assets_dir = tmp_path / "assets"
+    (assets_dir / "meses").mkdir(parents=True)
+    Image.new("RGB", (900, 400), (20, 120, 40)).save(assets_dir / "meses" / "jan_08_08_100,00.png")
+
+    build_dir = tmp_path / "build"
+    manifesto = gerar_variantes_imagens(assets_dir, build_dir, larguras=(320, 480), formatos=("webp",))
+    info = manifesto["images"]["meses/jan_08_08_100,00.png"]
+    assert [item["width"] for item in info["variants"]["webp"]] == [320, 480, 900]
+
+    mtimes = {item["path"]: (build_dir / item["path"]).stat().st_mtime_ns for item in info["variants"]["webp"]}
+    gerar_variantes_imagens(assets_dir, build_dir, larguras=(320, 480), formatos=("webp",))
+    assert mtimes == {item["path"]: (build_dir / item["path"]).stat().st_mtime_ns for item in info["variants"]["webp"]}
+
+    monkeypatch.setattr(app_module, "ASSETS_BUILD_DIR", str(build_dir))
+    monkeypatch.setattr(app_module, "_ASSET_MANIFEST", {"version": 1, "files": {}})
+    app_module._publicar_variantes_imagens(manifesto)
+    monkeypatch.chdir(tmp_path)
+    try:
+        response = client.get("/api/reports/monthly")
+        report = response.get_json()["reports"][0]
+        assert report["image_url"] == "/assets/meses/jan_08_08_100,00.png"
+        assert "320w" in report["image_srcset"] and "900w" in report["image_srcset"]
+        assert report["image_sources"][0]["type"] == "image/webp"
+
+        variante_url = report["image_srcset"].split(" ")[0]
+        variante = client.get(variante_url)
+        assert variante.status_code == 200
+        assert variante.mimetype == "image/webp"
+        assert variante.headers["Cache-Control"] == app_module.ASSET_IMMUTABLE_CACHE_CONTROL
+    finally:
+        app_module._publicar_variantes_imagens(None)
+
+
+def test_processo_sem_lideranca_rele_manifesto_de_imagens_gerado_por_outro(app_module, monkeypatch, tmp_path):
+    import json
+
+    monkeypatch.setattr(app_module, "ASSET_PIPELINE_ENABLED", True)
+    monkeypatch.setattr(app_module, "ASSET_IMAGE_VARIANTS_ENABLED", True)
+    monkeypatch.setattr(app_module, "ASSET_IMAGE_MANIFEST_CHECK_SECONDS", 0)
+    monkeypatch.setattr(app_module, "_ASSET_IMAGES_MTIME", None)
+    monkeypatch.setattr(app_module, "_ASSET_IMAGES_CHECADO_EM", 0.0)
+    monkeypatch.setattr(app_module, "ASSETS_BUILD_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module, "_ASSET_MANIFEST", {"version": 1, "files": {}})
+    app_module._sincronizar_manifesto_imagens(forcar=True)
+    try:
+        assert app_module.imagem_responsiva("meses/jan.png")["sources"] == []
+
+        # O lider grava o manifesto; este processo nao gerou nada.
+        (tmp_path / "images.json").write_text(json.dumps({
+            "version": 1,
+            "formats": ["webp"],
+            "images": {"meses/jan.png": {"width": 900, "height": 400, "variants": {"webp": [{"path": "meses/jan-320.webp", "width": 320}]}}},
+        }))
+
+        imagem = app_module.imagem_responsiva("meses/jan.png")
+        assert imagem["width"] == 900
+        assert imagem["srcset"] == "/assets/meses/jan-320.webp 320w"
+    finally:
+        app_module._publicar_variantes_imagens(None)
@@ -0,0 +1,107 @@
+from backup_utils import planejar_partes_backup
+
+
+def test_backup_parcial_e_retomado_na_execucao_seguinte(app_module, monkeypatch, tmp_path):
+    enc = tmp_path / "trxpro-backup-20260101-000000.enc"
+    enc.write_bytes(b"x" * (3 * 1024 * 1024 + 10))
+
+    execucoes = {}
+    enviados = []
+    falhar = {"ativo": True}
+
+    def registrar(**kwargs):
+        run_id = len(execucoes) + 1
+        execucoes[run_id] = dict(kwargs)
+        return run_id
+
+    def atualizar(run_id, **kwargs):
+        execucoes[run_id].update({chave: valor for chave, valor in kwargs.items() if valor is not None})
+
+    def pendentes(sending_ha_minutos):
+        return [
+            {"id": run_id, "backup_kind": item["backup_kind"], **{
+                chave: item[chave] for chave in ("filename", "size_bytes", "sha256", "parts")
+            }}
+            for run_id, item in execucoes.items()
+            if item["status"] == "PARTIAL"
+        ]
+
+    def enviar(destinatario, assunto, mensagem, filename, conteudo):
+        if falhar["ativo"] and filename.endswith("part002of004"):
+            raise RuntimeError("Apps Script 500")
+        enviados.append(filename)
+
+    def criar(**kwargs):
+        return {
+            "path": str(enc), "filename": enc.name, "size_bytes": enc.stat().st_size, "sha256": "abc",
+            "kind": "full", "chain": [enc.name], "state": {"version": 1},
+        }
+
+    monkeypatch.setattr(app_module, "BACKUP_ENABLED", True)
+    monkeypatch.setattr(app_module, "BACKUP_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module, "BACKUP_EMAIL_PART_MAX_MB", 1)
+    monkeypatch.setattr(app_module, "BACKUP_EMAIL_RETRIES", 1)
+    monkeypatch.setattr(app_module, "BACKUP_INCREMENTAL_ENABLED", False)
+    monkeypatch.setattr(app_module, "adquirir_lock_backup_distribuido", lambda: object())
+    monkeypatch.setattr(app_module, "liberar_lock_backup_distribuido", lambda conn: None)
+    monkeypatch.setattr(app_module, "registrar_backup_execucao", registrar)
+    monkeypatch.setattr(app_module, "atualizar_backup_execucao", atualizar)
+    monkeypatch.setattr(app_module, "listar_entregas_backup_pendentes", pendentes)
+    monkeypatch.setattr(app_module, "enviar_email_com_anexo_bytes", enviar)
+    monkeypatch.setattr(app_module, "criar_backup_criptografado", criar)
+    monkeypatch.setattr(app_module, "remover_backups_antigos", lambda **kwargs: [])
+
+    ok, mensagem = app_module.executar_backup_criptografado(trigger_type="manual")
+    assert not ok and "3/4 partes" in mensagem
+    assert execucoes[1]["status"] == "PARTIAL"
+    assert [p["status"] for p in execucoes[1]["parts"]] == ["sent", "failed", "sent", "sent"]
+
+    falhar["ativo"] = False
+    enviados.clear()
+    ok, _ = app_module.executar_backup_criptografado(trigger_type="manual")
+    assert ok
+    assert execucoes[1]["status"] == "SUCCESS"
+    # A retomada reenvia so a parte 2 da execucao anterior; o backup novo vai inteiro.
+    assert enviados.count(enc.name + ".part002of004") == 2
+    assert len(enviados) == 5
+
+
+def test_retomada_percorre_todas_as_entregas_pendentes(app_module, monkeypatch, tmp_path):
+    antigo = tmp_path / "trxpro-backup-20260101-000000.enc"
+    abandonado = tmp_path / "trxpro-backup-20260102-000000.enc"
+    for arquivo in (antigo, abandonado):
+        arquivo.write_bytes(b"y" * 10)
+
+    def parte(arquivo, status):
+        return [dict(item, status=status) for item in planejar_partes_backup(str(arquivo), 1024 * 1024)]
+
+    # PARTIAL antigo e SENDING de um processo que morreu no meio da entrega.
+    pendentes = [
+        {"id": 1, "filename": antigo.name, "size_bytes": 10, "sha256": "a", "backup_kind": "full", "parts": parte(antigo, "failed")},
+        {"id": 2, "filename": abandonado.name, "size_bytes": 10, "sha256": "b", "backup_kind": "incremental", "parts": parte(abandonado, "pending")},
+        {"id": 3, "filename": "sumiu.enc", "size_bytes": 10, "sha256": "c", "backup_kind": "full", "parts": None},
+    ]
+    consultas = []
+    finais = {}
+    enviados = []
+
+    def listar(sending_ha_minutos):
+        consultas.append(sending_ha_minutos)
+        return pendentes
+
+    monkeypatch.setattr(app_module, "BACKUP_OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(app_module, "listar_entregas_backup_pendentes", listar)
+    monkeypatch.setattr(app_module, "BACKUP_EMAIL_RETRIES", 1)
+    monkeypatch.setattr(
+        app_module, "enviar_email_com_anexo_bytes", lambda destinatario, assunto, mensagem, filename, conteudo: enviados.append(filename)
+    )
+    monkeypatch.setattr(
+        app_module,
+        "atualizar_backup_execucao",
+        lambda run_id, status=None, **kwargs: status and finais.__setitem__(run_id, status),
+    )
+
+    assert app_module._retomar_entregas_backup_pendentes() == ["SUCCESS", "SUCCESS", "FAILED"]
+    assert consultas == [app_module.BACKUP_SENDING_STALE_MINUTES]
+    assert enviados == [antigo.name, abandonado.name]
+    assert finais == {1: "SUCCESS", 2: "SUCCESS", 3: "FAILED"}
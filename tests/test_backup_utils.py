@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import pytest
+
+import backup_utils
+
+SENHA = "senha-de-teste-123"
+
+
+def _eventos(ids):
+    return "id,event_name\r\n" + "".join(f"{i},view\r\n" for i in ids)
+
+
+TABELAS = {
+    "orders": "order_id,plano\r\nA1,mensal\r\nA2,anual\r\n",
+    "analytics_funnel_events": _eventos(range(1, 501)),
+}
+
+
+class _ConexaoFalsa:
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.fechada = True
+
+
+@pytest.fixture
+def eventos():
+    return list(range(1, 501))
+
+
+@pytest.fixture
+def projeto(tmp_path, monkeypatch, eventos):
+    tabelas = dict(TABELAS)
+
+    def copiar(tabela, destino, snapshot_id=None, formato="csv", filtro=None):
+        assert snapshot_id == "snap-1"
+        if tabela == "analytics_funnel_events":
+            _, desde, ate = filtro or (None, 0, max(eventos))
+            conteudo = _eventos(i for i in eventos if desde < i <= ate)
+        else:
+            conteudo = tabelas[tabela]
+        destino.write(conteudo.encode("utf-8"))
+        return conteudo.count("\r\n") - 1
+
+    def watermark(conn, tabela, coluna, ate=None):
+        ids = eventos if tabela == "analytics_funnel_events" else []
+        return (max(ids) if ids else None), sum(1 for i in ids if ate is None or i <= ate)
+
+    monkeypatch.setattr(
+        backup_utils,
+        "abrir_snapshot_exportado",
+        lambda: (_ConexaoFalsa(), "snap-1", sorted(TABELAS), {"orders": [{"name": "order_id", "type": "text", "nullable": False}]}),
+    )
+    monkeypatch.setattr(backup_utils, "copiar_tabela_para", copiar)
+    monkeypatch.setattr(backup_utils, "resumir_watermark_tabela", watermark)
+    raiz = tmp_path / "projeto"
+    (raiz / "templates").mkdir(parents=True)
+    (raiz / "templates" / "index.html").write_text("<h1>TRX</h1>", encoding="utf-8")
+    (raiz / "dados.bin").write_bytes(os.urandom(3 * backup_utils.BACKUP_DEDUP_CHUNK_SIZE + 100))
+    return raiz
+
+
+def test_backup_stream_round_trip_e_hash_do_arquivo(projeto, tmp_path):
+    info = backup_utils.criar_backup_criptografado(projeto, tmp_path / "out", SENHA, chunk_size=4096)
+
+    dados = open(info["path"], "rb").read()
+    assert dados.startswith(backup_utils.BACKUP_STREAM_MAGIC)
+    assert info["sha256"] == hashlib.sha256(dados).hexdigest()
+    assert info["size_bytes"] == len(dados)
+    assert info["chunks"] > 1
+
+    restaurado = tmp_path / "restore"
+    backup_utils.restaurar_backup(info["path"], restaurado, SENHA)
+    assert (restaurado / "files" / "templates" / "index.html").read_text(encoding="utf-8") == "<h1>TRX</h1>"
+    assert (restaurado / "files" / "dados.bin").read_bytes() == (projeto / "dados.bin").read_bytes()
+    assert (restaurado / "database" / "orders.csv").read_bytes() == TABELAS["orders"].encode("utf-8")
+
+    manifesto = json.loads((restaurado / "database" / "manifest.json").read_text(encoding="utf-8"))
+    assert manifesto["format"] == "csv"
+    assert manifesto["tables"]["orders"]["rows"] == 2
+    assert manifesto["tables"]["analytics_funnel_events"]["rows"] == 500
+    assert manifesto["tables"]["orders"]["sha256"] == hashlib.sha256(TABELAS["orders"].encode("utf-8")).hexdigest()
+    assert manifesto["tables"]["orders"]["columns"][0]["name"] == "order_id"
+
+
+def test_backup_stream_detecta_adulteracao_e_truncamento(projeto, tmp_path):
+    info = backup_utils.criar_backup_criptografado(projeto, tmp_path / "out", SENHA, chunk_size=4096)
+    dados = open(info["path"], "rb").read()
+
+    adulterado = tmp_path / "adulterado.enc"
+    bytes_alterados = bytearray(dados)
+    bytes_alterados[200] ^= 0x01
+    adulterado.write_bytes(bytes(bytes_alterados))
+    with pytest.raises(ValueError, match="autenticacao"):
+        backup_utils.descriptografar_backup(adulterado, tmp_path / "a.tar.gz", SENHA)
+
+    # Corta exatamente no fim de um frame de dados: so o rodape ausente denuncia.
+    truncado = tmp_path / "truncado.enc"
+    fim_primeiro_frame = backup_utils._STREAM_HEADER.size + backup_utils._FRAME_HEADER.size + 4096 + 16
+    truncado.write_bytes(dados[:fim_primeiro_frame])
+    with pytest.raises(ValueError, match="truncado"):
+        backup_utils.descriptografar_backup(truncado, tmp_path / "t.tar.gz", SENHA)
+
+
+def test_backup_incremental_guarda_so_o_que_mudou_e_restaura_a_cadeia(projeto, tmp_path, eventos):
+    completo = backup_utils.criar_backup_criptografado(projeto, tmp_path / "out", SENHA, chunk_size=4096)
+    assert completo["kind"] == "full"
+
+    dados = bytearray((projeto / "dados.bin").read_bytes())
+    dados[10] ^= 0xFF
+    (projeto / "dados.bin").write_bytes(bytes(dados))
+    (projeto / "novo.txt").write_text("novo", encoding="utf-8")
+    eventos.extend(range(501, 511))
+
+    incremental = backup_utils.criar_backup_criptografado(
+        projeto, tmp_path / "out", SENHA, chunk_size=4096, estado_anterior=completo["state"]
+    )
+    assert incremental["kind"] == "incremental"
+    assert incremental["chain"] == [os.path.basename(completo["path"]), os.path.basename(incremental["path"])]
+    # So o primeiro chunk de dados.bin e o arquivo novo sao gravados de novo.
+    assert incremental["files_stats"]["chunks_new"] == 2
+    assert incremental["size_bytes"] < completo["size_bytes"] / 2
+
+    isolado = tmp_path / "isolado"
+    backup_utils.restaurar_backup(incremental["path"], isolado, SENHA)
+    parte = json.loads((isolado / "database" / "manifest.json").read_text(encoding="utf-8"))
+    assert parte["tables"]["analytics_funnel_events"]["mode"] == "incremental"
+    assert parte["tables"]["analytics_funnel_events"]["rows"] == 10
+
+    restaurado = tmp_path / "cadeia"
+    resultado = backup_utils.restaurar_cadeia_backups(
+        [completo["path"], incremental["path"]], restaurado, SENHA
+    )
+    assert (restaurado / "files" / "dados.bin").read_bytes() == bytes(dados)
+    assert (restaurado / "files" / "novo.txt").read_text(encoding="utf-8") == "novo"
+    assert resultado["tables"]["analytics_funnel_events"] == 510
+    partes = json.loads((restaurado / "database" / "manifest.json").read_text(encoding="utf-8"))
+    assert [p["rows"] for p in partes["tables"]["analytics_funnel_events"]["parts"]] == [500, 10]
+
+    with pytest.raises(ValueError, match="Cadeia"):
+        backup_utils.restaurar_cadeia_backups([incremental["path"]], tmp_path / "so-incremental", SENHA)
+
+
+def test_recuperar_backup_verifica_hashes_linhas_e_mede_fases(projeto, tmp_path):
+    info = backup_utils.criar_backup_criptografado(projeto, tmp_path / "out", SENHA, chunk_size=4096)
+
+    relatorio = backup_utils.recuperar_backup([info["path"]], tmp_path / "recover", SENHA)
+    assert relatorio["tables"]["analytics_funnel_events"]["rows"] == 500
+    assert relatorio["files"] == 2
+    assert set(relatorio["phases"]) == {"decrypt_extract", "verify", "total"}
+    assert relatorio["phases"]["verify"]["rows"] == 502
+    assert relatorio["phases"]["decrypt_extract"]["mb_s"] > 0
+
+    parte = tmp_path / "recover" / "database" / "orders" / "0000.csv"
+    parte.write_bytes(parte.read_bytes().replace(b"A2,anual\r\n", b""))
+    (tmp_path / "recover" / "files" / "templates" / "index.html").write_text("x", encoding="utf-8")
+    verificacao = backup_utils.verificar_restore(tmp_path / "recover")
+    assert not verificacao["ok"]
+    assert any("orders/0000.csv: 1 linhas" in erro for erro in verificacao["errors"])
+    assert any("templates/index.html" in erro for erro in verificacao["errors"])
+
+
+def test_contadores_de_linhas_do_copy_em_streaming():
+    csv_copy = b'id,obs\n1,"linha\nquebrada"\n2,"aspas "" escapadas"\n3,simples\n'
+    contador = backup_utils._ContadorLinhasCsv()
+    for i in range(0, len(csv_copy), 5):
+        contador.atualizar(csv_copy[i:i + 5])
+    assert contador.total() == 3
+
+    tuplas = b"".join(
+        struct.pack(">hi", 2, 4) + struct.pack(">i", i) + struct.pack(">i", -1) for i in range(7)
+    )
+    binario = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">II", 0, 0) + tuplas + struct.pack(">h", -1)
+    contador = backup_utils._ContadorLinhasBinario()
+    for i in range(0, len(binario), 3):
+        contador.atualizar(binario[i:i + 3])
+    assert contador.total() == 7
+
+
+def test_entrega_em_partes_com_retry_retomada_e_reuniao(tmp_path):
+    original = tmp_path / "trxpro-backup-x.enc"
+    original.write_bytes(os.urandom(10 * 1024 + 7))
+    partes = backup_utils.planejar_partes_backup(original, parte_max_bytes=4096)
+    assert [p["filename"] for p in partes] == [f"trxpro-backup-x.enc.part00{i}of003" for i in (1, 2, 3)]
+    assert partes[-1]["size"] == 2 * 1024 + 7
+
+    recebidas = {}
+    falhas = {2: 1, 3: 99}
+    em_voo = {"agora": 0, "max": 0}
+    lock = threading.Lock()
+    progresso = []
+
+    def enviar(parte, dados):
+        with lock:
+            em_voo["agora"] += 1
+            em_voo["max"] = max(em_voo["max"], em_voo["agora"])
+        try:
+            if falhas.get(parte["index"], 0) > 0:
+                falhas[parte["index"]] -= 1
+                raise RuntimeError("Apps Script 500")
+            recebidas[parte["filename"]] = dados
+        finally:
+            with lock:
+                em_voo["agora"] -= 1
+
+    resultado = backup_utils.enviar_partes_backup(
+        original, partes, enviar, workers=2, tentativas=2, espera_base=0,
+        ao_atualizar=lambda atuais: progresso.append([p["status"] for p in atuais]),
+    )
+    assert resultado == {"parts": 3, "sent": 2, "failed": 1, "attempted": 3}
+    assert [p["status"] for p in partes] == ["sent", "sent", "failed"]
+    assert partes[1]["attempts"] == 2
+    assert em_voo["max"] <= 2
+    assert len(progresso) == 3
+
+    # Retomada: so a parte que falhou e reenviada.
+    falhas[3] = 0
+    resultado = backup_utils.enviar_partes_backup(original, partes, enviar, tentativas=1, espera_base=0)
+    assert resultado["attempted"] == 1 and resultado["failed"] == 0
+
+    caixa = tmp_path / "caixa"
+    caixa.mkdir()
+    for nome, dados in recebidas.items():
+        (caixa / nome).write_bytes(dados)
+    arquivos = sorted(caixa.iterdir(), reverse=True)
+    sha = hashlib.sha256(original.read_bytes()).hexdigest()
+    reunido = backup_utils.reunir_partes_backup(arquivos, sha256_esperado=sha)
+    assert (caixa / "trxpro-backup-x.enc").read_bytes() == original.read_bytes()
+    assert reunido["parts"] == 3
+
+    with pytest.raises(ValueError, match="Faltam as partes: 2"):
+        backup_utils.reunir_partes_backup([caixa / partes[0]["filename"], caixa / partes[2]["filename"]], tmp_path / "x.enc")
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from ciclo_vida import CicloVida, restante
+from whatsapp_sender import DispatcherWhatsApp
+
+
+def test_ciclo_vida_roda_etapas_em_ordem_mesmo_com_falha():
+    ordem = []
+    concluidos = []
+
+    def falha(limite):
+        ordem.append("falha")
+        raise RuntimeError("sem banco")
+
+    ciclo = CicloVida(prazo_segundos=0.2, ao_concluir=concluidos.append)
+    ciclo.registrar("primeira", lambda limite: ordem.append("primeira") or 1)
+    ciclo.registrar("falha", falha)
+    # Estoura o prazo: a etapa seguinte ainda roda, com restante() ja zerado.
+    ciclo.registrar("lenta", lambda limite: time.sleep(0.3))
+    ciclo.registrar("ultima", lambda limite: restante(limite))
+
+    relatorio = ciclo.encerrar("teste", timeout=5)
+
+    assert ciclo.encerrando.is_set()
+    assert ordem == ["primeira", "falha"]
+    assert list(relatorio["steps"]) == ["primeira", "falha", "lenta", "ultima"]
+    assert (relatorio["steps"]["falha"]["ok"], relatorio["steps"]["falha"]["error"]) == (False, "sem banco")
+    assert relatorio["steps"]["ultima"]["result"] == 0.0
+    assert relatorio["deadline_exceeded"] is True
+    assert concluidos == [relatorio]
+    # Segunda chamada (SIGTERM + worker_exit) nao roda as etapas de novo.
+    assert ciclo.encerrar("de-novo", timeout=1) is relatorio
+
+
+def test_dispatcher_drenar_devolve_o_que_nao_coube_no_prazo():
+    enviados = []
+
+    def transporte(itens):
+        enviados.extend(item["order_id"] for item in itens)
+        return [{"ok": True, "order_id": item["order_id"]} for item in itens]
+
+    dispatcher = DispatcherWhatsApp(transporte=transporte, min_segundos_mesmo_numero=60, espera_lote_segundos=0)
+    primeiro = dispatcher.enviar("11999999999", "oi", order_id="pedido-1")
+    segundo = dispatcher.enviar("11999999999", "oi de novo", order_id="pedido-2")
+    assert primeiro.result(timeout=5)["ok"] is True
+
+    sobras = dispatcher.drenar(0.2)
+
+    assert enviados == ["pedido-1"]
+    assert [item["order_id"] for item in sobras] == ["pedido-2"]
+    assert not segundo.done()
+
+
+def test_webhook_recusa_com_503_durante_encerramento(app_module, client, monkeypatch):
+    encerrando = threading.Event()
+    encerrando.set()
+    monkeypatch.setattr(app_module, "_ENCERRANDO", encerrando)
+    monkeypatch.setattr(app_module, "verificar_token_webhook", lambda: True)
+
+    response = client.post("/webhook/infinitypay", json={"transaction_nsu": "t", "order_nsu": "o"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_encerramento_devolve_sobras_ao_banco_e_solta_lideranca(app_module, monkeypatch):
+    class DispatcherFalso:
+        def drenar(self, timeout):
+            return [{"phone": "5511999999999", "message": "oi", "order_id": "pedido-wa"}]
+
+    devolvidos_agenda = []
+    monkeypatch.setattr(app_module, "DISPATCHER_WHATSAPP", DispatcherFalso())
+    monkeypatch.setattr(
+        app_module,
+        "devolver_whatsapp_auto_para_agenda",
+        lambda order_ids: devolvidos_agenda.extend(order_ids) or len(order_ids),
+    )
+    monkeypatch.setattr(
+        app_module, "restaurar_order_para_pendente", lambda order_id: pytest.fail("pedido em voo nao pode voltar a PENDENTE")
+    )
+    monkeypatch.setattr(app_module, "descarregar_ultimos_logins_pendentes", lambda forcar=False: 2)
+    monkeypatch.setattr(app_module, "liberar_lideranca_workers", lambda: True)
+
+    # Copia das etapas registradas, sem o ao_concluir que para o escritor de logs da suite.
+    ciclo = CicloVida(prazo_segundos=0.2)
+    for nome, funcao in app_module.CICLO_VIDA._etapas:
+        ciclo.registrar(nome, funcao)
+
+    with app_module._WEBHOOKS_EM_VOO_COND:
+        app_module._WEBHOOKS_EM_VOO.add("pedido-preso")
+    try:
+        relatorio = ciclo.encerrar("teste", timeout=5)
+    finally:
+        with app_module._WEBHOOKS_EM_VOO_COND:
+            app_module._WEBHOOKS_EM_VOO.discard("pedido-preso")
+
+    passos = relatorio["steps"]
+    assert list(passos)[-1] == "advisory_locks"
+    assert all(passo["ok"] for passo in passos.values()), passos
+    assert passos["webhooks"]["result"] == {"in_flight": 1}
+    assert passos["whatsapp_dispatcher"]["result"] == {"unsent": 1, "rescheduled": 1}
+    assert passos["write_behind"]["result"] == {"last_logins": 2}
+    # O webhook ainda esta rodando: o pedido fica para a lease de processing_started_at.
+    assert passos["orders_processing"]["result"] == {"in_flight": ["pedido-preso"]}
+    assert devolvidos_agenda == ["pedido-wa"]
@@ -39,3 +39,90 @@ def test_cliente_login_csrf_invalido(app_module, client, monkeypatch):
     )
     assert response.status_code == 403
 
+
+
+def test_login_automatico_remember_usa_cache_e_agrupa_ultimo_login(app_module, client, monkeypatch):
+    from datetime import datetime, timedelta
+
+    email = "cliente@example.com"
+    conta = {
+        "email": email,
+        "first_access_required": False,
+        "remember_expires_at": datetime.now() + timedelta(days=5),
+    }
+    consultas = []
+    lotes = []
+
+    def fake_buscar(token_hash):
+        consultas.append(token_hash)
+        return dict(conta)
+
+    monkeypatch.setattr(app_module, "buscar_conta_cliente_por_remember_hash", fake_buscar)
+    monkeypatch.setattr(app_module, "atualizar_ultimo_login_contas_cliente", lambda logins: lotes.append(dict(logins)) or len(logins))
+    monkeypatch.setattr(app_module, "CLIENT_LAST_LOGIN_FLUSH_SECONDS", 3600)
+
+    for _ in range(3):
+        novo_cliente = app_module.app.test_client()
+        novo_cliente.set_cookie(app_module.CLIENT_REMEMBER_COOKIE, "token-remember")
+        response = novo_cliente.get("/termos")
+        assert response.status_code == 200
+
+    assert len(consultas) == 1
+    assert lotes == []
+    assert list(app_module._last_login_pending) == [email]
+
+    assert app_module.descarregar_ultimos_logins_pendentes(forcar=True) == 1
+    assert list(lotes[0]) == [email]
+    assert not app_module._last_login_pending
+
+
+def test_remember_cache_com_varios_processos_e_flush_periodico(app_module, monkeypatch):
+    import threading
+    import time
+    from datetime import datetime, timedelta
+
+    email = "cliente@example.com"
+    consultas = []
+    lotes = []
+    encerrando = threading.Event()
+
+    def fake_buscar(token_hash):
+        consultas.append(token_hash)
+        return {"email": email, "first_access_required": False, "remember_expires_at": datetime.now() + timedelta(days=5)}
+
+    monkeypatch.setattr(app_module, "buscar_conta_cliente_por_remember_hash", fake_buscar)
+    monkeypatch.setattr(app_module, "atualizar_ultimo_login_contas_cliente", lambda logins: lotes.append(dict(logins)) or len(logins))
+    versao = {"atual": 7}
+    monkeypatch.setattr(app_module, "obter_versao_remember_tokens", lambda: versao["atual"])
+    monkeypatch.setattr(app_module, "CLIENT_REMEMBER_VERSION_CHECK_SECONDS", 0)
+    monkeypatch.setattr(app_module, "_ENCERRANDO", encerrando)
+    monkeypatch.setattr(app_module, "_last_login_flush_thread", None)
+    monkeypatch.setattr(app_module, "CLIENT_LAST_LOGIN_FLUSH_SECONDS", 0.05)
+    monkeypatch.setattr(app_module, "_last_login_last_flush_at", time.time() + 3600)
+
+    def visitar():
+        novo_cliente = app_module.app.test_client()
+        novo_cliente.set_cookie(app_module.CLIENT_REMEMBER_COOKIE, "token-remember")
+        assert novo_cliente.get("/termos").status_code == 200
+
+    app_module.configurar_processos_servidor(3)
+    try:
+        visitar()
+        visitar()
+        assert len(consultas) == 1
+
+        # Logout/reset de senha em outro processo incrementa a versao: o cache local e descartado.
+        versao["atual"] = 8
+        visitar()
+        assert len(consultas) == 2
+
+        # O login seguinte nao vem; o flush periodico grava o pendente mesmo assim.
+        monkeypatch.setattr(app_module, "_last_login_last_flush_at", 0)
+        for _ in range(200):
+            if lotes:
+                break
+            time.sleep(0.01)
+        assert [list(lote) for lote in lotes] == [[email]]
+    finally:
+        app_module.configurar_processos_servidor(1)
+        encerrando.set()
@@ -0,0 +1,176 @@
+import inspect
+from datetime import datetime
+
+import psycopg2
+import pytest
+
+import database
+
+
+class _CursorFalso:
+    def __init__(self, banco):
+        self.banco = banco
+        self._resultado = []
+
+    def execute(self, query, params=None):
+        texto = " ".join(str(query).split())
+        self.banco.log.append((texto, self.banco.conn.autocommit))
+        if texto == "SELECT version FROM schema_migrations":
+            if self.banco.versoes is None:
+                raise psycopg2.errors.UndefinedTable("schema_migrations")
+            self._resultado = [(v,) for v in sorted(self.banco.versoes)]
+        elif texto.startswith("CREATE TABLE IF NOT EXISTS schema_migrations"):
+            if self.banco.versoes is None:
+                self.banco.versoes = set()
+        elif texto.startswith("INSERT INTO schema_migrations"):
+            self.banco.pendentes.add(params[0])
+            if self.banco.conn.autocommit:
+                self.banco.commit()
+
+    def fetchall(self):
+        return self._resultado
+
+
+class _ConexaoFalsa:
+    def __init__(self, banco):
+        self.banco = banco
+        self.autocommit = False
+
+    def cursor(self):
+        return _CursorFalso(self.banco)
+
+    def commit(self):
+        self.banco.commit()
+
+    def rollback(self):
+        self.banco.pendentes.clear()
+
+    def close(self):
+        pass
+
+
+class _BancoFalso:
+    def __init__(self, versoes=None):
+        self.versoes = versoes
+        self.pendentes = set()
+        self.log = []
+        self.conn = _ConexaoFalsa(self)
+
+    def commit(self):
+        self.versoes |= self.pendentes
+        self.pendentes.clear()
+
+
+def _migrations(chamadas, falhar_em=None):
+    def passo(versao):
+        def funcao(cur):
+            chamadas.append(versao)
+            if versao == falhar_em:
+                raise RuntimeError("falhou")
+            cur.execute(f"-- passo {versao}")
+        return funcao
+    return (
+        (1, "schema", passo(1), False),
+        (2, "indices", passo(2), True),
+        (3, "backfill", passo(3), False),
+    )
+
+
+def test_migrations_aplicam_em_ordem_uma_vez_e_depois_custam_uma_query():
+    banco = _BancoFalso()
+    chamadas = []
+
+    assert database.aplicar_migrations(banco.conn, _migrations(chamadas)) == [1, 2, 3]
+    assert chamadas == [1, 2, 3]
+    assert banco.versoes == {1, 2, 3}
+    textos = [texto for texto, _ in banco.log]
+    assert textos.index("SELECT pg_advisory_lock(%s)") < textos.index("-- passo 1")
+    assert textos[-1] == "SELECT pg_advisory_unlock(%s)"
+    autocommit = dict(banco.log)
+    assert autocommit["-- passo 1"] is False and autocommit["-- passo 3"] is False
+    assert autocommit["-- passo 2"] is True  # CREATE INDEX CONCURRENTLY fora de transacao
+
+    banco.log.clear()
+    assert database.aplicar_migrations(banco.conn, _migrations(chamadas)) == []
+    assert banco.log == [("SELECT version FROM schema_migrations", True)]
+
+
+def test_migration_com_erro_nao_e_registrada_e_lock_e_liberado():
+    banco = _BancoFalso(versoes={1})
+    chamadas = []
+
+    with pytest.raises(RuntimeError):
+        database.aplicar_migrations(banco.conn, _migrations(chamadas, falhar_em=3))
+    assert chamadas == [2, 3]
+    assert banco.versoes == {1, 2}
+    assert banco.log[-1][0] == "SELECT pg_advisory_unlock(%s)"
+
+
+def test_indices_base_sem_duplicados():
+    nomes = [nome for nome, _, _ in database._INDICES_BASE]
+    assert len(nomes) == len(set(nomes))
+    # Os indices ficam so na migration concorrente, nao no DDL transacional.
+    assert "CREATE INDEX" not in inspect.getsource(database._m001_schema_base)
+
+
+class _CursorBackfill:
+    def __init__(self, estado):
+        self.estado = estado
+        self._linha = None
+
+    def execute(self, query, params=None):
+        texto = " ".join(query.split())
+        self.estado["queries"].append((texto, params))
+        if texto.startswith("SELECT pg_try_advisory_xact_lock"):
+            self._linha = (self.estado["lock_livre"],)
+        elif texto.startswith("SELECT watermark FROM job_watermarks"):
+            self._linha = (self.estado["watermark"],) if self.estado["watermark"] else None
+        elif texto.startswith("WITH candidatos AS"):
+            self._linha = (3, 2, 1, datetime(2026, 3, 10, 12, 0))
+        elif texto.startswith("INSERT INTO job_watermarks"):
+            self.estado["watermark"] = params[1]
+
+    def fetchone(self):
+        return self._linha
+
+    def close(self):
+        pass
+
+
+class _ConexaoBackfill:
+    def __init__(self, estado):
+        self.estado = estado
+
+    def cursor(self):
+        return _CursorBackfill(self.estado)
+
+    def commit(self):
+        self.estado["commits"] += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_backfill_analytics_set_based_com_lock_e_watermark(monkeypatch):
+    estado = {"queries": [], "lock_livre": False, "watermark": None, "commits": 0}
+    monkeypatch.setattr(database, "get_conn", lambda: _ConexaoBackfill(estado))
+    precos = {"trx-gratis": 0, "trx-gold": 19700}
+
+    assert database.backfill_analytics_from_orders(precos) == {"skipped": True}
+    assert not any(texto.startswith("WITH") for texto, _ in estado["queries"])
+
+    estado["lock_livre"] = True
+    primeiro = database.backfill_analytics_from_orders(precos)
+    assert primeiro["since"] is None and primeiro["events"] == 2
+    assert estado["watermark"] == datetime(2026, 3, 10, 12, 0)
+
+    estado["queries"].clear()
+    segundo = database.backfill_analytics_from_orders(precos, lookback_days=2)
+    assert segundo["since"] == datetime(2026, 3, 8, 12, 0)
+    # Um unico INSERT ... SELECT por execucao, com os precos como arrays.
+    (_, params), = [q for q in estado["queries"] if q[0].startswith("WITH candidatos AS")]
+    assert params[:2] == (["trx-gratis", "trx-gold"], [0, 19700])
+    assert estado["commits"] == 2
@@ -0,0 +1,284 @@
+import os
+import threading
+import time
+
+
+def test_alertas_em_rajada_viram_um_digest_por_canal(app_module, monkeypatch):
+    enviados = []
+    liberar = threading.Event()
+
+    def webhook(payload):
+        enviados.append(payload)
+        liberar.wait(2)
+        return "sent"
+
+    despachante = app_module.DespachanteAlertas(
+        canais={
+            "webhook": (lambda: True, webhook),
+            "email": (lambda: False, lambda payload: "sent"),
+        },
+        janela_segundos=0.2,
+        max_fila=50,
+        max_itens_digest=5,
+        concorrencia_canal=1,
+    )
+    monkeypatch.setattr(app_module, "OBS_ALERTS_ENABLED", True)
+    monkeypatch.setattr(app_module, "OBS_ALERT_DISPATCHER", despachante)
+
+    for indice in range(8):
+        app_module.obs_alert("email", f"falha provedor {indice}")
+
+    for _ in range(100):
+        if enviados:
+            break
+        time.sleep(0.01)
+    liberar.set()
+    for _ in range(200):
+        if len(enviados) >= 2:
+            break
+        time.sleep(0.01)
+
+    assert len(enviados) == 2
+    assert enviados[0]["error"] == "falha provedor 0"
+    digest = enviados[1]
+    assert digest["digest"] is True
+    assert digest["count"] == 7
+    assert len(digest["alerts"]) == 5
+    assert digest["omitted"] == 2
+    assert app_module.OBS_COUNTERS.snapshot()["alerts.digests"] == 1
+
+
+def test_log_assincrono_descarta_com_fila_cheia_e_amostra_2xx(app_module, client, monkeypatch):
+    import logging
+    import queue
+
+    from obs_logging import FilaLogHandler
+
+    handler = FilaLogHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("trx.test.fila")
+    logger.handlers = [handler]
+    logger.propagate = False
+    for indice in range(5):
+        logger.warning({"event": "teste", "n": indice})
+    assert handler.queue.qsize() == 2
+    assert handler.descartados == 3
+
+    monkeypatch.setattr(app_module, "OBS_REQUEST_LOG_SAMPLE_2XX", 0.0)
+    assert client.get("/termos").status_code == 200
+    assert app_module.OBS_COUNTERS.snapshot()["http.request_logs_sampled_out"] == 1
+
+
+def test_metrics_exige_admin_e_exporta_histograma_por_rota(app_module, client):
+    assert client.get("/metrics").status_code == 403
+
+    for _ in range(3):
+        assert client.get("/termos").status_code == 200
+
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+
+    texto = response.get_data(as_text=True)
+    assert 'trx_http_request_duration_seconds_count{route="/termos",method="GET",status_class="2xx"}' in texto
+    assert 'le="+Inf"' in texto
+
+    rotas = app_module.obs_resumo_latencia()["routes"]
+    termos = next(item for item in rotas if item["route"] == "/termos")
+    assert termos["count"] >= 3
+    assert termos["p50_ms"] is not None
+
+
+def test_queries_por_request_viram_server_timing_e_top_fingerprints(app_module, monkeypatch):
+    import database
+
+    logs = []
+    monkeypatch.setattr(app_module, "OBS_DB_SLOW_QUERY_MS", 100)
+    monkeypatch.setattr(app_module, "OBS_SERVER_TIMING_ENABLED", True)
+    monkeypatch.setattr(app_module, "OBS_METRICS_TOKEN", "token-metricas")
+    monkeypatch.setattr(app_module, "obs_log", lambda level, event, **campos: logs.append((event, campos)))
+    observador = database._OBSERVADOR_QUERIES
+    assert observador is app_module.obs_registrar_query
+
+    # Anonimo nao ve tempo de banco nem contagem de queries.
+    with app_module.app.test_request_context("/termos"):
+        app_module.app.preprocess_request()
+        observador("SELECT 1", 1.0)
+        anonima = app_module.app.process_response(app_module.app.response_class("ok"))
+    assert "Server-Timing" not in anonima.headers
+    # Sem cookie de sessao a checagem nao le a session: a pagina publica segue cacheavel.
+    assert "Cookie" not in anonima.headers.get("Vary", "")
+    logs.clear()
+
+    with app_module.app.test_request_context("/termos", headers={"Authorization": "Bearer token-metricas"}):
+        app_module.app.preprocess_request()
+        observador("SELECT * FROM orders WHERE order_id = %s", 4.0)
+        observador("SELECT * FROM orders WHERE order_id = 'abc'", 6.5)
+        observador("UPDATE orders SET status = 'PAGO' WHERE order_id IN (%s, %s)", 150.0)
+        assert app_module.g.db_queries == 3
+        assert app_module.g.db_slowest.startswith("UPDATE orders")
+        response = app_module.app.process_response(app_module.app.response_class("ok"))
+
+    assert 'db;dur=160.5;desc="3 queries"' in response.headers["Server-Timing"]
+    lentas = [campos for event, campos in logs if event == "db_slow_query"]
+    assert lentas == [{
+        "request_id": lentas[0]["request_id"],
+        "duration_ms": 150.0,
+        "fingerprint": "UPDATE orders SET status = ? WHERE order_id IN (?+)",
+    }]
+    http_log = next(campos for event, campos in logs if event == "http_request")
+    assert http_log["db_queries"] == 3 and http_log["db_slowest_ms"] == 150.0
+
+    top = app_module.obs_resumo_queries()
+    assert top[0]["fingerprint"].startswith("UPDATE orders")
+    assert top[1] == {**top[1], "fingerprint": "SELECT * FROM orders WHERE order_id = ?", "count": 2}
+
+
+def test_dependencias_registram_timeout_status_e_degradam_health(app_module, monkeypatch):
+    import obs_dependencias
+    import pytest
+    import requests
+
+    respostas = iter([200, 502, "timeout", 502, "timeout"])
+
+    class Resposta:
+        def __init__(self, status_code):
+            self.status_code = status_code
+
+    def post_falso(url, **kwargs):
+        proxima = next(respostas)
+        if proxima == "timeout":
+            raise requests.Timeout("read timeout")
+        return Resposta(proxima)
+
+    class SessaoFalsa:
+        post = staticmethod(post_falso)
+
+    monkeypatch.setattr(obs_dependencias.MONITOR_DEPENDENCIAS, "sessao", lambda: SessaoFalsa)
+    monkeypatch.setattr(app_module, "obs_check_database", lambda: (True, {}, None))
+
+    for _ in range(5):
+        try:
+            obs_dependencias.post_monitorado("infinitepay_checkout", "https://checkout.example", timeout=1)
+        except requests.Timeout:
+            pass
+
+    checkout = app_module.obs_health_payload()["dependencies"]["infinitepay_checkout"]
+    assert checkout["count"] == 5
+    assert checkout["timeouts"] == 2
+    assert checkout["status_codes"] == {"200": 1, "502": 2, "timeout": 2}
+    assert checkout["window"]["error_rate"] == pytest.approx(0.8)
+    assert checkout["failing"] is True
+
+
+def test_contadores_sharded_somam_threads_e_mantem_formato_do_health(app_module, client, monkeypatch):
+    from obs_metrics import ContadoresSharded
+
+    contadores = ContadoresSharded()
+    contadores.max_shards_antes_de_consolidar = 4
+
+    def trabalho():
+        for _ in range(1000):
+            contadores.incrementar("x")
+
+    threads = [threading.Thread(target=trabalho) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    contadores.incrementar("x", 5)
+    assert contadores.snapshot() == {"x": 10005}
+    assert len(contadores._shards) <= 5
+
+    monkeypatch.setattr(app_module, "obs_check_database", lambda: (True, {}, None))
+    app_module.obs_mark_error("email", "smtp fora", alert=False)
+    assert client.get("/termos").status_code == 200
+
+    payload = app_module.obs_health_payload()
+    assert payload["components"]["email"]["errors"] == 1
+    assert payload["components"]["email"]["last_error"] == "smtp fora"
+    assert set(payload["components"]["http"]) == {
+        "success", "errors", "last_success_at", "last_error_at", "last_error"
+    }
+    assert payload["http"]["last_request"]["path"] == "/termos"
+    assert payload["http"]["requests_total"] == 1
+
+
+def test_profiler_sob_demanda_so_para_admin_e_lista_perfis(app_module, client):
+    response = client.get("/termos?_profile=1")
+    assert "X-Profile-Id" not in response.headers
+    assert app_module.OBS_PROFILER.listar() == []
+
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    response = client.get("/termos", headers={"X-Profile-Request": "1"})
+    perfil_id = response.headers["X-Profile-Id"]
+
+    perfil = app_module.OBS_PROFILER.obter(perfil_id)
+    assert perfil["trigger"] == "admin"
+    assert perfil["route"] == "/termos"
+    assert perfil["top_cumulative"] and perfil["total_calls"] > 0
+
+    pagina = client.get(f"/admin/health/profiles?id={perfil_id}")
+    assert pagina.status_code == 200
+    assert "GET /termos" in pagina.get_data(as_text=True)
+
+
+def test_metrics_soma_os_processos_do_servidor(app_module, client, monkeypatch, tmp_path):
+    import subprocess
+    import sys
+
+    from obs_metrics import MetricasMultiprocesso, gravar_json_atomico
+
+    diretorio = tmp_path / "metrics"
+    monkeypatch.setattr(
+        app_module, "OBS_METRICAS_PROCESSOS", MetricasMultiprocesso(str(diretorio), app_module._obs_coletar_metricas)
+    )
+    # Outro worker, ja encerrado: as contagens dele continuam na soma.
+    outro = subprocess.Popen([sys.executable, "-c", "pass"])
+    outro.wait()
+    buckets = [0] * (len(app_module.LATENCY_BUCKETS_MS) + 1)
+    buckets[0] = 4
+    gravar_json_atomico(str(diretorio / f"metrics-{outro.pid}.json"), {
+        "pid": outro.pid,
+        "started_at": time.time() - 60,
+        "histograms": {"http": [[["/termos", "GET", "2xx"], buckets, 8.0, 4]]},
+        "counters": {"events": {"http.requests_total": 4}},
+    })
+
+    for _ in range(2):
+        assert client.get("/termos").status_code == 200
+    with client.session_transaction() as sess:
+        sess["admin"] = True
+    texto = client.get("/metrics").get_data(as_text=True)
+
+    assert 'trx_http_request_duration_seconds_count{route="/termos",method="GET",status_class="2xx"} 6' in texto
+    proprios = app_module.OBS_COUNTERS.snapshot()["http.requests_total"]
+    assert f'trx_events_total{{name="http.requests_total"}} {proprios + 4}' in texto
+    # Uptime so dos processos vivos, identificados pelo pid.
+    assert f'trx_uptime_seconds{{pid="{os.getpid()}"}}' in texto
+    assert f'pid="{outro.pid}"' not in texto
+
+    termos = next(item for item in app_module.obs_resumo_latencia()["routes"] if item["route"] == "/termos")
+    assert termos["count"] >= 6
+
+
+def test_perfis_ficam_visiveis_para_todos_os_processos(tmp_path):
+
+    from obs_profiler import ProfilerRequisicoes
+
+    worker_a = ProfilerRequisicoes(max_perfis=2, diretorio=str(tmp_path))
+    worker_b = ProfilerRequisicoes(max_perfis=2, diretorio=str(tmp_path))
+
+    ids = []
+    for indice in range(3):
+        profile = worker_a.iniciar()
+        sum(range(1000))
+        ids.append(worker_a.finalizar(profile, path=f"/p{indice}")["id"])
+        time.sleep(0.002)
+
+    assert [perfil["id"] for perfil in worker_b.listar()] == [ids[2], ids[1]]
+    assert worker_b.obter(ids[2])["path"] == "/p2"
+    assert worker_b.obter(ids[0]) is None
+    assert worker_b.obter("../../etc") is None
@@ -0,0 +1,132 @@
+import importlib.util
+import io
+import logging
+from pathlib import Path
+
+from obs_logging import configurar_log_assincrono, reiniciar_log_assincrono
+
+
+def _carregar_config_gunicorn(monkeypatch, **env):
+    for nome, valor in env.items():
+        monkeypatch.setenv(nome, valor)
+    caminho = Path(__file__).resolve().parents[1] / "gunicorn.conf.py"
+    spec = importlib.util.spec_from_file_location("gunicorn_conf_teste", caminho)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def test_config_gunicorn_dimensiona_por_env(monkeypatch):
+    config = _carregar_config_gunicorn(
+        monkeypatch, WEB_CONCURRENCY="3", GUNICORN_THREADS="6", PORT="8080", GUNICORN_TIMEOUT="abc"
+    )
+
+    assert config.wsgi_app == "app:app"
+    assert config.bind == "0.0.0.0:8080"
+    assert (config.workers, config.threads, config.timeout) == (3, 6, 60)
+    assert config.worker_class == "gthread"
+    assert config.preload_app is True
+
+
+def test_eleicao_lider_inicia_loops_uma_vez_e_libera_ao_perder_conexao(app_module, monkeypatch):
+    class ConexaoFalsa:
+        def __init__(self, nome):
+            self.nome = nome
+            self.viva = True
+
+        def close(self):
+            self.viva = False
+
+    conn_a, conn_b = ConexaoFalsa("a"), ConexaoFalsa("b")
+    # Primeira tentativa vira lider; a segunda perde para outro processo; a terceira reassume.
+    tentativas = iter([conn_a, None, conn_b])
+    loops = []
+
+    monkeypatch.setattr(app_module, "adquirir_lock_lider_workers", lambda: next(tentativas))
+    monkeypatch.setattr(app_module, "lock_lider_workers_ativo", lambda conn: conn.viva)
+    monkeypatch.setattr(app_module, "iniciar_worker_whatsapp", lambda: loops.append("whatsapp"))
+    monkeypatch.setattr(app_module, "iniciar_worker_backup_diario", lambda: loops.append("backup"))
+    monkeypatch.setattr(app_module, "WA_SENDER_URL", "")
+    monkeypatch.setattr(app_module, "_WORKERS_LOOPS_INICIADOS", False)
+    app_module._WORKERS_LIDER.clear()
+
+    try:
+        assert app_module.eleger_lider_workers(None) is conn_a
+        assert app_module._WORKERS_LIDER.is_set()
+        assert app_module.eleger_lider_workers(conn_a) is conn_a
+
+        conn_a.viva = False
+        assert app_module.eleger_lider_workers(conn_a) is None
+        assert not app_module._WORKERS_LIDER.is_set()
+
+        assert app_module.eleger_lider_workers(None) is conn_b
+        assert app_module._WORKERS_LIDER.is_set()
+        assert loops == ["whatsapp", "backup"]
+    finally:
+        app_module._WORKERS_LIDER.clear()
+
+
+def test_log_assincrono_volta_a_escrever_apos_reinicio_de_fork():
+    stream = io.StringIO()
+    logger = logging.getLogger("obs.teste.fork")
+    logger.setLevel(logging.INFO)
+    handler, escritor = configurar_log_assincrono(logger, stream=stream)
+    escritor.parar()
+    # Simula o filho: a thread do escritor nao existe mais.
+    escritor._thread = None
+
+    reiniciar_log_assincrono(handler, escritor)
+    logger.info({"event": "depois_do_fork"})
+    escritor.parar()
+
+    assert '"event": "depois_do_fork"' in stream.getvalue()
+
+
+def test_agendador_whatsapp_roda_so_no_lider(app_module, monkeypatch):
+    class AgendadorFalso:
+        def __init__(self):
+            self.ativo = False
+            self.agendados = []
+
+        def iniciar(self):
+            self.ativo = True
+
+        def parar(self):
+            self.ativo = False
+
+        def agendar(self, order_id, atraso_segundos=0):
+            self.agendados.append(order_id)
+
+    class ConexaoFalsa:
+        viva = True
+
+        def close(self):
+            pass
+
+    agendador = AgendadorFalso()
+    conn = ConexaoFalsa()
+    monkeypatch.setattr(app_module, "AGENDADOR_WHATSAPP_AUTO", agendador)
+    monkeypatch.setattr(app_module, "WA_SENDER_URL", "https://wa.example.com/send")
+    monkeypatch.setattr(app_module, "WA_SENDER_TOKEN", "token")
+    monkeypatch.setattr(app_module, "_WORKERS_LOOPS_INICIADOS", True)
+    monkeypatch.setattr(app_module, "registrar_whatsapp_auto_agendamento", lambda order_id, delay_minutes: True)
+    monkeypatch.setattr(app_module, "adquirir_lock_lider_workers", lambda: conn)
+    monkeypatch.setattr(app_module, "lock_lider_workers_ativo", lambda c: c.viva)
+    pedido = {"order_id": "pedido-1", "telefone": "11999999999"}
+
+    try:
+        # Processo que nao e lider so grava a linha SCHEDULED.
+        app_module.agendar_whatsapp_pos_pago(pedido)
+        assert agendador.ativo is False and agendador.agendados == []
+
+        assert app_module.eleger_lider_workers(None) is conn
+        assert agendador.ativo is True
+        app_module.agendar_whatsapp_pos_pago(pedido)
+        assert agendador.agendados == ["pedido-1"]
+
+        conn.viva = False
+        monkeypatch.setattr(app_module, "adquirir_lock_lider_workers", lambda: None)
+        assert app_module.eleger_lider_workers(conn) is None
+        assert agendador.ativo is False
+    finally:
+        app_module._WORKERS_LIDER.clear()
@@ -0,0 +1,131 @@
+import os
+import time
+
+import pytest
+
+import obs_startup
+
+
+def test_inicializacao_roda_uma_vez_no_primeiro_uso(app_module, client, monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(app_module, "_APP_INIT_OK", False)
+    monkeypatch.setattr(app_module, "_APP_DB_OK", False)
+    monkeypatch.setattr(app_module, "_INICIADOS", set())
+    monkeypatch.setattr(app_module, "APP_SKIP_DB_INIT", False)
+    monkeypatch.setattr(app_module, "inicializar_pipeline_assets", lambda: chamadas.append("assets"))
+    monkeypatch.setattr(app_module, "init_db", lambda: chamadas.append("init_db"))
+    monkeypatch.setattr(app_module, "iniciar_backfill_analytics", lambda: chamadas.append("backfill"))
+    monkeypatch.setattr(app_module, "iniciar_workers_background", lambda: chamadas.append("workers"))
+
+    assert app_module.criar_app(aquecer=False) is app_module.app
+    assert chamadas == []
+
+    client.get("/termos")
+    client.get("/termos")
+
+    assert chamadas == ["assets", "init_db", "backfill", "workers"]
+
+
+def test_falha_no_init_db_e_repetida_na_proxima_requisicao(app_module, client, monkeypatch):
+    tentativas = []
+
+    def init_db_instavel():
+        tentativas.append(1)
+        if len(tentativas) == 1:
+            raise RuntimeError("banco indisponivel")
+
+    monkeypatch.setattr(app_module, "_APP_INIT_OK", False)
+    monkeypatch.setattr(app_module, "_APP_DB_OK", False)
+    monkeypatch.setattr(app_module, "APP_SKIP_DB_INIT", False)
+    monkeypatch.setattr(app_module, "_APP_INIT_FALHOU_EM", 0.0)
+    monkeypatch.setattr(app_module, "APP_INIT_RETRY_SECONDS", 0)
+    monkeypatch.setattr(app_module, "init_db", init_db_instavel)
+    monkeypatch.setattr(app_module, "iniciar_backfill_analytics", lambda: None)
+    monkeypatch.setattr(app_module, "iniciar_workers_background", lambda: None)
+    with pytest.raises(RuntimeError):
+        client.get("/termos")
+    client.get("/termos")
+
+    assert len(tentativas) == 2
+    assert app_module._APP_INIT_OK is True
+
+
+def test_banco_fora_espera_o_intervalo_e_nao_segura_assets_nem_healthz(app_module, client, monkeypatch):
+    tentativas = []
+
+    def init_db_fora():
+        tentativas.append(1)
+        raise RuntimeError("banco indisponivel")
+
+    monkeypatch.setattr(app_module, "_APP_INIT_OK", False)
+    monkeypatch.setattr(app_module, "_APP_DB_OK", False)
+    monkeypatch.setattr(app_module, "_APP_INIT_FALHOU_EM", 0.0)
+    monkeypatch.setattr(app_module, "APP_INIT_RETRY_SECONDS", 30)
+    monkeypatch.setattr(app_module, "APP_SKIP_DB_INIT", False)
+    monkeypatch.setattr(app_module, "init_db", init_db_fora)
+
+    assert client.get("/favicon.ico").status_code == 200
+    client.get("/healthz")
+    assert tentativas == []
+
+    with pytest.raises(RuntimeError):
+        client.get("/termos")
+    # Dentro do intervalo: 503 sem bater no banco de novo.
+    response = client.get("/termos")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert tentativas == [1]
+
+    monkeypatch.setattr(app_module, "_APP_INIT_FALHOU_EM", app_module._APP_INIT_FALHOU_EM - 31)
+    with pytest.raises(RuntimeError):
+        client.get("/termos")
+    assert tentativas == [1, 1]
+
+
+def test_falha_depois_do_init_db_nao_repete_schema_nem_threads(app_module, client, monkeypatch):
+    chamadas = []
+    threads = []
+
+    def workers_instavel():
+        chamadas.append("workers")
+        if chamadas.count("workers") == 1:
+            raise RuntimeError("eleicao indisponivel")
+
+    monkeypatch.setattr(app_module, "_APP_INIT_OK", False)
+    monkeypatch.setattr(app_module, "_APP_DB_OK", False)
+    monkeypatch.setattr(app_module, "_INICIADOS", set())
+    monkeypatch.setattr(app_module, "_APP_INIT_FALHOU_EM", 0.0)
+    monkeypatch.setattr(app_module, "APP_INIT_RETRY_SECONDS", 0)
+    monkeypatch.setattr(app_module, "APP_SKIP_DB_INIT", False)
+    monkeypatch.setattr(app_module, "APP_SKIP_ANALYTICS_BACKFILL", False)
+    monkeypatch.setattr(app_module, "init_db", lambda: chamadas.append("init_db"))
+    monkeypatch.setattr(app_module, "executar_backfill_analytics", lambda: threads.append("backfill"))
+    monkeypatch.setattr(app_module, "iniciar_workers_background", workers_instavel)
+
+    with pytest.raises(RuntimeError):
+        client.get("/termos")
+    client.get("/termos")
+
+    assert chamadas == ["init_db", "workers", "workers"]
+    for _ in range(100):
+        if threads:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert threads == ["backfill"]
+
+
+def test_benchmark_startup_sem_banco_e_sem_imports_pesados(app_module):
+    env = dict(os.environ)
+    env.update({"APP_SKIP_DB_INIT": "true", "BACKGROUND_WORKERS_ENABLED": "false"})
+
+    resultado = obs_startup.medir_startup(env=env)
+    print(resultado)
+
+    assert resultado["status"] in {200, 503}
+    assert resultado["import_ms"] > 0
+    assert resultado["first_response_ms"] > 0
+    assert not any(resultado["lazy_loaded"].values()), resultado["lazy_loaded"]
+    assert resultado["top_modules"]
+    # Teto folgado para pegar regressao grosseira (ex.: init_db ou rede de volta no import).
+    assert resultado["total_ms"] < int(os.environ.get("STARTUP_BUDGET_MS", "10000"))
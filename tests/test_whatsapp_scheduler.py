@@ -0,0 +1,246 @@
+import threading
+import time
+
+import pytest
+
+from whatsapp_sender import (
+    AgendadorWhatsApp,
+    DispatcherWhatsApp,
+    StubSenderWhatsApp,
+    WhatsAppEnvioExpirado,
+    WhatsAppRateLimited,
+)
+
+
+def test_agendador_recupera_pendentes_e_envia_em_ordem(app_module):
+    enviados = []
+    concluido = threading.Event()
+
+    def executar(order_id):
+        enviados.append(order_id)
+        if len(enviados) == 3:
+            concluido.set()
+
+    agendador = AgendadorWhatsApp(
+        executar=executar,
+        carregar_pendentes=lambda horizonte, limite: [("recuperado", 0)],
+        senders=1,
+        max_em_memoria=10,
+        horizonte_segundos=60,
+        intervalo_recarga=60,
+    )
+    agendador.agendar("segundo", atraso_segundos=0.2)
+    agendador.agendar("primeiro", atraso_segundos=0.1)
+    assert agendador.agendar("fora-do-horizonte", atraso_segundos=3600) is False
+
+    agendador.iniciar()
+    try:
+        assert concluido.wait(5)
+    finally:
+        agendador.parar()
+
+    assert enviados == ["recuperado", "primeiro", "segundo"]
+    assert agendador.pendentes_em_memoria() == 0
+
+
+def test_agendador_para_com_fila_de_envio_cheia():
+    liberar = threading.Event()
+    agendador = AgendadorWhatsApp(
+        executar=lambda order_id: liberar.wait(5),
+        senders=1,
+        max_em_memoria=20,
+        horizonte_segundos=60,
+        intervalo_recarga=60,
+    )
+    for indice in range(10):
+        agendador.agendar(f"pedido-{indice}")
+
+    agendador.iniciar()
+    loop_agendador = agendador._threads[0]
+    for _ in range(200):
+        if agendador._fila_envio.full():
+            break
+        time.sleep(0.01)
+    assert agendador._fila_envio.full()
+
+    try:
+        inicio = time.monotonic()
+        agendador.parar(timeout=1)
+        assert not loop_agendador.is_alive()
+        assert time.monotonic() - inicio < 3
+    finally:
+        liberar.set()
+
+
+def test_envio_agendado_respeita_claim(app_module, monkeypatch):
+    enviados = []
+    marcados = []
+
+    def transporte(itens):
+        enviados.extend(item["order_id"] for item in itens)
+        return [{"ok": True, "order_id": item["order_id"]} for item in itens]
+
+    monkeypatch.setattr(app_module, "reivindicar_whatsapp_auto", lambda order_id: order_id == "livre")
+    monkeypatch.setattr(
+        app_module,
+        "buscar_order_por_id",
+        lambda order_id: {"order_id": order_id, "nome": "Cliente", "plano": "trx-gratis", "telefone": "11999999999"},
+    )
+    monkeypatch.setattr(
+        app_module,
+        "DISPATCHER_WHATSAPP",
+        DispatcherWhatsApp(transporte=transporte, min_segundos_mesmo_numero=0, espera_lote_segundos=0),
+    )
+    monkeypatch.setattr(app_module, "marcar_whatsapp_auto_enviado", marcados.append)
+
+    assert app_module.enviar_whatsapp_pos_pago_agendado("livre") is True
+    assert app_module.enviar_whatsapp_pos_pago_agendado("ja-reivindicado") is False
+    for _ in range(200):
+        if marcados:
+            break
+        time.sleep(0.01)
+    app_module.DISPATCHER_WHATSAPP.parar()
+    assert enviados == ["livre"]
+    assert marcados == ["livre"]
+
+
+def test_fila_whatsapp_envia_apenas_lote_reivindicado(app_module, monkeypatch):
+    chamadas = {}
+    enviados = []
+    falhas = []
+
+    def reivindicar(limite, max_tentativas, lease_segundos):
+        chamadas.update(limite=limite, max_tentativas=max_tentativas, lease=lease_segundos)
+        return [
+            {"order_id": "ok", "whatsapp_tentativas": 0, "telefone": "11999999999"},
+            {"order_id": "erro", "whatsapp_tentativas": 1, "telefone": "11999999999"},
+        ]
+
+    def enviar(pedido):
+        if pedido["order_id"] == "erro":
+            raise RuntimeError("falhou")
+
+    monkeypatch.setattr(app_module, "reivindicar_whatsapp_pendentes", reivindicar)
+    monkeypatch.setattr(app_module, "enviar_whatsapp_automatico", enviar)
+    monkeypatch.setattr(app_module, "incrementar_whatsapp_enviado", enviados.append)
+    monkeypatch.setattr(app_module, "registrar_falha_whatsapp", lambda *args: falhas.append(args))
+
+    with app_module.ThreadPoolExecutor(max_workers=2) as executor:
+        assert app_module.processar_fila_whatsapp(executor) == 2
+
+    assert chamadas["limite"] == app_module.WHATSAPP_QUEUE_SENDERS * 2
+    assert chamadas["max_tentativas"] == app_module.MAX_TENTATIVAS_WHATSAPP
+    assert enviados == ["ok"]
+    assert falhas == [("erro", 2, "falhou")]
+
+
+def test_retry_de_envio_com_falha_vence_quando_o_lease_expira(app_module, monkeypatch):
+    import database
+
+    consultas = []
+
+    class Cursor:
+        def execute(self, query, params=None):
+            consultas.append((" ".join(query.split()), params))
+
+        def fetchone(self):
+            # Pedido que falhou ha 75s com lease de 120s: vence daqui a 45s.
+            return (45.0,)
+
+        def close(self):
+            pass
+
+    class Conexao:
+        def cursor(self):
+            return Cursor()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(database, "get_conn", Conexao)
+    monkeypatch.setattr(app_module, "WHATSAPP_QUEUE_LEASE_SECONDS", 120)
+    monkeypatch.setattr(app_module, "WHATSAPP_QUEUE_POLL_SECONDS", 60)
+
+    assert app_module._espera_fila_whatsapp() == 45.5
+
+    (query, params), = consultas
+    assert params == ("120", app_module.MAX_TENTATIVAS_WHATSAPP)
+    # O claim de uma falha nao e limpo: o proximo vencimento conta o fim do lease em vez de ignorar o pedido.
+    assert "whatsapp_claimed_at IS NULL" not in query
+    assert "whatsapp_claimed_at + (%s || ' seconds')::INTERVAL" in query
+
+
+def test_dispatcher_agrupa_lote_e_respeita_retry_after():
+    stub = StubSenderWhatsApp(min_segundos_mesmo_numero=0.2, latencia_requisicao=0, latencia_mensagem=0)
+    dispatcher = DispatcherWhatsApp(transporte=stub, min_segundos_mesmo_numero=0, lote_max=10)
+    try:
+        futures = [dispatcher.enviar(f"5511999990{indice:03d}", "oi", order_id=f"o{indice}") for indice in range(8)]
+        # Mesmo numero duas vezes: o stub recusa com retry_after e o dispatcher reenfileira.
+        futures += [dispatcher.enviar("5511999990000", "de novo", order_id="repetido")]
+        for future in futures:
+            assert future.result(timeout=5)["ok"] is True
+    finally:
+        dispatcher.parar()
+
+    assert dispatcher.stats["sent"] == 9
+    assert dispatcher.stats["requests"] <= 3
+
+
+def test_dispatcher_limita_retries_de_rate_limit_global_e_expira_itens():
+    chamadas = []
+
+    def recusa_sempre(itens):
+        chamadas.append([item["order_id"] for item in itens])
+        raise WhatsAppRateLimited("rate_limited", retry_after=0)
+
+    dispatcher = DispatcherWhatsApp(transporte=recusa_sempre, min_segundos_mesmo_numero=0, espera_lote_segundos=0, max_tentativas=2)
+    try:
+        with pytest.raises(WhatsAppRateLimited):
+            dispatcher.enviar("11999999999", "oi", order_id="o1").result(timeout=5)
+    finally:
+        dispatcher.parar()
+    assert chamadas == [["o1"], ["o1"]]
+
+    enviados = []
+    dispatcher = DispatcherWhatsApp(
+        transporte=lambda itens: enviados.extend(i["order_id"] for i in itens) or [{"ok": True, "order_id": i["order_id"]} for i in itens],
+        min_segundos_mesmo_numero=60,
+        espera_lote_segundos=0,
+        validade_segundos=0.2,
+    )
+    try:
+        assert dispatcher.enviar("11999999999", "oi", order_id="a").result(timeout=5)["ok"] is True
+        # Mesmo numero: so sairia em 60s, depois do prazo do claim.
+        with pytest.raises(WhatsAppEnvioExpirado):
+            dispatcher.enviar("11999999999", "oi", order_id="b").result(timeout=5)
+    finally:
+        dispatcher.parar()
+    assert enviados == ["a"]
+
+
+def test_dispatcher_bloqueia_enviar_com_fila_cheia():
+    liberar = threading.Event()
+
+    def transporte(itens):
+        liberar.wait(5)
+        return [{"ok": True, "order_id": item["order_id"]} for item in itens]
+
+    dispatcher = DispatcherWhatsApp(transporte=transporte, min_segundos_mesmo_numero=0, espera_lote_segundos=0, lote_max=1, max_pendentes=1)
+    enfileirados = []
+    try:
+        dispatcher.enviar("11999999991", "oi", order_id="em-voo")
+        time.sleep(0.05)
+        dispatcher.enviar("11999999992", "oi", order_id="na-fila")
+        produtor = threading.Thread(
+            target=lambda: enfileirados.append(dispatcher.enviar("11999999993", "oi", order_id="bloqueado"))
+        )
+        produtor.start()
+        produtor.join(0.2)
+        assert produtor.is_alive()
+        assert dispatcher.pendentes() == 1
+
+        liberar.set()
+        produtor.join(5)
+        assert enfileirados[0].result(timeout=5)["ok"] is True
+    finally:
+        dispatcher.parar()
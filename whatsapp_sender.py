@@ -1,10 +1,50 @@
+import heapq
 import os
+import queue
 import re
 import threading
-import requests
+import time
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+
+from obs_dependencias import post_monitorado
 
 WA_SENDER_URL = os.environ.get("WA_SENDER_URL", "").strip()
 WA_SENDER_TOKEN = os.environ.get("WA_SENDER_TOKEN", "").strip()
+WA_SENDER_BATCH_URL = (
+    os.environ.get("WA_SENDER_BATCH_URL", "").strip()
+    or (re.sub(r"/send/?$", "", WA_SENDER_URL) + "/send-batch" if WA_SENDER_URL else "")
+)
+# Espelham as regras do server.js (MIN_SECONDS_BETWEEN_SAME_NUMBER / MAX_AUTH_REQUESTS_PER_MINUTE).
+WA_MIN_SECONDS_BETWEEN_SAME_NUMBER = float(os.environ.get("MIN_SECONDS_BETWEEN_SAME_NUMBER", "60"))
+WA_MAX_REQUESTS_PER_MINUTE = max(20, int(os.environ.get("MAX_AUTH_REQUESTS_PER_MINUTE", "120")))
+WA_MAX_BATCH_MESSAGES = max(1, int(os.environ.get("MAX_BATCH_MESSAGES", "50")))
+
+_batch_suportado = True
+
+
+class WhatsAppRateLimited(RuntimeError):
+    def __init__(self, mensagem, retry_after=None):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+class WhatsAppEnvioExpirado(RuntimeError):
+    pass
+
+
+def _parse_retry_after(valor, padrao=None):
+    valor = (str(valor).strip() if valor is not None else "")
+    if not valor:
+        return padrao
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return padrao
 
 
 def normalizar_telefone_wa(phone):
@@ -34,26 +74,609 @@ def send_whatsapp(phone, message, order_id):
         "order_id": order_id
     }
 
-    response = requests.post(WA_SENDER_URL, json=payload, headers=headers, timeout=20)
+    response = post_monitorado("wa_sender", WA_SENDER_URL, json=payload, headers=headers, timeout=20)
+    if response.status_code == 429:
+        raise WhatsAppRateLimited(
+            "sender limitou o envio (429)",
+            retry_after=_parse_retry_after(response.headers.get("Retry-After"), padrao=WA_MIN_SECONDS_BETWEEN_SAME_NUMBER),
+        )
     response.raise_for_status()
     return True
 
 
-def schedule_whatsapp(phone, message, order_id, delay_minutes, on_success=None, on_failure=None):
-    delay_seconds = max(0, int(delay_minutes or 0) * 60)
+def send_whatsapp_batch(itens):
+    """Envia um lote via /send-batch; cai para /send item a item se o sender nao suportar."""
+    global _batch_suportado
 
-    def _job():
+    if not WA_SENDER_URL or not WA_SENDER_TOKEN:
+        raise RuntimeError("WA_SENDER_URL/WA_SENDER_TOKEN não configurados")
+
+    mensagens = [
+        {
+            "phone": normalizar_telefone_wa(item["phone"]),
+            "message": item["message"],
+            "order_id": item.get("order_id"),
+        }
+        for item in itens
+    ]
+
+    if _batch_suportado and WA_SENDER_BATCH_URL:
+        headers = {
+            "Authorization": f"Bearer {WA_SENDER_TOKEN}",
+            "Content-Type": "application/json"
+        }
+        response = post_monitorado(
+            "wa_sender_batch", WA_SENDER_BATCH_URL, json={"messages": mensagens}, headers=headers, timeout=30
+        )
+        if response.status_code in (404, 405):
+            _batch_suportado = False
+        else:
+            if response.status_code in (429, 503):
+                raise WhatsAppRateLimited(
+                    f"sender indisponivel ({response.status_code})",
+                    retry_after=_parse_retry_after(response.headers.get("Retry-After"), padrao=60),
+                )
+            response.raise_for_status()
+            return (response.json() or {}).get("results") or []
+
+    resultados = []
+    for item in mensagens:
         try:
-            send_whatsapp(phone=phone, message=message, order_id=order_id)
-            print(f"📲 WhatsApp auto enviado ({order_id})", flush=True)
-            if on_success:
-                on_success(order_id)
+            send_whatsapp(item["phone"], item["message"], item["order_id"])
+            resultados.append({"ok": True, "order_id": item["order_id"]})
+        except WhatsAppRateLimited as exc:
+            resultados.append({"ok": False, "order_id": item["order_id"], "error": str(exc), "retry_after": exc.retry_after})
         except Exception as exc:
-            print(f"❌ Falha WhatsApp auto ({order_id}): {exc}", flush=True)
-            if on_failure:
-                on_failure(order_id, str(exc))
-
-    timer = threading.Timer(delay_seconds, _job)
-    timer.daemon = True
-    timer.start()
-    return timer
+            resultados.append({"ok": False, "order_id": item["order_id"], "error": str(exc)})
+    return resultados
+
+
+class TokenBucket:
+    def __init__(self, capacidade, taxa_por_segundo, agora=None):
+        self.capacidade = float(capacidade)
+        self.taxa = float(taxa_por_segundo)
+        self.tokens = float(capacidade)
+        self.atualizado_em = time.monotonic() if agora is None else agora
+
+    def _repor(self, agora):
+        if self.taxa > 0:
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+        self.atualizado_em = agora
+
+    def espera(self, agora):
+        self._repor(agora)
+        if self.tokens >= 1:
+            return 0.0
+        if self.taxa <= 0:
+            return float("inf")
+        return (1 - self.tokens) / self.taxa
+
+    def consumir(self, agora):
+        if self.espera(agora) > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def adiar(self, segundos, agora):
+        # Retry-After do servidor: proximo token so daqui a `segundos`.
+        self.tokens = min(self.tokens, 1.0 - max(0.0, segundos) * self.taxa)
+        self.atualizado_em = agora
+
+
+class DispatcherWhatsApp:
+    """Fila unica de envio com token bucket por numero e global, agrupando em /send-batch.
+
+    enviar() devolve um Future resolvido com o resultado do item (ou a excecao). Com a fila
+    cheia (max_pendentes), enviar() bloqueia quem enfileira; com validade_segundos, um item que
+    nao saiu ate o prazo falha com WhatsAppEnvioExpirado em vez de ser enviado atrasado.
+    """
+
+    def __init__(
+        self,
+        transporte=send_whatsapp_batch,
+        min_segundos_mesmo_numero=WA_MIN_SECONDS_BETWEEN_SAME_NUMBER,
+        max_requisicoes_minuto=WA_MAX_REQUESTS_PER_MINUTE,
+        lote_max=20,
+        espera_lote_segundos=0.05,
+        max_tentativas=3,
+        max_pendentes=1000,
+        validade_segundos=None,
+        nome="whatsapp_dispatcher",
+    ):
+        self.transporte = transporte
+        self.intervalo_numero = max(0.0, float(min_segundos_mesmo_numero or 0))
+        self.lote_max = max(1, min(int(lote_max or 1), WA_MAX_BATCH_MESSAGES))
+        self.espera_lote = max(0.0, float(espera_lote_segundos or 0))
+        self.max_tentativas = max(1, int(max_tentativas or 1))
+        self.max_pendentes = max(1, int(max_pendentes or 1))
+        self.validade = float(validade_segundos) if validade_segundos else None
+        self.nome = nome
+
+        requisicoes = max(1, int(max_requisicoes_minuto or 1))
+        self._bucket_global = TokenBucket(requisicoes, requisicoes / 60.0)
+        self._buckets_numero = {}
+        self._pendentes = []
+        self._em_voo = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._ativo = False
+        self.stats = {"requests": 0, "sent": 0, "failed": 0, "retried": 0, "rate_limited": 0}
+
+    def iniciar(self):
+        with self._cond:
+            if self._ativo:
+                return False
+            self._ativo = True
+        self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+        self._thread.start()
+        return True
+
+    def parar(self, timeout=5):
+        with self._cond:
+            self._ativo = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def pendentes(self):
+        with self._cond:
+            return len(self._pendentes)
+
+    def drenar(self, timeout):
+        """Espera a fila esvaziar ate o prazo, para o loop e devolve o que nao foi enviado.
+
+        Os futures das sobras nao sao resolvidos: quem enfileirou decide como persistir.
+        """
+        limite = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            while self._ativo and (self._pendentes or self._em_voo):
+                espera = limite - time.monotonic()
+                if espera <= 0:
+                    break
+                self._cond.wait(espera)
+            sobras = [
+                {"phone": item["phone"], "message": item["message"], "order_id": item["order_id"]}
+                for item in self._pendentes
+            ]
+            self._pendentes = []
+        self.parar(timeout=max(0.0, limite - time.monotonic()))
+        return sobras
+
+    def enviar(self, phone, message, order_id=None):
+        future = Future()
+        agora = time.monotonic()
+        item = {
+            "phone": normalizar_telefone_wa(phone),
+            "message": message,
+            "order_id": order_id,
+            "future": future,
+            "pronto_em": 0.0,
+            "expira_em": agora + self.validade if self.validade else None,
+            "tentativas": 0,
+        }
+        with self._cond:
+            # Fila cheia: segura quem enfileira (o pool do agendador) em vez de crescer sem limite.
+            while self._ativo and len(self._pendentes) >= self.max_pendentes:
+                espera = None if item["expira_em"] is None else item["expira_em"] - time.monotonic()
+                if espera is not None and espera <= 0:
+                    self.stats["failed"] += 1
+                    future.set_exception(WhatsAppEnvioExpirado("fila do dispatcher cheia ate o prazo do item"))
+                    return future
+                self._cond.wait(espera)
+            self._pendentes.append(item)
+            # notify_all: loop e quem espera vaga na fila dividem a mesma Condition.
+            self._cond.notify_all()
+        self.iniciar()
+        return future
+
+    def _bucket_numero(self, phone, agora):
+        if self.intervalo_numero <= 0:
+            return None
+        bucket = self._buckets_numero.get(phone)
+        if bucket is None:
+            bucket = TokenBucket(1, 1.0 / self.intervalo_numero, agora=agora)
+            self._buckets_numero[phone] = bucket
+        return bucket
+
+    def _limpar_buckets(self, agora):
+        # Bucket cheio equivale a numero nunca visto; descarta para manter a memoria limitada.
+        if len(self._buckets_numero) < 10000:
+            return
+        for phone in [p for p, b in self._buckets_numero.items() if b.espera(agora) == 0]:
+            self._buckets_numero.pop(phone, None)
+
+    def _remover_expirados(self, agora):
+        expirados = [item for item in self._pendentes if item["expira_em"] is not None and item["expira_em"] <= agora]
+        for item in expirados:
+            self._pendentes.remove(item)
+        return expirados
+
+    def _selecionar_lote(self, agora):
+        lote = []
+        numeros = set()
+        proxima = float("inf")
+        for item in self._pendentes:
+            if item["expira_em"] is not None:
+                # Acorda no vencimento para falhar o item antes do claim dele expirar.
+                proxima = min(proxima, item["expira_em"] - agora)
+            if len(lote) >= self.lote_max:
+                continue
+            if item["phone"] in numeros:
+                continue
+            bucket = self._bucket_numero(item["phone"], agora)
+            espera = max(item["pronto_em"] - agora, bucket.espera(agora) if bucket else 0.0)
+            if espera > 0:
+                proxima = min(proxima, espera)
+                continue
+            lote.append(item)
+            numeros.add(item["phone"])
+        return lote, proxima
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._ativo:
+                        return
+                    agora = time.monotonic()
+                    expirados = self._remover_expirados(agora)
+                    if expirados:
+                        lote = []
+                        break
+                    lote, proxima = self._selecionar_lote(agora)
+                    espera_global = self._bucket_global.espera(agora)
+                    if lote and espera_global <= 0:
+                        if len(lote) < self.lote_max and self.espera_lote > 0 and not lote[0].get("aguardou"):
+                            # Janela curta para juntar mais itens no mesmo request.
+                            lote[0]["aguardou"] = True
+                            self._cond.wait(self.espera_lote)
+                            continue
+                        break
+                    espera = espera_global if lote else proxima
+                    self._cond.wait(None if espera == float("inf") else max(0.001, espera))
+
+                if lote:
+                    self._bucket_global.consumir(agora)
+                    for item in lote:
+                        bucket = self._bucket_numero(item["phone"], agora)
+                        if bucket:
+                            bucket.consumir(agora)
+                        self._pendentes.remove(item)
+                    self._limpar_buckets(agora)
+                    self._em_voo += 1
+                # Abriu vaga na fila para quem esta bloqueado em enviar().
+                self._cond.notify_all()
+
+            for item in expirados:
+                self._concluir(item, erro=WhatsAppEnvioExpirado("item expirou na fila antes do envio"))
+            if not lote:
+                continue
+
+            try:
+                self._despachar(lote)
+            finally:
+                with self._cond:
+                    self._em_voo -= 1
+                    self._cond.notify_all()
+
+    def _despachar(self, lote):
+        self.stats["requests"] += 1
+        try:
+            resultados = self.transporte(
+                [{"phone": i["phone"], "message": i["message"], "order_id": i["order_id"]} for i in lote]
+            )
+        except WhatsAppRateLimited as exc:
+            self.stats["rate_limited"] += 1
+            atraso = exc.retry_after if exc.retry_after is not None else 60
+            esgotados = []
+            with self._cond:
+                self._bucket_global.adiar(atraso, time.monotonic())
+                repetir = []
+                for item in lote:
+                    # Recusa do lote inteiro tambem conta tentativa; senao o item volta para sempre.
+                    item["tentativas"] += 1
+                    if item["tentativas"] >= self.max_tentativas:
+                        esgotados.append(item)
+                        continue
+                    item["aguardou"] = False
+                    repetir.append(item)
+                self.stats["retried"] += len(repetir)
+                self._pendentes[:0] = repetir
+                self._cond.notify_all()
+            for item in esgotados:
+                self._concluir(item, erro=exc)
+            return
+        except Exception as exc:
+            for item in lote:
+                self._concluir(item, erro=exc)
+            return
+
+        por_order = {}
+        for indice, resultado in enumerate(resultados or []):
+            chave = resultado.get("order_id") if resultado.get("order_id") is not None else indice
+            por_order[chave] = resultado
+
+        for indice, item in enumerate(lote):
+            resultado = por_order.get(item["order_id"] if item["order_id"] is not None else indice)
+            if resultado is None:
+                self._concluir(item, erro=RuntimeError("sender nao retornou resultado para o item"))
+            elif resultado.get("ok"):
+                self._concluir(item, resultado=resultado)
+            elif resultado.get("retry_after") is not None and item["tentativas"] + 1 < self.max_tentativas:
+                self.stats["retried"] += 1
+                atraso = _parse_retry_after(resultado.get("retry_after"), padrao=self.intervalo_numero)
+                with self._cond:
+                    agora = time.monotonic()
+                    item["tentativas"] += 1
+                    item["pronto_em"] = agora + atraso
+                    item["aguardou"] = False
+                    bucket = self._bucket_numero(item["phone"], agora)
+                    if bucket:
+                        bucket.adiar(atraso, agora)
+                    self._pendentes.append(item)
+                    self._cond.notify_all()
+            else:
+                self._concluir(item, erro=RuntimeError(resultado.get("error") or "falha no envio"))
+
+    def _concluir(self, item, resultado=None, erro=None):
+        if erro is not None:
+            self.stats["failed"] += 1
+            item["future"].set_exception(erro)
+        else:
+            self.stats["sent"] += 1
+            item["future"].set_result(resultado)
+
+
+class StubSenderWhatsApp:
+    """Sender local com as mesmas regras do server.js, para benchmark offline."""
+
+    def __init__(
+        self,
+        min_segundos_mesmo_numero=WA_MIN_SECONDS_BETWEEN_SAME_NUMBER,
+        max_requisicoes_minuto=WA_MAX_REQUESTS_PER_MINUTE,
+        latencia_requisicao=0.02,
+        latencia_mensagem=0.002,
+    ):
+        self.intervalo_numero = float(min_segundos_mesmo_numero)
+        self.max_requisicoes_minuto = max(20, int(max_requisicoes_minuto))
+        self.latencia_requisicao = latencia_requisicao
+        self.latencia_mensagem = latencia_mensagem
+        self._ultimo_envio = {}
+        self._requisicoes = []
+        self._lock = threading.Lock()
+        self.enviados = 0
+        self.recusados = 0
+
+    def _autorizar(self):
+        agora = time.monotonic()
+        with self._lock:
+            self._requisicoes = [ts for ts in self._requisicoes if agora - ts < 60]
+            if len(self._requisicoes) >= self.max_requisicoes_minuto:
+                self.recusados += 1
+                raise WhatsAppRateLimited("rate_limited", retry_after=60 - (agora - self._requisicoes[0]))
+            self._requisicoes.append(agora)
+
+    def _enviar_item(self, item):
+        agora = time.monotonic()
+        with self._lock:
+            ultimo = self._ultimo_envio.get(item["phone"])
+            if ultimo is not None and agora - ultimo < self.intervalo_numero:
+                self.recusados += 1
+                return {
+                    "ok": False,
+                    "order_id": item.get("order_id"),
+                    "error": "aguarde",
+                    "retry_after": self.intervalo_numero - (agora - ultimo),
+                }
+            self._ultimo_envio[item["phone"]] = agora
+            self.enviados += 1
+        time.sleep(self.latencia_mensagem)
+        return {"ok": True, "order_id": item.get("order_id")}
+
+    def __call__(self, itens):
+        self._autorizar()
+        time.sleep(self.latencia_requisicao)
+        return [self._enviar_item(item) for item in itens]
+
+
+
+class AgendadorWhatsApp:
+    """Agendador unico (heap por horario) com pool fixo de envio.
+
+    A fonte de verdade e a tabela whatsapp_auto_dispatches: a memoria guarda so
+    os envios que vencem dentro do horizonte, e o restante e recarregado do banco.
+    """
+
+    def __init__(
+        self,
+        executar,
+        carregar_pendentes=None,
+        senders=2,
+        max_em_memoria=5000,
+        horizonte_segundos=900,
+        intervalo_recarga=60,
+        nome="whatsapp_scheduler",
+    ):
+        self.executar = executar
+        self.carregar_pendentes = carregar_pendentes
+        self.senders = max(1, int(senders or 1))
+        self.max_em_memoria = max(1, int(max_em_memoria or 1))
+        self.horizonte_segundos = max(1, int(horizonte_segundos or 1))
+        self.intervalo_recarga = max(1, int(intervalo_recarga or 1))
+        self.nome = nome
+
+        self._heap = []
+        self._agendados = set()
+        self._cond = threading.Condition()
+        self._fila_envio = queue.Queue(maxsize=self.senders * 4)
+        self._threads = []
+        self._ativo = False
+        self._proxima_recarga = 0.0
+        self.descartados = 0
+
+    @property
+    def ativo(self):
+        return self._ativo
+
+    def pendentes_em_memoria(self):
+        with self._cond:
+            return len(self._heap)
+
+    def iniciar(self):
+        with self._cond:
+            if self._ativo:
+                return False
+            self._ativo = True
+            self._proxima_recarga = 0.0
+
+        self._threads = [threading.Thread(target=self._loop_agendador, name=self.nome, daemon=True)]
+        for indice in range(self.senders):
+            self._threads.append(
+                threading.Thread(target=self._loop_envio, name=f"{self.nome}-sender-{indice}", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+        return True
+
+    def parar(self, timeout=5):
+        with self._cond:
+            if not self._ativo:
+                return
+            self._ativo = False
+            self._cond.notify_all()
+        for _ in range(self.senders):
+            try:
+                self._fila_envio.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def agendar(self, order_id, atraso_segundos=0):
+        """Coloca o envio no heap; fora do horizonte ou com heap cheio fica so no banco."""
+        if not order_id:
+            return False
+        atraso = max(0.0, float(atraso_segundos or 0))
+        if atraso > self.horizonte_segundos:
+            return False
+
+        with self._cond:
+            if order_id in self._agendados:
+                return True
+            if len(self._heap) >= self.max_em_memoria:
+                self.descartados += 1
+                return False
+            vence_em = time.time() + atraso
+            heapq.heappush(self._heap, (vence_em, order_id))
+            self._agendados.add(order_id)
+            if self._heap[0][1] == order_id:
+                self._cond.notify()
+        return True
+
+    def recarregar(self):
+        if not self.carregar_pendentes:
+            return 0
+        livres = self.max_em_memoria - self.pendentes_em_memoria()
+        if livres <= 0:
+            return 0
+        total = 0
+        for order_id, segundos_para_envio in self.carregar_pendentes(self.horizonte_segundos, livres) or []:
+            if self.agendar(order_id, max(0.0, float(segundos_para_envio or 0))):
+                total += 1
+        return total
+
+    def _loop_agendador(self):
+        while True:
+            if time.time() >= self._proxima_recarga:
+                try:
+                    self.recarregar()
+                except Exception as exc:
+                    print(f"❌ Falha ao recarregar agenda WhatsApp: {exc}", flush=True)
+                self._proxima_recarga = time.time() + self.intervalo_recarga
+
+            with self._cond:
+                if not self._ativo:
+                    return
+                agora = time.time()
+                espera = self._proxima_recarga - agora
+                if self._heap:
+                    espera = min(espera, self._heap[0][0] - agora)
+                if espera > 0:
+                    self._cond.wait(espera)
+                    continue
+                if not self._heap:
+                    continue
+                _, order_id = heapq.heappop(self._heap)
+
+            # Espera quando todos os senders estao ocupados (backpressure), mas sem deixar
+            # parar() preso atras da fila cheia: o pedido continua no banco e volta na recarga.
+            while True:
+                try:
+                    self._fila_envio.put(order_id, timeout=0.2)
+                    break
+                except queue.Full:
+                    if not self._ativo:
+                        with self._cond:
+                            self._agendados.discard(order_id)
+                        return
+
+    def _loop_envio(self):
+        while True:
+            order_id = self._fila_envio.get()
+            if order_id is None:
+                return
+            try:
+                self.executar(order_id)
+            except Exception as exc:
+                print(f"❌ Falha WhatsApp auto ({order_id}): {exc}", flush=True)
+            finally:
+                with self._cond:
+                    self._agendados.discard(order_id)
+
+
+def benchmark_dispatcher(total=200, numeros=200, lote_max=20, min_segundos_mesmo_numero=0.5, max_requisicoes_minuto=120):
+    """Mede throughput do dispatcher contra o stub local (sem rede)."""
+    resultados = {}
+    for modo, tamanho_lote in (("unitario", 1), ("lote", lote_max)):
+        stub = StubSenderWhatsApp(
+            min_segundos_mesmo_numero=min_segundos_mesmo_numero,
+            max_requisicoes_minuto=max_requisicoes_minuto,
+        )
+        dispatcher = DispatcherWhatsApp(
+            transporte=stub,
+            min_segundos_mesmo_numero=min_segundos_mesmo_numero,
+            max_requisicoes_minuto=max_requisicoes_minuto,
+            lote_max=tamanho_lote,
+        )
+        inicio = time.monotonic()
+        futures = [
+            dispatcher.enviar(f"55119{indice % numeros:08d}", "mensagem", order_id=f"bench-{indice}")
+            for indice in range(total)
+        ]
+        falhas = 0
+        for future in futures:
+            try:
+                future.result(timeout=600)
+            except Exception:
+                falhas += 1
+        duracao = time.monotonic() - inicio
+        dispatcher.parar()
+        resultados[modo] = {
+            "mensagens": total,
+            "falhas": falhas,
+            "requests": dispatcher.stats["requests"],
+            "recusados_pelo_sender": stub.recusados,
+            "segundos": round(duracao, 3),
+            "msg_por_segundo": round(total / duracao, 1) if duracao else None,
+        }
+    return resultados
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(json.dumps(benchmark_dispatcher(total=total), indent=2))